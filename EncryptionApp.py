@@ -2,20 +2,28 @@
 # inport the necessary libraries (for the UI)
 from PyQt6.QtWidgets import (
     QApplication, QWidget, QLabel, QPushButton, QVBoxLayout,
-    QHBoxLayout, QLineEdit, QTextEdit, QFileDialog, QMessageBox,
-    QTabWidget, QMenuBar
+    QHBoxLayout, QLineEdit, QFileDialog, QMessageBox,
+    QTabWidget, QMenuBar, QProgressBar, QInputDialog, QCheckBox
 )
+from PyQt6.QtCore import QThreadPool
 from PyQt6.QtGui import QIcon # for the icon (if needed)
+from hex_viewer import HexView
+from crypto_jobs import CryptoJob
+from batch_queue import BatchQueue
 
 # import the necessary libraries (for the encryption)
 from Crypto.Cipher import AES
 from Crypto.Random import get_random_bytes
-import random
-from Crypto.Util.Padding import pad, unpad
+from key_generator import printable_key
+from Crypto.Util.Padding import pad
+import file_encryption
+import folder_archive
+from key_derivation import PasswordKey, FileKey
 
 # import the necessary libraries (for the file handling)    
 import sys
 import os
+import time
 
 def int_to_bytes(i:int, size:int=1):
     return i.to_bytes(size, "big")
@@ -28,8 +36,6 @@ class EncryptionApp(QWidget):
     - add more encryption methods (DES, 3DES, etc.)
     - add a light/dark mode
     - add a way to change the key size (128, 192, 256 bits)
-    - add a way to encrypt multiple files at once / folder (compression)
-    - add a way to have how keys (maybe a image.jpg can be a key ? if hashing is used)
     """
     def __init__(self):
         super().__init__()
@@ -37,11 +43,18 @@ class EncryptionApp(QWidget):
         # creating cipghering method table
         self.ciphers_names = {
             AES.MODE_ECB: "ECB",
-            AES.MODE_CBC: "CBC"
+            AES.MODE_CBC: "CBC",
+            file_encryption.MODE_V2: "GCM" # authenticated v2 container
         }
         
         # choosing the default ciphering method
-        self.ciphering_method = AES.MODE_CBC
+        self.ciphering_method = file_encryption.MODE_V2
+
+        # the crypto work runs in a thread pool, several jobs can be queued
+        self.thread_pool = QThreadPool()
+        self.thread_pool.setMaxThreadCount(2)
+        self.jobs = []
+        self.batch_window = None
         
         # initializing the UI components
         self.init_menu()
@@ -78,23 +91,30 @@ class EncryptionApp(QWidget):
         self.key_file_edit = QLineEdit()
         self.key_file_button = QPushButton("Browse")
         self.key_file_button.clicked.connect(lambda: self.browse_file(self.key_file_edit))
+        self.key_file_hash = QCheckBox("Hash the file into the key (any file can be a key, an image for example)")
         self.key_file_verification = QLabel("")
 
         # key text
         self.key_txt_label = QLabel("Key value :")
         self.key_txt_edit = QLineEdit()
         self.key_txt_button = QPushButton("Randomize")
+        self.key_txt_password = QCheckBox("Password (derive the key with scrypt, GCM only)")
         self.key_txt_verification = QLabel("")
 
         # Buttons
         self.encrypt_button = QPushButton(f"Encrypt using {self.ciphers_names[self.ciphering_method]}")
         self.decrypt_button = QPushButton(f"Encrypt using {self.ciphers_names[self.ciphering_method]}")
+
+        # progress of the running jobs
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setRange(0, 100)
+        self.progress_label = QLabel("")
+        self.cancel_button = QPushButton("Cancel")
+        self.cancel_button.setEnabled(False)
         
-        # Hex content display
-        self.input_content = QTextEdit("Content of input file in hex")
-        self.output_content = QTextEdit("Content of output file in hex")
-        self.input_content.setReadOnly(True)
-        self.output_content.setReadOnly(True)
+        # Hex content display, only the visible rows of the files are read
+        self.input_content = HexView("Content of input file in hex")
+        self.output_content = HexView("Content of output file in hex")
         
         # Layout setup
         
@@ -129,6 +149,7 @@ class EncryptionApp(QWidget):
         bot_file_button_layout.addWidget(self.key_file_edit)
         bot_file_button_layout.addWidget(self.key_file_button)
         bot_file_layout.addLayout(bot_file_button_layout)
+        bot_file_layout.addWidget(self.key_file_hash)
         bot_file_layout.addWidget(self.key_file_verification)
 
         ## the second tab is for the text key
@@ -137,6 +158,7 @@ class EncryptionApp(QWidget):
         bot_key_button_layout.addWidget(self.key_txt_edit)
         bot_key_button_layout.addWidget(self.key_txt_button)
         bot_txt_key_layout.addLayout(bot_key_button_layout)
+        bot_txt_key_layout.addWidget(self.key_txt_password)
         bot_txt_key_layout.addWidget(self.key_txt_verification)
     
         # add the 2 tabs to the tab widget
@@ -154,6 +176,12 @@ class EncryptionApp(QWidget):
         button_layout = QHBoxLayout()
         button_layout.addWidget(self.encrypt_button)
         button_layout.addWidget(self.decrypt_button)
+
+        # create the progress layout
+        progress_layout = QHBoxLayout()
+        progress_layout.addWidget(self.progress_bar)
+        progress_layout.addWidget(self.progress_label)
+        progress_layout.addWidget(self.cancel_button)
         
         # create the text layout
         text_layout = QHBoxLayout()
@@ -165,6 +193,7 @@ class EncryptionApp(QWidget):
         main_layout.addWidget(self.menu_bar)
         main_layout.addLayout(file_layout)
         main_layout.addLayout(button_layout)
+        main_layout.addLayout(progress_layout)
         main_layout.addLayout(text_layout)
         
         # set the main layout to the window
@@ -178,33 +207,74 @@ class EncryptionApp(QWidget):
         self.key_file_edit.textChanged.connect(lambda text: self.check_file(text, self.key_file_verification, False, True))
         self.key_txt_edit.textChanged.connect(lambda text: self.check_file(text, self.key_txt_verification, False, False, True))
         self.key_txt_button.clicked.connect(self.randomize_key)
+        self.key_txt_password.toggled.connect(lambda: self.check_file(self.key_txt_edit.text(), self.key_txt_verification, False, False, True))
         
         # connect the buttons to their actions (encrypt and decrypt)
         self.encrypt_button.clicked.connect(self.encrypt_file)
         self.decrypt_button.clicked.connect(self.decrypt_file)
+        self.cancel_button.clicked.connect(self.cancel_jobs)
 
     def init_menu(self):
         """Initialize the menu bar and its items."""
         self.menu_bar = QMenuBar(self)
         self.file_menu = self.menu_bar.addMenu("File")
+        self.file_menu.addAction("Batch encryption...", self.open_batch)
+        self.file_menu.addAction("Encrypt folder (compressed)...", self.archive_folder)
+        self.file_menu.addAction("Extract encrypted archive...", self.extract_archive)
         self.edit_menu = self.menu_bar.addMenu("Edit")
         self.encryption_menu = self.menu_bar.addMenu("Encryption")
+        self.encryption_menu.addAction("set AES GCM (authenticated)", lambda : self.change_cipher(file_encryption.MODE_V2))
         self.encryption_menu.addAction("set AES CBC", lambda : self.change_cipher(AES.MODE_CBC))
         self.encryption_menu.addAction("set AES ECB", lambda : self.change_cipher(AES.MODE_ECB))
 
         self.help_menu = self.menu_bar.addMenu("Help")
         
+    def open_batch(self) -> None:
+        """open the batch window, it uses the key and the mode of this window"""
+        if self.batch_window is None:
+            self.batch_window = BatchQueue(self.read_key, lambda: self.ciphering_method)
+        self.batch_window.show()
+        self.batch_window.raise_()
+
+    def archive_folder(self) -> None:
+        """compress and encrypt a folder into an archive, streamed without temporary file"""
+        self.clear_input()
+        folder = QFileDialog.getExistingDirectory(self, "Select Folder")
+        if not folder:
+            return
+        output_file, _ = QFileDialog.getSaveFileName(self, "Save Archive", folder + ".pfsa")
+        if not output_file:
+            return
+        level, ok = QInputDialog.getInt(self, "Compression", "Compression level (0-9):", 6, 0, 9)
+        if not ok:
+            return
+        key = self.read_key()
+        if key is None:
+            return
+        job = CryptoJob(folder_archive.archive_folder, folder, output_file, key, "zlib", level)
+        self.start_job(job, "Folder archived successfully!", decrypting=False, preview=False)
+
+    def extract_archive(self) -> None:
+        """decrypt and extract an archive made by archive_folder"""
+        self.clear_input()
+        input_file, _ = QFileDialog.getOpenFileName(self, "Select Archive", "", "Encrypted archives (*.pfsa);;All files (*)")
+        if not input_file:
+            return
+        output_folder = QFileDialog.getExistingDirectory(self, "Select Output Folder")
+        if not output_folder:
+            return
+        key = self.read_key(decrypting=True)
+        if key is None:
+            return
+        job = CryptoJob(folder_archive.extract_archive, input_file, output_folder, key)
+        self.start_job(job, "Archive extracted successfully!", decrypting=True, preview=False)
+
     def randomize_key(self) -> None:
         """
         This method generates a random key of 32 bytes and sets it in the key text edit field.
-        The key is generated using random ASCII printable characters, excluding certain characters to avoid issues with quotes and slashes.
+        The key is generated using random ASCII printable characters (key_generator), excluding certain characters to avoid issues with quotes and slashes.
         """
-        output = bytes()
-        while len(output) < 32:
-            r = random.randint(33, 126) # ASCII printable characters
-            if r in [34, 39, 47, 92]: continue
-            else: output += bytes([r])
-        self.key_txt_edit.setText(output.decode('ascii'))
+        self.key_txt_edit.setText(printable_key(32).decode('ascii')) # from the OS CSPRNG
 
     def browse_file(self, line_edit:QLineEdit) -> None:
         """Open a file dialog to select a file and set the selected file path in the line edit."""
@@ -212,85 +282,77 @@ class EncryptionApp(QWidget):
         if file_path:
             line_edit.setText(file_path)
 
-    def encrypt_file(self) -> None:
-        self.clear_input() # clear previous error messages
-        
-        # Get input values
-        input_file = self.input_file_edit.text()
-        output_file = self.output_file_edit.text()
-
+    def read_key(self, decrypting:bool=False) -> bytes:
+        """read the key from the key file or the text key tab, None if the key is invalid (the error is displayed)
+        a password gives a PasswordKey, the AES key is derived in the job with the salt of the file header,
+        a hashed key file gives a FileKey, hashed in the job (and cached)"""
         key_index = self.bot_tab_widget.currentIndex() # we have 2 tabs, key file and text key
-        
         key_file = self.key_file_edit.text()
         key_txt = self.key_txt_edit.text()
 
-        # Check if input file exists
-        if not os.path.exists(input_file): # input file
-            self.input_file_verification.setText("Error : Input file does not exist")
-            self.input_file_verification.setStyleSheet("color: red")
-            return
-        else:
-            with open(input_file, "rb") as f:
-                original_data = f.read()
-        
-        # checking key file or text key
         if key_index == 0: # Key file
             if key_file == "":
-                self.key_file_verification.setText("Error : Key file name is empty, add a name")
+                self.key_file_verification.setText("Error : Key file name is empty" + ("" if decrypting else ", add a name"))
                 self.key_file_verification.setStyleSheet("color: red")
-                return
+                return None
             elif not os.path.exists(key_file):
+                if decrypting:
+                    self.key_file_verification.setText("Error : Key file does not exist")
+                    self.key_file_verification.setStyleSheet("color: red")
+                    return None
                 key = get_random_bytes(32)
                 with open(key_file, "wb") as f:
                     f.write(key)
+                if self.key_file_hash.isChecked():
+                    key = FileKey(key_file)
+            elif self.key_file_hash.isChecked(): # hashed in the job, the file may be big
+                key = FileKey(key_file)
             else:
                 with open(key_file, "rb") as f:
                     key = f.read()
-        elif key_index == 1: # Text key
+        else: # Text key
             if key_txt == "":
-                self.key_txt_verification.setText("Error : Key value is empty, add a value")
+                self.key_txt_verification.setText("Error : Key value is empty" + ("" if decrypting else ", add a value"))
                 self.key_txt_verification.setStyleSheet("color: red")
-                return
+                return None
+            elif self.key_txt_password.isChecked(): # the salt is drawn once, a batch derives the key once
+                key = PasswordKey(key_txt)
             elif len(key_txt) > 32:
                 self.key_txt_verification.setText("Error : Key value is too long, must be 32 bytes max")
                 self.key_txt_verification.setStyleSheet("color: red")
-                return
+                return None
             else:
                 key = key_txt.encode() # convert to bytes
                 if len(key) < 32: # if the key is less than 32 bytes, pad it, otherwise no need to pad
                     key = pad(key, 32)
+        return key
+
+    def encrypt_file(self) -> None:
+        self.clear_input() # clear previous error messages
         
-        # perform encryption
-        iv = get_random_bytes(16) # the iv is generated anyway because we always have IV = [:16] ; data = [16:]
-        if self.ciphering_method == AES.MODE_ECB:
-            cipher = AES.new(key, self.ciphering_method)
-        else:
-            cipher = AES.new(key, self.ciphering_method, iv)
-            
-        ciphertext = cipher.encrypt(pad(original_data, AES.block_size)) #
-        
-        # output the data in hex format
-        if len(original_data) > 500:
-            self.input_content.setPlainText(original_data.hex()[:500])
-            self.output_content.setPlainText(ciphertext.hex()[:500])
-        else:
-            self.input_content.setPlainText(original_data.hex())
-            self.output_content.setPlainText(ciphertext.hex())
+        # Get input values
+        input_file = self.input_file_edit.text()
+        output_file = self.output_file_edit.text()
+
+        # Check if input file exists
+        if not os.path.exists(input_file): # input file
+            self.input_file_verification.setText("Error : Input file does not exist")
+            self.input_file_verification.setStyleSheet("color: red")
+            return
 
         # check if output file exists
         if output_file == "":
             self.output_file_verification.setText("Error : Output file name is empty, add a name")
             self.output_file_verification.setStyleSheet("color: red")
             return
-        
-        # putting at the beginning of the file the method used for encryption
-        method = int_to_bytes(self.ciphering_method, size=1) # 1 => ECB # 2 => CBC 
-    
-        with open(output_file, "wb") as f:
-            f.write(method + iv + ciphertext)
-        
-        self.popup("Encryption completed successfully!")
-        return
+
+        key = self.read_key()
+        if key is None:
+            return
+
+        # the encryption runs in a worker thread, the file is processed by chunks
+        job = CryptoJob(file_encryption.encrypt_file, input_file, output_file, key, self.ciphering_method)
+        self.start_job(job, "Encryption completed successfully!", decrypting=False)
     
     def decrypt_file(self) -> None:
         self.clear_input() # clear previous error messages
@@ -298,99 +360,114 @@ class EncryptionApp(QWidget):
         # Get input values
         input_file = self.input_file_edit.text()
         output_file = self.output_file_edit.text()
-        key_file = self.key_file_edit.text()
-        key_txt = self.key_txt_edit.text()
-    
-        key_index = self.bot_tab_widget.currentIndex() # we have 2 tabs, key file and text key
         
         # Check if input file exists
         if not os.path.exists(input_file):
             self.input_file_verification.setText("Error : Input file does not exist")
             self.input_file_verification.setStyleSheet("color: red")
             return
-        else:
-            with open(input_file, "rb") as f:
-                original_data = f.read()
-                if len(original_data) <= 16: # if less that 16 bytes, not encrypted by us
-                    self.input_file_verification.setText("Error Decrypting, are you sure about the input ?")
-                    self.input_file_verification.setStyleSheet("color: red")
-                    return
-                
-                method = original_data[0] # the first byte is the method used for encryption
-                
-                # check if the method is valid
-                if method != self.ciphering_method:
-                    self.input_file_verification.setText("encryption modes are not matching, changing modes...")
-                    self.input_file_verification.setStyleSheet("color: orange")
-                    if method in self.ciphers_names:
-                        self.change_cipher(method) # change the ciphering method to the one used for encryption
-                    else: return
-                original_data = original_data[1:] # remove the first byte
-                
-                iv = original_data[:16] # the first 16 bytes are the IV (even if we use ECB, we need to remove it)
-                original_data = original_data[16:] # get the rest of the data
-        
-        # checking key file or text key
-        if key_index == 0: # Key file
-            if key_file == "":
-                self.key_file_verification.setText("Error : Key file name is empty")
-                self.key_file_verification.setStyleSheet("color: red")
-                return
-            if not os.path.exists(key_file):
-                self.key_file_verification.setText("Error : Key file does not exist")
-                self.key_file_verification.setStyleSheet("color: red")
-                return
-            else:
-                with open(key_file, "rb") as f:
-                    key = f.read()
-        elif key_index == 1: # Text key
-            if key_txt == "":
-                self.key_txt_verification.setText("Error : Key value is empty")
-                self.key_txt_verification.setStyleSheet("color: red")
-                return
-            elif len(key_txt) > 32:
-                self.key_txt_verification.setText("Error : Key value is too long, must be 32 bytes max")
-                self.key_txt_verification.setStyleSheet("color: red")
-                return
-            else:
-                key = key_txt.encode()
-                if len(key) < 32:
-                    key = pad(key, 32)
-    
-        # perform decryption
-        try: # try to decrypt the file
-            if self.ciphering_method == AES.MODE_ECB:
-                cipher = AES.new(key, self.ciphering_method)
-            else:
-                cipher = AES.new(key, self.ciphering_method, iv)
-                
-            cleartext = cipher.decrypt(original_data)
-            cleartext = unpad(cleartext, AES.block_size)
-        except: # if the decryption fails, it means the key is wrong or the input file is not encrypted by us
-            self.input_file_verification.setText("Error decrypting, wrong input or key")
+
+        method = file_encryption.read_mode(input_file) # the first byte is the method used for encryption
+        if method is None: # if less that 17 bytes, not encrypted by us
+            self.input_file_verification.setText("Error Decrypting, are you sure about the input ?")
             self.input_file_verification.setStyleSheet("color: red")
             return
-        
-        # output the data in hex format
-        if len(original_data) > 500:
-            self.input_content.setPlainText(original_data.hex()[:500])
-            self.output_content.setPlainText(cleartext.hex()[:500])
-        else:
-            self.input_content.setPlainText(original_data.hex())
-            self.output_content.setPlainText(cleartext.hex())
+
+        # check if the method is valid
+        if method != self.ciphering_method:
+            self.input_file_verification.setText("encryption modes are not matching, changing modes...")
+            self.input_file_verification.setStyleSheet("color: orange")
+            if method in self.ciphers_names:
+                self.change_cipher(method) # change the ciphering method to the one used for encryption
+            else: return
 
         if output_file == "":
-            self.output_file_verification.setText("Decryption successful but no output file provided")
-            self.output_file_verification.setStyleSheet("color: orange")
+            self.output_file_verification.setText("Error : Output file name is empty, add a name")
+            self.output_file_verification.setStyleSheet("color: red")
             return
 
-        # writing the decrypted data to the output file
-        with open(output_file, "wb") as f:
-            f.write(cleartext)
-        
-        self.popup("Decryption completed successfully!")
-        self.clear_input()
-        return
+        key = self.read_key(decrypting=True)
+        if key is None:
+            return
+
+        job = CryptoJob(file_encryption.decrypt_file, input_file, output_file, key)
+        self.start_job(job, "Decryption completed successfully!", decrypting=True)
+
+    def start_job(self, job, message:str, decrypting:bool, preview:bool=True) -> None:
+        """queue a job on the thread pool, the UI stays responsive while it runs
+        preview is False for folder jobs, their input or output can't be shown in the hex views"""
+        input_file, output_file = job.args[0], job.args[1]
+        for view in (self.input_content, self.output_content): # a mapped file must not be rewritten
+            if view.viewer.path is not None and os.path.abspath(view.viewer.path) == os.path.abspath(output_file):
+                view.close_file()
+
+        key = job.args[2]
+        def finished():
+            if isinstance(key, (PasswordKey, FileKey)): # report the cost of the key derivation
+                label = self.key_file_verification if isinstance(key, FileKey) else self.key_txt_verification
+                label.setText(f"Key derived in {key.derivation_time:.3f}s" + (" (cached)" if key.derivation_time < 0.01 else ""))
+                label.setStyleSheet("color: green")
+            # the hex views skip the header of the encrypted file
+            if not preview:
+                pass
+            elif decrypting:
+                self.show_preview(input_file, output_file, input_offset=file_encryption.data_offset(input_file))
+            else:
+                self.show_preview(input_file, output_file, output_offset=file_encryption.data_offset(output_file))
+            self.popup(message)
+
+        def failed(error:str):
+            self.input_file_verification.setText(f"Error processing {os.path.basename(input_file)}: {error}")
+            self.input_file_verification.setStyleSheet("color: red")
+
+        def cancelled():
+            self.input_file_verification.setText(f"{os.path.basename(input_file)} cancelled, partial output removed")
+            self.input_file_verification.setStyleSheet("color: orange")
+
+        job.signals.progress.connect(self.update_progress)
+        job.signals.finished.connect(finished)
+        job.signals.failed.connect(failed)
+        job.signals.cancelled.connect(cancelled)
+        for signal in (job.signals.finished, job.signals.failed, job.signals.cancelled):
+            signal.connect(lambda *_, job=job: self.job_done(job))
+
+        self.jobs.append(job)
+        self.cancel_button.setEnabled(True)
+        self.update_progress()
+        self.thread_pool.start(job)
+
+    def job_done(self, job) -> None:
+        """remove a finished, failed or cancelled job from the active jobs"""
+        if job in self.jobs:
+            self.jobs.remove(job)
+        self.cancel_button.setEnabled(bool(self.jobs))
+        self.update_progress()
+
+    def cancel_jobs(self) -> None:
+        """cancel the running and queued jobs, their partial output is removed"""
+        for job in self.jobs:
+            job.cancel()
+
+    def update_progress(self, *_) -> None:
+        """update the progress bar, the throughput and the ETA of the active jobs"""
+        if not self.jobs:
+            self.progress_bar.setValue(0)
+            self.progress_label.setText("")
+            return
+        done = sum(job.done for job in self.jobs)
+        total = sum(job.total for job in self.jobs) or 1
+        self.progress_bar.setValue(int(100 * done / total))
+
+        started = [job.started_at for job in self.jobs if job.started_at is not None]
+        elapsed = time.perf_counter() - min(started) if started else 0
+        speed = done / elapsed if elapsed > 0 else 0
+        eta = f"{(total - done) / speed:.0f}s" if speed > 0 else "?"
+        self.progress_label.setText(f"{len(self.jobs)} job(s) - {speed / 1e6:.1f} MB/s - ETA {eta}")
+
+    def show_preview(self, input_file:str, output_file:str, input_offset:int=0, output_offset:int=0) -> None:
+        """display the input and output data in hex format, the offsets skip the file headers"""
+        self.input_content.open_file(input_file, input_offset)
+        self.output_content.open_file(output_file, output_offset)
 
     def check_file(self, file_path:str, verification_label:QLabel, is_output:bool=False, is_key_file:bool=False, is_key_txt:bool=False) -> None:
         """method to check if the file exists and update the verification label accordingly."""
@@ -399,6 +476,10 @@ class EncryptionApp(QWidget):
                 verification_label.setText("Key file name is empty, add a name")
                 verification_label.setStyleSheet("color: red")
                 return
+            elif self.key_txt_password.isChecked(): # any length, the key is derived from it
+                verification_label.setText("Password, the key will be derived with scrypt")
+                verification_label.setStyleSheet("color: green")
+                return
             else:
                 if len(file_path) > 32: # key file name is too long
                     verification_label.setText("Key is too long, must be 32 bytes max")
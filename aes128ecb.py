@@ -3,7 +3,10 @@ from colorama import Fore, Style
 import os
 from Crypto.Cipher import AES
 from Crypto.Util.Padding import pad, unpad
-from random import randint
+from inplace_encryption import transform_in_place
+from key_derivation import PasswordKey, KDF_PARAMS, ALGORITHMS
+from key_generator import printable_key
+import profiling
 
 """
 Command line interface for the AES ECB encryption/decryption algorithm
@@ -15,16 +18,24 @@ python aes128ecb.py -i "text to cipher" -K "key" -o "output file name" -e
 python aes128ecb.py -i input_file.txt -K key.key -d
 python aes128ecb.py -i "0x5468697320697320612074657374" -K "0x546869732069732061206b6579" -o "output_file.bin" -d
 
+python aes128ecb.py -i disk.img -K key.key -e --in-place
+
 To encode as file be sure to provide the file extension in the -i option
 To encode as hexadecimal be sure to provide the 0x prefix in the -i option
 To encode as binary be sure to provide the 0b prefix in the -i option
 Else the input will be treated as a string (ascii encoding)
 
 This also works for the key input
+
+--kdf scrypt (or pbkdf2) treats -K as a password: the key is derived with a calibrated
+KDF and the salt + parameters are written before the ciphertext (read back with -d --kdf)
+
+--in-place encrypts a file directly in itself (no output file, no copy in memory),
+the file size must be a multiple of 16 bytes since the data isn't padded
 """
 
 def encrypt_aes_ecb(data: bytes, key: bytes,) -> bytes:
-    """Encrypt the data with the key using the AES ECB mode
+    r"""Encrypt the data with the key using the AES ECB mode
     Block size is 128 bits (16 bytes)
     The key and the data are padded in the process
 
@@ -49,7 +60,7 @@ def encrypt_aes_ecb(data: bytes, key: bytes,) -> bytes:
     return ciphertext
 
 def decrypt_aes_ecb(data: bytes, key: bytes) -> bytes:
-    """Decrypt the data with the key using the AES ECB mode
+    r"""Decrypt the data with the key using the AES ECB mode
     Block size is 128 bits (16 bytes)
     The key & data are padded in the process
     Args:
@@ -68,13 +79,76 @@ def decrypt_aes_ecb(data: bytes, key: bytes) -> bytes:
     original_data = unpad(decrypted_data, AES.block_size)# Unpad the decrypted data 
     return original_data
 
+def read_buffer(path: str, extra: int = 0) -> bytearray:
+    """Read a file with readinto into a preallocated buffer
+    extra free bytes are left at the end (room for the padding)
+
+    Args:
+        path (str): file to read
+        extra (int): free bytes after the file content
+
+    Returns:
+        bytearray: file content + extra bytes
+    """
+    size = os.path.getsize(path)
+    buffer = bytearray(size + extra)
+    with open(path, "rb") as file:
+        file.readinto(memoryview(buffer)[:size])
+    return buffer
+
+def encrypt_aes_ecb_buffer(buffer: bytearray, length: int, key: bytes) -> memoryview:
+    """Encrypt in place the first length bytes of buffer, the padding is written after them
+    The buffer needs AES.block_size free bytes after the data (read_buffer(path, AES.block_size))
+
+    Args:
+        buffer (bytearray): data followed by free bytes
+        length (int): size of the data
+        key (bytes): Key to use for encryption
+
+    Returns:
+        memoryview: Encrypted data, a view of buffer (no copy)
+
+    The peak memory stays about the size of the file:
+
+    >>> import tempfile, tracemalloc
+    >>> path = os.path.join(tempfile.mkdtemp(), "data.bin")
+    >>> with open(path, "wb") as file: _ = file.write(os.urandom(4 * 1024 * 1024))
+    >>> tracemalloc.start()
+    >>> buffer = read_buffer(path, AES.block_size)
+    >>> encrypted = encrypt_aes_ecb_buffer(buffer, os.path.getsize(path), b"key")
+    >>> decrypted = decrypt_aes_ecb_buffer(encrypted, b"key")
+    >>> tracemalloc.get_traced_memory()[1] < 1.1 * 4 * 1024 * 1024
+    True
+    >>> tracemalloc.stop()
+    >>> bytes(decrypted) == open(path, "rb").read()
+    True
+    """
+    padding = AES.block_size - length % AES.block_size
+    view = memoryview(buffer)[:length + padding]
+    view[length:] = bytes([padding]) * padding # PKCS#7 padding, like pad()
+    cipher = AES.new(pad(key, AES.block_size), AES.MODE_ECB)
+    cipher.encrypt(view, output=view)
+    return view
+
+def decrypt_aes_ecb_buffer(buffer, key: bytes) -> memoryview:
+    """Decrypt buffer in place and remove the padding
+
+    Args:
+        buffer (bytearray | memoryview): encrypted data
+        key (bytes): Key to use for decryption
+
+    Returns:
+        memoryview: Decrypted data, a view of buffer (no copy)
+    """
+    view = memoryview(buffer)
+    cipher = AES.new(pad(key, AES.block_size), AES.MODE_ECB)
+    cipher.decrypt(view, output=view)
+    last_block = unpad(bytes(view[-AES.block_size:]), AES.block_size) # only the last block is unpadded
+    return view[:len(view) - AES.block_size + len(last_block)]
+
 def keyGenerator(n:int) -> bytes:
-    output = bytes()
-    while len(output) < n:
-        r = randint(33, 126) # 33 => ! , 126 => ~
-        if r in [34, 39, 47, 92]: continue # Skip " " ' / \
-        else: output += bytes([r])
-    return output
+    """random printable key of n characters (without " ' / \\), from the OS CSPRNG"""
+    return printable_key(n)
 
 def check_encoding(data: str) -> bytes:
     if data[:2] == "0x" and set(data[2:]) <= set("0123456789abcdef"): # Hexadecimal input detected
@@ -99,14 +173,17 @@ def main():
     argument_parser.add_argument("-o", type=str, help="Output file name")
     argument_parser.add_argument("-e", action="store_true", help="Encode")
     argument_parser.add_argument("-d", action="store_true", help="Decode")
+    argument_parser.add_argument("--kdf", type=str, choices=list(ALGORITHMS), help="Derive the key from the -K password (scrypt or pbkdf2)")
+    argument_parser.add_argument("--in-place", action="store_true", help="Encrypt/decrypt the -i file in itself (size multiple of 16 bytes)")
+    profiling.add_arguments(argument_parser)
     
     args = argument_parser.parse_args()
+    profiling.start(args)
     
     #### Check the arguments
     if not args.i: # Check if the input is provided
         error("You must provide a text to cipher with the -i option")
-    if not args.o:
-        args.print_only = True
+    args.print_only = not args.o
         
     if not args.e and not args.d:
         error("You must provide an action: -e for encoding and -d for decoding")
@@ -119,13 +196,35 @@ def main():
     if args.d and not args.K: 
         error("You must provide a key with the -K option")
     
+    if args.in_place and args.kdf:
+        error("--kdf can't be used with --in-place, the file has no room for the salt")
+    if args.in_place: # the file is transformed in itself, no input is read in memory
+        if not os.path.isfile(args.i):
+            error("--in-place needs an existing file with the -i option")
+        if not args.K:
+            error("You must provide a key with the -K option")
+        if str(args.K).split(".")[-1] in ["txt", "bin", "key"] and os.path.exists(args.K):
+            with open(args.K, "rb") as file:
+                key = file.read()
+        else:
+            key = check_encoding(args.K)
+        padded_key = pad(key[:AES.block_size], AES.block_size) # same key as encrypt_aes_ecb
+        try:
+            with profiling.phase("transform", hot=True):
+                transform_in_place(args.i, padded_key, "ecb", decrypt=args.d)
+        except ValueError as e:
+            error(str(e))
+        indicator(f"{args.i} {'decrypted' if args.d else 'encrypted'} in place")
+        return
+
     #### Check if the input is a file or just a string
-    if str(args.i).split(".")[-1] == ["txt", "bin"]: 
+    file_input = str(args.i).split(".")[-1] in ["txt", "bin"]
+    if file_input:
         indicator("file input detected...")
         if not os.path.exists(args.i): 
             error("The file does not exist")
-        with open(args.i, "rb") as file:
-            text = file.read()
+        with profiling.phase("load input"):
+            text = read_buffer(args.i, AES.block_size if args.e else 0) # room for the padding, encrypted in place
     else:
         text = check_encoding(args.i)
         
@@ -133,28 +232,47 @@ def main():
         indicator("Key file input detected...")
         if not os.path.exists(args.K):
             error("The file does not exist")
-        with open(args.K, "rb") as file:
+        with profiling.phase("load key"), open(args.K, "rb") as file:
             args.K = file.read()
     else:
         args.K = check_encoding(args.K)
     
-    if len(args.K) > AES.block_size:
+    kdf_header = b"" # written before the ciphertext
+    if args.kdf: # the password isn't the key, the key is derived with the parameters of the header
+        password_key = PasswordKey(args.K, args.kdf, key_size=AES.block_size)
+        if args.e:
+            kdf_header = params = password_key.extension
+        else:
+            params = bytes(text[:KDF_PARAMS.size])
+            text = memoryview(text)[KDF_PARAMS.size:] if file_input else text[KDF_PARAMS.size:]
+        try:
+            with profiling.phase("derive key"):
+                args.K = password_key.derive(params)
+        except ValueError as e:
+            error(f"Invalid key derivation header: {e}")
+        indicator(f"Key derived in {password_key.derivation_time:.2f}s")
+    elif len(args.K) > AES.block_size:
         args.K = args.K[:AES.block_size]
     
     # Process the text
-    if args.e: output = encrypt_aes_ecb(text, args.K)
-    else:      output = decrypt_aes_ecb(text, args.K)
+    with profiling.phase("transform", hot=True):
+        if file_input: # the file buffer is processed in place, output is a view of it
+            if args.e: output = encrypt_aes_ecb_buffer(text, len(text) - AES.block_size, args.K)
+            else:      output = decrypt_aes_ecb_buffer(text, args.K)
+        elif args.e: output = encrypt_aes_ecb(text, args.K)
+        else:        output = decrypt_aes_ecb(text, args.K)
     
     # Print or save the output
     if args.print_only:
         print("Output:")
-        print(output.hex())
+        print(kdf_header.hex() + output.hex())
         try:
-            print(output.decode('ascii'))
+            print(bytes(output).decode('ascii'))
         except:
             pass
     else:
-        with open(args.o, "wb") as file:
+        with profiling.phase("write output"), open(args.o, "wb") as file:
+            file.write(kdf_header) # empty without --kdf
             file.write(output)
             
 if __name__ == "__main__":
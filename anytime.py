@@ -0,0 +1,465 @@
+from cipher_classifier import ENGLISH, COMMON_BIGRAMS, classify
+from colorama import Fore, Style
+import numpy as np
+import functools
+import argparse
+import math
+import profiling
+import time
+import re
+import os
+
+"""
+Deadline-bounded ("anytime") cracking: the best candidate so far within a time budget
+
+The crackers of the toolset run to completion, a service calling them can't
+bound its latency. crack() takes a time budget (and/or a cancelled() callable,
+like the jobs of file_encryption.py) and returns the best candidate found
+before it runs out, with a score and a confidence estimate. Each improvement
+is passed to on_candidate as soon as it is found, a UI shows a plausible answer
+within a few ms and refines it.
+
+Each family is cracked in stages, from the cheapest estimate to the best one:
+
+- caesar: the shift whose letters are closest to english (chi-squared) on a
+  2000 characters prefix, then a 64k prefix, then the whole text. With a
+  dictionary, the shifts are then scored by their dictionary words (from the
+  most likely shift by frequency)
+- mono: the key mapping the letters by frequency rank, on the same growing
+  prefixes. With a word-pattern index (word_patterns.py) the word search then
+  refines it, every better solution of the search is a candidate (the letters
+  it didn't fix are mapped by frequency)
+- poly: the period of the classifier, then the best period of the Kasiski
+  examination (kasiski.py) of the 64k prefix, each column text[i::period]
+  mapped by frequency rank on the growing prefixes
+
+The dictionary stage is skipped (complete is False) when the dictionary is
+not loaded yet and its load, estimated from the file size, would overrun the
+budget; a process cracking many texts (the daemon, warmed with --dictionary)
+keeps it loaded.
+The pattern index is memory mapped, it opens in constant time.
+
+The larger prefix is skipped when the time of the previous one predicts it
+would overrun the budget. The counts cover the whole prefix, the confidence is
+measured on its first CONFIDENCE_SAMPLE characters. The first stage always runs
+(a few ms), so there is
+always a candidate. Without a family the classifier picks it (plain texts are
+returned as is, transposition and unknown samples have no candidate).
+
+Candidate: family, method (frequency, dictionary, word_patterns, or classifier
+for a plain text), key (shift,
+key alphabet in the format of mono_alphabet_cipher.py, or key alphabets of
+poly_alphabet_cipher.py), score (-chi-squared per letter to english for the
+frequency methods, share of the words or letters found for the dictionary
+methods, None for a text without letters), confidence (0 to 1: share of the words or letters found in the
+dictionary, or the share of common english bigrams between 0 for a wrong key
+and 1 for english), preview (decoded start of the text) and elapsed seconds.
+The result adds the decoded text and complete (False if the budget cut a stage).
+
+Usage:
+
+python anytime.py -i ciphertext.txt --print-only
+python anytime.py -i "wkh fdw dqg wkh grj" -w words_dictionary.json --watch --print-only
+python anytime.py -i ciphertext.txt -x words.pat --budget 2 --watch -o output.txt
+"""
+
+alphabet = 'abcdefghijklmnopqrstuvwxyz'
+BUDGET = 0.1 # seconds
+SAMPLES = (2000, 64000) # prefixes of the first stages, then the whole text
+CLASSIFY_SAMPLE = 8000 # characters classified when the family is not given
+WORD_SAMPLE = 4000 # characters scored with the dictionary or searched with the pattern index
+CONFIDENCE_SAMPLE = 16000 # decoded characters of a prefix scored by plausibility()
+PREVIEW = 200 # decoded characters of each candidate
+MAX_PERIOD = 20
+DICTIONARY_LOAD_RATE = 20e6 # bytes of JSON dictionary parsed per second, to predict a cold load
+# share of the common english bigrams between two letters (calibrated on english texts of 20 to 2000 words)
+RANDOM_BIGRAMS = 0.04 # median of the texts decoded with a wrong key
+ENGLISH_BIGRAMS = 0.38 # lowest tenth of the english texts
+FAMILIES = ("caesar", "mono", "poly")
+_ENGLISH = ENGLISH.tolist()
+
+def error(message: str) -> None:
+    print(Fore.RED + Style.BRIGHT + message + Style.RESET_ALL)
+    os._exit(1)
+
+def indicator(message: str) -> None:
+    print(Fore.GREEN + message + Style.RESET_ALL)
+
+class Deadline:
+    """Time budget and cancellation of a crack
+
+    Args:
+        budget (float): seconds, None for no limit
+        cancelled (callable): returns True when the caller cancels (user, closed connection...)
+    """
+    def __init__(self, budget: float = None, cancelled=None):
+        self.started = time.monotonic()
+        self.end = None if budget is None else self.started + budget
+        self.cancelled = cancelled
+
+    def expired(self) -> bool:
+        if self.cancelled is not None and self.cancelled():
+            return True
+        return self.end is not None and time.monotonic() >= self.end
+
+    def remaining(self) -> float:
+        return float("inf") if self.end is None else self.end - time.monotonic()
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+def load_dictionary_within(deadline: Deadline, path: str):
+    """words of a JSON dictionary (operations.load_dictionary), None if loading it would overrun the deadline
+
+    A dictionary this process already loaded is in the cache of operations.py, a cold load is
+    estimated from the file size (the parsing holds the GIL, a thread can't cut it short).
+    """
+    import operations
+    if deadline.expired():
+        return None
+    if not operations.dictionary_loaded(path) and os.path.getsize(path) / DICTIONARY_LOAD_RATE > deadline.remaining():
+        return None
+    return operations.load_dictionary(path)
+
+#### Scores
+
+def letter_counts(text: str) -> list[int]:
+    """count of each letter, a to z
+
+    >>> letter_counts("Hello")[7], letter_counts("Hello")[11]
+    (1, 2)
+    """
+    data = np.frombuffer(text.lower().encode("ascii", "ignore"), dtype=np.uint8)
+    return np.bincount(data, minlength=256)[97:123].tolist()
+
+def distance(counts: list[int]) -> float:
+    """chi-squared per letter of letter counts to the english frequencies"""
+    total = sum(counts)
+    if not total:
+        return float("inf")
+    return sum((count - total * p) ** 2 / (total * p) for count, p in zip(counts, _ENGLISH)) / total
+
+def plausibility(text: str) -> float:
+    """0 for a text decoded with a wrong key, 1 for english: share of the common english bigrams between letters
+
+    >>> plausibility("it was the best of times it was the worst of times"), plausibility("qb jhd lwt utdl")
+    (1.0, 0.0)
+    """
+    text = text.lower()
+    pairs = sum(len(word) - 1 for word in re.findall(f"[{alphabet}]+", text))
+    if pairs <= 0:
+        return 0.0
+    share = sum(text.count(bigram) for bigram in COMMON_BIGRAMS) / pairs
+    return round(min(1.0, max(0.0, (share - RANDOM_BIGRAMS) / (ENGLISH_BIGRAMS - RANDOM_BIGRAMS))), 3)
+
+def _score(counts: list[int], key: str) -> float:
+    """score of the frequency methods: -distance of the letters decoded with a key"""
+    return -round(distance([counts[alphabet.index(cipher)] for cipher in key]), 4)
+
+def _confidence(sample: str, decode) -> float:
+    return plausibility(decode(_prefix(sample, CONFIDENCE_SAMPLE)))
+
+#### Keys
+
+def frequency_key(counts: list[int]) -> str:
+    """mono-alphabet key mapping the cipher letters to the english letters of the same frequency rank"""
+    plain_order = sorted(range(26), key=lambda i: -_ENGLISH[i])
+    cipher_order = sorted(range(26), key=lambda i: (-counts[i], i))
+    key = [""] * 26
+    for plain, cipher in zip(plain_order, cipher_order):
+        key[plain] = alphabet[cipher]
+    return "".join(key)
+
+def complete_key(partial: str, counts: list[int], unknown: str = "_") -> str:
+    """fill the unknown letters of a partial key by frequency rank
+
+    >>> complete_key("bcdefghijklmnopqrstuvwxyz_", [0] * 26)
+    'bcdefghijklmnopqrstuvwxyza'
+    """
+    free_plain = sorted((i for i, letter in enumerate(partial) if letter == unknown), key=lambda i: -_ENGLISH[i])
+    used = set(partial)
+    free_cipher = sorted((i for i, letter in enumerate(alphabet) if letter not in used), key=lambda i: (-counts[i], i))
+    key = list(partial)
+    for plain, cipher in zip(free_plain, free_cipher):
+        key[plain] = alphabet[cipher]
+    return "".join(key)
+
+def shift_key(shift: int) -> str:
+    return alphabet[shift:] + alphabet[:shift]
+
+def decode_mono(text: str, key: str) -> str:
+    """decode with a key alphabet (the cipher letter of a, b, c...), the other characters are kept
+
+    >>> decode_mono("Khoor, zruog", shift_key(3))
+    'hello, world'
+    """
+    return text.lower().translate(str.maketrans(key, alphabet))
+
+def decode_poly(text: str, keys: list[str]) -> str:
+    """decode with the key alphabets of poly_alphabet_cipher.py (every character counts for the key)"""
+    lower = text.lower()
+    characters = list(lower)
+    for i, key in enumerate(keys):
+        characters[i::len(keys)] = lower[i::len(keys)].translate(str.maketrans(key, alphabet))
+    return "".join(characters)
+
+def column_counts(text: str, period: int) -> list[list[int]]:
+    """letter counts of each column text[i::period]"""
+    lower = text.lower()
+    return [letter_counts(lower[i::period]) for i in range(period)]
+
+#### Stages
+
+def _prefix(text: str, size: int) -> str:
+    """the first size characters of a text, cut after a word when possible"""
+    if len(text) <= size:
+        return text
+    cut = text.rfind(" ", 0, size)
+    return text[:cut] if cut > size // 2 else text[:size]
+
+class _Prefixes:
+    """growing prefixes of a text, then the text: the next one is skipped when the times of the previous
+    ones predict it would overrun the deadline (the first one is always given)"""
+    def __init__(self, text: str, deadline: Deadline):
+        self.text = text
+        self.deadline = deadline
+        self.done = 0 # characters of the last prefix processed
+
+    def __iter__(self):
+        timings = [] # (characters, seconds) of the prefixes processed
+        for size in SAMPLES + (len(self.text),):
+            sample = _prefix(self.text, size)
+            if len(sample) <= self.done:
+                continue
+            if timings and self._predict(timings, len(sample)) > self.deadline.remaining():
+                return
+            start = time.monotonic()
+            yield sample # the caller processes it before the next one
+            timings.append((len(sample), time.monotonic() - start))
+            self.done = len(sample)
+            if self.deadline.expired():
+                return
+
+    @staticmethod
+    def _predict(timings: list, characters: int) -> float:
+        """seconds to process a prefix: proportional to the last one, or a fixed cost (the confidence
+        sample, the key) and a cost per character fitted on the last two
+
+        >>> round(_Prefixes._predict([(1000, 0.002)], 10000), 3), round(_Prefixes._predict([(1000, 0.002), (11000, 0.003)], 101000), 3)
+        (0.02, 0.012)
+        """
+        if len(timings) == 1:
+            return timings[0][1] / timings[0][0] * characters
+        (small, small_seconds), (large, large_seconds) = timings[-2:]
+        per_character = max(0.0, (large_seconds - small_seconds) / (large - small))
+        return large_seconds + per_character * (characters - large)
+
+    @property
+    def whole(self) -> bool:
+        """the whole text was processed"""
+        return self.done == len(self.text)
+
+class _Best:
+    """best candidate of a crack, each improvement is passed to the callback"""
+    def __init__(self, family: str, text: str, deadline: Deadline, on_candidate=None):
+        self.family = family
+        self.text = text
+        self.deadline = deadline
+        self.on_candidate = on_candidate
+        self.candidate = None
+        self.improvements = 0
+        self._decode = None
+
+    def offer(self, method: str, key, score: float, confidence: float, decode, supersede: bool = False) -> None:
+        """a candidate replaces the best one if it is more confident or better informed (supersede)
+
+        decode is the function decoding a text with the key
+        """
+        if score is not None and not math.isfinite(score): # no letter to score, JSON has no NaN or Infinity
+            score = None
+        best = self.candidate
+        if best is not None and not supersede and confidence <= best["confidence"]:
+            return
+        if best is not None and key == best["key"]: # the same answer, better estimated
+            best.update(method=method, score=score, confidence=confidence)
+            return
+        self.candidate = {"family": self.family, "method": method, "key": key, "score": score, "confidence": confidence,
+                          "preview": decode(_prefix(self.text, PREVIEW)), "elapsed": round(self.deadline.elapsed(), 4)}
+        self._decode = decode
+        self.improvements += 1
+        if self.on_candidate is not None:
+            self.on_candidate(dict(self.candidate))
+
+    def result(self, complete: bool) -> dict:
+        """the best candidate with the decoded text"""
+        if self.candidate is None:
+            result = {"family": self.family, "method": None, "key": None, "score": None, "confidence": 0.0,
+                      "preview": None, "text": None}
+        else:
+            result = dict(self.candidate, text=self._decode(self.text))
+        return result | {"elapsed": round(self.deadline.elapsed(), 4), "complete": complete, "improvements": self.improvements}
+
+def crack_caesar(text: str, deadline: Deadline, best: _Best, dictionary: str = None) -> bool:
+    """caesar stages, returns False if the deadline cut them"""
+    prefixes = _Prefixes(text, deadline)
+    distances = [0.0] * 26 # an empty text has no prefix
+    for sample in prefixes:
+        counts = letter_counts(sample)
+        distances = [distance(counts[shift:] + counts[:shift]) for shift in range(26)]
+        shift = min(range(26), key=distances.__getitem__)
+        decode = functools.partial(decode_mono, key=shift_key(shift))
+        best.offer("frequency", shift, -round(distances[shift], 4), _confidence(sample, decode), decode, supersede=True)
+    if dictionary is None:
+        return prefixes.whole
+    import operations
+    words = load_dictionary_within(deadline, dictionary)
+    if words is None: # a cold load would overrun the budget
+        return False
+    sample = _prefix(text, WORD_SAMPLE)
+    for shift in sorted(range(26), key=distances.__getitem__):
+        if deadline.expired():
+            return False
+        decode = functools.partial(decode_mono, key=shift_key(shift))
+        found = re.findall(f"[{alphabet}]+", decode(sample))
+        matched = sum(word in words for word in found)
+        best.offer("dictionary", shift, matched, round(matched / len(found), 3) if found else 0.0, decode)
+    return prefixes.whole
+
+def crack_mono(text: str, deadline: Deadline, best: _Best, index: str = None) -> bool:
+    """mono-alphabet stages, returns False if the deadline cut them"""
+    prefixes = _Prefixes(text, deadline)
+    counts = letter_counts("") # an empty text has no prefix
+    for sample in prefixes:
+        counts = letter_counts(sample)
+        key = frequency_key(counts)
+        decode = functools.partial(decode_mono, key=key)
+        best.offer("frequency", key, _score(counts, key), _confidence(sample, decode), decode, supersede=True)
+    if index is None:
+        return prefixes.whole
+    import operations, word_patterns
+
+    def improved(partial, coverage):
+        key = complete_key(partial, counts)
+        best.offer("word_patterns", key, coverage, coverage, functools.partial(decode_mono, key=key))
+    result = word_patterns.solve(_prefix(text, WORD_SAMPLE), operations.load_pattern_index(index),
+                                 cancelled=deadline.expired, on_improve=improved)
+    return prefixes.whole and result["complete"]
+
+def crack_poly(text: str, deadline: Deadline, best: _Best, max_period: int = MAX_PERIOD, period: int = None) -> bool:
+    """poly-alphabet stages, returns False if the deadline cut them
+
+    The period is the one of the classifier (period) on the first prefix, then the best one of the
+    Kasiski ranking up to the 64k prefix, the larger prefixes only refine the keys.
+    """
+    import kasiski
+    prefixes = _Prefixes(text, deadline)
+    for sample in prefixes:
+        if len(sample) <= SAMPLES[-1] and (period is None or prefixes.done):
+            period = kasiski.rank_periods(sample, max_period)[0]["period"]
+        columns = column_counts(sample, period)
+        keys = [frequency_key(counts) for counts in columns]
+        decode = functools.partial(decode_poly, keys=keys)
+        score = round(sum(_score(counts, key) * sum(counts) for counts, key in zip(columns, keys)) / max(1, sum(map(sum, columns))), 4)
+        best.offer("frequency", keys, score, _confidence(sample, decode), decode, supersede=True)
+    return prefixes.whole
+
+#### Driver
+
+def crack(text: str, budget: float = BUDGET, cancelled=None, on_candidate=None, family: str = None,
+          dictionary: str = None, index: str = None, max_period: int = MAX_PERIOD) -> dict:
+    """Best candidate for a ciphertext within a time budget
+
+    Args:
+        budget (float): seconds, None to run every stage
+        cancelled (callable): returns True to stop now (checked between the steps of every stage)
+        on_candidate (callable): called with each better candidate as soon as it is found
+        family (str): caesar, mono or poly, classified when None
+        dictionary (str): JSON dictionary scoring the caesar shifts
+        index (str): word-pattern index refining the mono keys (word_patterns.py)
+
+    Returns:
+        dict: the best candidate with the decoded text, complete and improvements (see the module docstring)
+
+    Raises:
+        ValueError: if the family is unknown
+
+    >>> import caesar
+    >>> text = caesar.encode_caesar_cipher("it was the best of times it was the worst of times " * 3, 7)
+    >>> result = crack(text)
+    >>> result["family"], result["key"], result["text"][:27], result["complete"]
+    ('caesar', 7, 'it was the best of times it', True)
+    """
+    deadline = Deadline(budget, cancelled)
+    period = None
+    if family is None:
+        result = classify([_prefix(text, CLASSIFY_SAMPLE)], max_period)[0]
+        family, period = result["label"], result.get("period")
+    elif family not in FAMILIES:
+        raise ValueError(f"Unknown family {family}, use {', '.join(FAMILIES)}")
+    best = _Best(family, text, deadline, on_candidate)
+    if family == "caesar":
+        complete = crack_caesar(text, deadline, best, dictionary)
+    elif family == "mono":
+        complete = crack_mono(text, deadline, best, index)
+    elif family == "poly":
+        complete = crack_poly(text, deadline, best, max_period, period)
+    elif family == "plain":
+        best.offer("classifier", None, -round(distance(letter_counts(text)), 4), _confidence(text, str.lower), str.lower)
+        complete = True
+    else: # transposition or unknown: no cracker
+        complete = True
+    return best.result(complete)
+
+def main():
+    argument_parser = argparse.ArgumentParser(description="Best candidate of the crackers within a time budget")
+    argument_parser.add_argument("-i", type=str, help="Ciphertext (or a .txt file)")
+    argument_parser.add_argument("-o", type=str, help="Output file")
+    argument_parser.add_argument("--budget", type=float, default=BUDGET, help="Seconds, 0 runs every stage")
+    argument_parser.add_argument("--family", choices=FAMILIES, help="Cipher family, classified by default")
+    argument_parser.add_argument("-w", type=str, help="JSON dictionary scoring the caesar shifts")
+    argument_parser.add_argument("-x", type=str, help="Word-pattern index refining the mono keys (word_patterns.py --build)")
+    argument_parser.add_argument("--max-period", type=int, default=MAX_PERIOD, help="Largest poly-alphabet period tried")
+    argument_parser.add_argument("--watch", action="store_true", help="Print every better candidate as it is found")
+    argument_parser.add_argument("--print-only", action="store_true", help="Print the output only")
+    profiling.add_arguments(argument_parser)
+
+    args = argument_parser.parse_args()
+    profiling.start(args)
+
+    if not args.i:
+        error("You must provide a ciphertext with the -i option")
+    if not args.o and not args.print_only:
+        error("You must provide an output file name with the -o option")
+    if args.budget < 0:
+        error("The budget can't be negative")
+    for path in (args.w, args.x):
+        if path and not os.path.exists(path):
+            error(f"{path} does not exist")
+    if str(args.i).split(".")[-1] == "txt":
+        if not os.path.exists(args.i):
+            error("The file does not exist")
+        with profiling.phase("load input"), open(args.i, "r", encoding='UTF-8') as file:
+            text = file.read()
+    else:
+        text = args.i
+
+    def watch(candidate):
+        preview = candidate["preview"][:60].replace("\n", " ")
+        print(f"{candidate['elapsed'] * 1000:8.1f} ms  {candidate['method']:<13} confidence {candidate['confidence']:.2f}  {preview}")
+    with profiling.phase("transform", hot=True):
+        result = crack(text, args.budget or None, on_candidate=watch if args.watch else None, family=args.family,
+                       dictionary=args.w, index=args.x, max_period=args.max_period)
+
+    if result["text"] is None:
+        error(f"Classified as {result['family']}, the toolset has no cracker for it (--family picks one)")
+    indicator(f"{result['family']} ({result['method']}), confidence {result['confidence']:.2f}, "
+              f"{result['elapsed'] * 1000:.1f} ms{'' if result['complete'] else ', stopped at the budget'}")
+    print(f"key: {result['key']}")
+    if args.print_only:
+        print(result["text"])
+    else:
+        with profiling.phase("write output"), open(args.o, "w") as file:
+            file.write(result["text"])
+
+if __name__ == "__main__":
+    main()
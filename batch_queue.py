@@ -0,0 +1,255 @@
+# encoding: utf-8
+from PyQt6.QtWidgets import (
+    QWidget, QLabel, QPushButton, QVBoxLayout, QHBoxLayout, QLineEdit,
+    QFileDialog, QTableWidget, QTableWidgetItem, QHeaderView, QSpinBox
+)
+from PyQt6.QtCore import QThreadPool
+from crypto_jobs import CryptoJob
+from collections import Counter
+import file_encryption
+import os
+import time
+
+"""
+Batch window of EncryptionApp
+
+Files and folders are dropped (or added) in a queue and encrypted or decrypted
+concurrently on a bounded thread pool. The key is read once for the whole batch
+and the output paths mirror the source tree in the output folder.
+"""
+
+ENCRYPTED_SUFFIX = ".enc"
+
+class BatchQueue(QWidget):
+    """queue of files to encrypt or decrypt with one key
+
+    Args:
+        read_key (callable): read_key(decrypting) returns the key or None if it is invalid
+        get_mode (callable): returns the AES mode used for encryption
+    """
+    def __init__(self, read_key, get_mode, parent=None):
+        super().__init__(parent)
+        self.read_key = read_key
+        self.get_mode = get_mode
+        self.entries = [] # (source file, root), the output path is the path relative to root
+        self.jobs = {} # row => CryptoJob
+        self.started_at = None
+        self.finished_bytes = 0 # bytes processed by the finished jobs of the batch
+        self.thread_pool = QThreadPool()
+        self.thread_pool.setMaxThreadCount(min(8, os.cpu_count() or 1))
+
+        self.setWindowTitle("Batch encryption")
+        self.setAcceptDrops(True)
+        self.init_ui()
+
+    def init_ui(self):
+        """Initialize the user interface components."""
+        self.table = QTableWidget(0, 3)
+        self.table.setHorizontalHeaderLabels(["File", "Size", "Status"])
+        self.table.horizontalHeader().setSectionResizeMode(0, QHeaderView.ResizeMode.Stretch)
+
+        self.add_files_button = QPushButton("Add files")
+        self.add_folder_button = QPushButton("Add folder")
+        self.clear_button = QPushButton("Clear")
+        self.add_files_button.clicked.connect(self.browse_files)
+        self.add_folder_button.clicked.connect(self.browse_folder)
+        self.clear_button.clicked.connect(self.clear)
+
+        self.output_dir_label = QLabel("Output folder:")
+        self.output_dir_edit = QLineEdit()
+        self.output_dir_button = QPushButton("Browse")
+        self.output_dir_button.clicked.connect(self.browse_output_dir)
+
+        self.workers_label = QLabel("Workers:")
+        self.workers_spin = QSpinBox()
+        self.workers_spin.setRange(1, 64)
+        self.workers_spin.setValue(self.thread_pool.maxThreadCount())
+        self.workers_spin.valueChanged.connect(self.thread_pool.setMaxThreadCount)
+
+        self.encrypt_button = QPushButton("Encrypt all")
+        self.decrypt_button = QPushButton("Decrypt all")
+        self.cancel_button = QPushButton("Cancel")
+        self.cancel_button.setEnabled(False)
+        self.encrypt_button.clicked.connect(lambda: self.start(decrypting=False))
+        self.decrypt_button.clicked.connect(lambda: self.start(decrypting=True))
+        self.cancel_button.clicked.connect(self.cancel)
+
+        self.status_label = QLabel("Drop files or folders here")
+
+        add_layout = QHBoxLayout()
+        add_layout.addWidget(self.add_files_button)
+        add_layout.addWidget(self.add_folder_button)
+        add_layout.addWidget(self.clear_button)
+
+        output_layout = QHBoxLayout()
+        output_layout.addWidget(self.output_dir_label)
+        output_layout.addWidget(self.output_dir_edit)
+        output_layout.addWidget(self.output_dir_button)
+        output_layout.addWidget(self.workers_label)
+        output_layout.addWidget(self.workers_spin)
+
+        button_layout = QHBoxLayout()
+        button_layout.addWidget(self.encrypt_button)
+        button_layout.addWidget(self.decrypt_button)
+        button_layout.addWidget(self.cancel_button)
+
+        main_layout = QVBoxLayout()
+        main_layout.addLayout(add_layout)
+        main_layout.addWidget(self.table)
+        main_layout.addLayout(output_layout)
+        main_layout.addLayout(button_layout)
+        main_layout.addWidget(self.status_label)
+        self.setLayout(main_layout)
+
+    def dragEnterEvent(self, event) -> None:
+        if event.mimeData().hasUrls():
+            event.acceptProposedAction()
+
+    def dropEvent(self, event) -> None:
+        for url in event.mimeData().urls():
+            if url.isLocalFile():
+                self.add_path(url.toLocalFile())
+
+    def browse_files(self) -> None:
+        files, _ = QFileDialog.getOpenFileNames(self, "Select Files")
+        for file_path in files:
+            self.add_path(file_path)
+
+    def browse_folder(self) -> None:
+        folder = QFileDialog.getExistingDirectory(self, "Select Folder")
+        if folder:
+            self.add_path(folder)
+
+    def browse_output_dir(self) -> None:
+        folder = QFileDialog.getExistingDirectory(self, "Select Output Folder")
+        if folder:
+            self.output_dir_edit.setText(folder)
+
+    def add_path(self, path:str) -> None:
+        """add a file, or every file of a folder, to the queue"""
+        path = os.path.abspath(path).rstrip(os.sep)
+        root = os.path.dirname(path) # a folder keeps its name in the output folder
+        if os.path.isfile(path):
+            files = [path]
+        else:
+            files = sorted(os.path.join(folder, name) for folder, _, names in os.walk(path) for name in names)
+        queued = {source for source, _ in self.entries}
+        skipped = [] # broken links, sockets, files removed meanwhile or unreadable
+        for file_path in files:
+            if file_path in queued:
+                continue
+            try:
+                if not os.path.isfile(file_path):
+                    raise OSError("not a regular file")
+                size = os.path.getsize(file_path)
+            except OSError:
+                skipped.append(os.path.relpath(file_path, root))
+                continue
+            self.entries.append((file_path, root))
+            row = self.table.rowCount()
+            self.table.insertRow(row)
+            self.table.setItem(row, 0, QTableWidgetItem(os.path.relpath(file_path, root)))
+            self.table.setItem(row, 1, QTableWidgetItem(f"{size}"))
+            self.table.setItem(row, 2, QTableWidgetItem("queued"))
+        status = f"{len(self.entries)} files in the queue"
+        if skipped:
+            status += f", {len(skipped)} skipped (not a regular file or unreadable): {', '.join(skipped[:3])}{'...' if len(skipped) > 3 else ''}"
+        self.status_label.setText(status)
+
+    def clear(self) -> None:
+        if self.jobs:
+            return
+        self.entries = []
+        self.table.setRowCount(0)
+        self.status_label.setText("Drop files or folders here")
+
+    def output_path(self, source:str, root:str, decrypting:bool) -> str:
+        """output path of a file, mirroring its path relative to root in the output folder"""
+        relative = os.path.relpath(source, root)
+        if decrypting:
+            if relative.endswith(ENCRYPTED_SUFFIX):
+                relative = relative[:-len(ENCRYPTED_SUFFIX)]
+        else:
+            relative += ENCRYPTED_SUFFIX
+        return os.path.join(self.output_dir_edit.text(), relative)
+
+    def set_status(self, row:int, status:str) -> None:
+        self.table.item(row, 2).setText(status)
+
+    def start(self, decrypting:bool) -> None:
+        """queue a job per file on the thread pool, the key is read once for the whole batch"""
+        if self.jobs:
+            self.status_label.setText("A batch is already running")
+            return
+        if not self.entries:
+            self.status_label.setText("The queue is empty")
+            return
+        if self.output_dir_edit.text() == "":
+            self.status_label.setText("Error : Output folder is empty, add a folder")
+            return
+        key = self.read_key(decrypting)
+        if key is None:
+            self.status_label.setText("Error : invalid key, check the key of the main window")
+            return
+        mode = self.get_mode()
+
+        self.started_at = time.perf_counter()
+        self.finished_bytes = 0
+        # the jobs run at the same time: two entries writing the same output, or an output
+        # overwriting another queued source, would clobber (and on failure remove) each other's file
+        outputs = [self.output_path(source, root, decrypting) for source, root in self.entries]
+        resolved = [os.path.normcase(os.path.realpath(output)) for output in outputs]
+        sources = {os.path.normcase(os.path.realpath(source)) for source, _ in self.entries}
+        writers = Counter(resolved)
+        for row, (source, root) in enumerate(self.entries):
+            output = outputs[row]
+            if resolved[row] == os.path.normcase(os.path.realpath(source)):
+                self.set_status(row, "skipped, output is the input")
+                continue
+            if writers[resolved[row]] > 1:
+                self.set_status(row, "skipped, another queued file has the same output")
+                continue
+            if resolved[row] in sources:
+                self.set_status(row, "skipped, output is another queued file")
+                continue
+            os.makedirs(os.path.dirname(output), exist_ok=True)
+            if decrypting:
+                job = CryptoJob(file_encryption.decrypt_file, source, output, key)
+            else:
+                job = CryptoJob(file_encryption.encrypt_file, source, output, key, mode)
+            job.signals.progress.connect(lambda done, total, row=row: self.job_progress(row, done, total))
+            job.signals.finished.connect(lambda row=row: self.job_done(row, "done"))
+            job.signals.failed.connect(lambda error, row=row: self.job_done(row, f"failed, {error}"))
+            job.signals.cancelled.connect(lambda row=row: self.job_done(row, "cancelled"))
+            self.jobs[row] = job
+            self.set_status(row, "queued")
+            self.thread_pool.start(job)
+        self.cancel_button.setEnabled(bool(self.jobs))
+        self.update_status()
+
+    def job_progress(self, row:int, done:int, total:int) -> None:
+        self.set_status(row, f"running {100 * done // max(total, 1)}%")
+        self.update_status()
+
+    def job_done(self, row:int, status:str) -> None:
+        self.set_status(row, status)
+        job = self.jobs.pop(row, None)
+        if job is not None:
+            self.finished_bytes += job.done
+        self.cancel_button.setEnabled(bool(self.jobs))
+        self.update_status()
+
+    def cancel(self) -> None:
+        """cancel the running and queued jobs, their partial output is removed"""
+        for job in self.jobs.values():
+            job.cancel()
+
+    def update_status(self) -> None:
+        """display the number of remaining files and the total throughput of the batch"""
+        if self.started_at is None:
+            return
+        done = self.finished_bytes + sum(job.done for job in self.jobs.values())
+        elapsed = time.perf_counter() - self.started_at
+        speed = done / elapsed if elapsed > 0 else 0
+        state = f"{len(self.jobs)} files remaining" if self.jobs else "batch finished"
+        self.status_label.setText(f"{state} - {done / 1e6:.1f} MB in {elapsed:.1f}s - {speed / 1e6:.1f} MB/s")
@@ -0,0 +1,357 @@
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, ALL_COMPLETED, wait
+from colorama import Fore, Style
+import multiprocessing
+import operations
+import argparse
+import json
+import time
+import sys
+import os
+
+"""
+Batch runner of JSONL jobs over all the operations of the toolset
+
+Each input line is a job {"id": ..., "op": "caesar.encode", "params": {...}}
+(the operations and their parameters are listed in operations.py). Each output
+line is {"line": n, "id": ..., "ok": true, "result": {...}} or
+{"line": n, "id": ..., "ok": false, "error": "..."}, n is the input line number.
+
+The jobs of one operation are grouped in batches sent to a process pool, a
+small job costs a fraction of a pickled batch instead of a round trip to a
+worker. The results are written in the input order (default) or as they
+complete (--unordered, no reorder buffer).
+
+A checkpoint (<output>.checkpoint) is written every few seconds: the output is
+flushed to disk first, then the checkpoint records its size, the first input
+line not yet done and the lines done after it. An interrupted run started
+again with the same arguments truncates the output to that size and skips the
+jobs already done. At the end, the throughput of each operation is printed.
+
+Usage:
+
+python batch_runner.py -i jobs.jsonl -o results.jsonl
+python batch_runner.py -i jobs.jsonl -o results.jsonl -w 8 --batch-size 256 --unordered
+python batch_runner.py -i jobs.jsonl -o results.jsonl --metrics metrics.json
+"""
+
+BATCH_SIZE = 64 # jobs of one operation sent to a worker at once
+CHECKPOINT_INTERVAL = 5.0 # seconds between two checkpoints
+CHECKPOINT_VERSION = 1
+
+def error(message: str) -> None:
+    print(Fore.RED + Style.BRIGHT + message + Style.RESET_ALL)
+    os._exit(1)
+
+def indicator(message: str) -> None:
+    print(Fore.GREEN + message + Style.RESET_ALL, file=sys.stderr)
+
+def run_jobs(op: str, jobs: list[dict]) -> tuple:
+    """Run a batch of jobs of one operation (in a worker process)
+
+    Returns:
+        tuple: (responses, seconds spent), a response is {"ok": True, "result": ...} or {"ok": False, "error": ...}
+    """
+    start = time.perf_counter()
+    responses = []
+    for params in jobs:
+        try:
+            responses.append({"ok": True, "result": operations.run(op, params)})
+        except Exception as e:
+            responses.append({"ok": False, "error": operations.error_message(e)})
+    return responses, time.perf_counter() - start
+
+def _input_fingerprint(path: str) -> list:
+    stat = os.stat(path)
+    return [os.path.realpath(path), stat.st_size, stat.st_mtime_ns]
+
+def load_checkpoint(path: str, input_path: str, ordered: bool) -> dict:
+    """Checkpoint of an interrupted run, None if there is none
+
+    Raises:
+        ValueError: if the checkpoint belongs to another input or mode
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as file:
+        checkpoint = json.load(file)
+    if checkpoint.get("version") != CHECKPOINT_VERSION or checkpoint["input"] != _input_fingerprint(input_path):
+        raise ValueError("The checkpoint belongs to another input file (or the input changed), remove it to start over")
+    if checkpoint["ordered"] != ordered:
+        raise ValueError("The checkpoint was made with another order mode")
+    return checkpoint
+
+def _write_checkpoint(path: str, checkpoint: dict) -> None:
+    """atomically replace the checkpoint"""
+    temporary = path + ".tmp"
+    with open(temporary, "w") as file:
+        json.dump(checkpoint, file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary, path)
+
+class BatchRunner:
+    """Run a JSONL file of jobs into a JSONL file of results, resumable
+
+    Args:
+        input_path (str): JSONL jobs
+        output_path (str): JSONL results
+        workers (int): processes of the pool, 0 runs the jobs in this process
+        batch_size (int): jobs of one operation sent to a worker at once
+        ordered (bool): write the results in the input order, else as they complete
+        checkpoint_path (str): checkpoint file, <output>.checkpoint if None
+        checkpoint_interval (float): seconds between two checkpoints
+        dictionaries (list[str]): JSON dictionaries loaded at start by the workers
+    """
+    def __init__(self, input_path: str, output_path: str, workers: int = None, batch_size: int = BATCH_SIZE,
+                 ordered: bool = True, checkpoint_path: str = None, checkpoint_interval: float = CHECKPOINT_INTERVAL,
+                 dictionaries: list[str] = ()):
+        self.input_path = input_path
+        self.output_path = output_path
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.batch_size = batch_size
+        self.ordered = ordered
+        self.checkpoint_path = checkpoint_path or output_path + ".checkpoint"
+        self.checkpoint_interval = checkpoint_interval
+        self.dictionaries = [os.path.abspath(path) for path in dictionaries]
+        self.max_batches = max(1, self.workers) * 4 # batches submitted and not collected, bounds the memory
+        self.metrics = {} # op => {"jobs", "errors", "seconds"}
+
+    #### Results
+
+    def _complete(self, line: int, response: dict) -> None:
+        """a job is done (response None for the lines without a job)"""
+        if response is not None:
+            self.jobs_done += 1
+            if not response["ok"]:
+                self.errors += 1
+        if self.ordered:
+            self.ready[line] = response
+            while self.watermark in self.ready: # write the results that are next in the input order
+                self._write(self.watermark, self.ready.pop(self.watermark))
+                self._advance()
+        else:
+            self._write(line, response)
+            self.done_above.add(line)
+            while self.watermark in self.done_above:
+                self.done_above.remove(self.watermark)
+                self._advance()
+
+    def _advance(self) -> None:
+        self.offsets.pop(self.watermark, None)
+        self.watermark += 1
+
+    def _write(self, line: int, response: dict) -> None:
+        if response is not None:
+            record = {"line": line + 1, "id": self.ids.pop(line, None), **response}
+            self.output.write(json.dumps(record).encode() + b"\n")
+        else:
+            self.ids.pop(line, None)
+
+    #### Batches
+
+    def _submit(self, op: str) -> None:
+        """send the buffered jobs of an operation as one batch"""
+        jobs = self.buffers.pop(op)
+        lines = [line for line, _ in jobs]
+        params = [params for _, params in jobs]
+        if self.pool is None:
+            self._collect(op, lines, run_jobs(op, params))
+        else:
+            future = self.pool.submit(run_jobs, op, params)
+            self.in_flight[future] = (op, lines)
+
+    def _collect(self, op: str, lines: list[int], outcome: tuple) -> None:
+        responses, seconds = outcome
+        metrics = self.metrics.setdefault(op, {"jobs": 0, "errors": 0, "seconds": 0.0})
+        metrics["jobs"] += len(responses)
+        metrics["errors"] += sum(not response["ok"] for response in responses)
+        metrics["seconds"] += seconds
+        for line, response in zip(lines, responses):
+            self._complete(line, response)
+
+    def _wait(self, all_done: bool = False) -> None:
+        """collect the finished batches, wait for at least one (or all of them)"""
+        if not self.in_flight:
+            return
+        finished, _ = wait(list(self.in_flight), return_when=ALL_COMPLETED if all_done else FIRST_COMPLETED)
+        for future in finished:
+            op, lines = self.in_flight.pop(future)
+            try:
+                outcome = future.result()
+            except Exception as e: # the worker died, the whole batch failed
+                outcome = ([{"ok": False, "error": operations.error_message(e)}] * len(lines), 0.0)
+            self._collect(op, lines, outcome)
+
+    #### Checkpoints
+
+    def _checkpoint(self, read_offset: int, lines_read: int) -> None:
+        self.output.flush()
+        os.fsync(self.output.fileno()) # the results are on disk before the checkpoint counts them
+        _write_checkpoint(self.checkpoint_path, {
+            "version": CHECKPOINT_VERSION,
+            "input": _input_fingerprint(self.input_path),
+            "ordered": self.ordered,
+            "output_offset": self.output.tell(),
+            "line": self.watermark, # first line not done
+            "input_offset": self.offsets.get(self.watermark, read_offset) if self.watermark < lines_read else read_offset,
+            "done": sorted(self.done_above | self.skip), # lines done after it (--unordered)
+        })
+        self.last_checkpoint = time.perf_counter()
+
+    #### Run
+
+    def _read(self, offset: int, line: int):
+        """(line number, offset after the line, content) of the input lines from an offset"""
+        with open(self.input_path, "rb") as file:
+            file.seek(offset)
+            for content in file:
+                offset += len(content)
+                yield line, offset, content
+                line += 1
+
+    def run(self, progress=None) -> dict:
+        """Run every job not done yet
+
+        Args:
+            progress (callable): called with (jobs done, seconds) at each checkpoint
+
+        Raises:
+            ValueError: if the checkpoint belongs to another input
+
+        Returns:
+            dict: metrics of the run (jobs, errors, seconds, jobs_per_second, resumed_from, operations)
+        """
+        checkpoint = load_checkpoint(self.checkpoint_path, self.input_path, self.ordered)
+        start_line, start_offset, output_offset = 0, 0, 0
+        self.skip = set() # lines done by the interrupted run, not read yet
+        if checkpoint is not None: # resume, the results after the checkpoint are written again
+            start_line, start_offset = checkpoint["line"], checkpoint["input_offset"]
+            output_offset = checkpoint["output_offset"]
+            self.skip = set(checkpoint["done"])
+        self.done_above = set()
+        self.watermark = start_line
+        self.ready, self.offsets, self.ids = {}, {}, {}
+        self.buffers, self.in_flight = {}, {}
+        self.jobs_done = self.errors = 0
+        started = self.last_checkpoint = time.perf_counter()
+
+        mode = "r+b" if checkpoint is not None and os.path.exists(self.output_path) else "wb"
+        self.pool = None
+        if self.workers > 0:
+            self.pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"),
+                                            initializer=operations.warm, initargs=(self.dictionaries,))
+        try:
+            with open(self.output_path, mode) as self.output:
+                self.output.truncate(output_offset)
+                self.output.seek(output_offset)
+                read_offset, lines_read = start_offset, start_line
+                for line, read_offset, content in self._read(start_offset, start_line):
+                    lines_read = line + 1
+                    self.offsets[line] = read_offset - len(content)
+                    if line in self.skip:
+                        self.skip.remove(line)
+                        self._complete(line, None) # its result is already in the output
+                        continue
+                    self._add(line, content)
+                    if len(self.in_flight) >= self.max_batches:
+                        self._wait()
+                    if time.perf_counter() - self.last_checkpoint >= self.checkpoint_interval:
+                        self._checkpoint(read_offset, lines_read)
+                        if progress is not None:
+                            progress(self.jobs_done, time.perf_counter() - started)
+                for op in list(self.buffers):
+                    self._submit(op)
+                self._wait(all_done=True)
+                self.output.flush()
+        finally:
+            if self.pool is not None:
+                self.pool.shutdown(cancel_futures=True)
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+
+        seconds = time.perf_counter() - started
+        return {"jobs": self.jobs_done, "errors": self.errors, "seconds": round(seconds, 3),
+                "jobs_per_second": round(self.jobs_done / seconds, 1) if seconds else None,
+                "resumed_from": start_line + 1 if checkpoint is not None else None,
+                "operations": {op: {**metrics, "seconds": round(metrics["seconds"], 3),
+                                    "jobs_per_second": round(metrics["jobs"] / metrics["seconds"], 1) if metrics["seconds"] else None}
+                               for op, metrics in sorted(self.metrics.items())}}
+
+    def _add(self, line: int, content: bytes) -> None:
+        """parse a job line and buffer it with the jobs of its operation"""
+        if not content.strip():
+            self._complete(line, None)
+            return
+        try:
+            job = json.loads(content)
+            if not isinstance(job, dict):
+                raise ValueError("A job is a JSON object")
+            self.ids[line] = job.get("id")
+            op, params = job.get("op"), job.get("params") or {}
+            if not isinstance(params, dict):
+                raise ValueError("params must be a JSON object")
+            operations.kind(op, params) # unknown operation
+        except ValueError as e: # json.JSONDecodeError is a ValueError
+            self._complete(line, {"ok": False, "error": str(e)})
+            return
+        self.buffers.setdefault(op, []).append((line, params))
+        if len(self.buffers[op]) >= self.batch_size:
+            self._submit(op)
+        elif self.ordered:
+            # a rare operation must not hold back the output: its jobs are sent once the input moved on
+            for other, jobs in list(self.buffers.items()):
+                if line - jobs[0][0] >= self.batch_size * self.max_batches:
+                    self._submit(other)
+
+def format_metrics(metrics: dict) -> str:
+    lines = [f"{'operation':<24} {'jobs':>9} {'errors':>7} {'cpu (s)':>9} {'jobs/s':>10}"]
+    for op, values in metrics["operations"].items():
+        rate = f"{values['jobs_per_second']:10.1f}" if values["jobs_per_second"] else f"{'-':>10}"
+        lines.append(f"{op:<24} {values['jobs']:>9} {values['errors']:>7} {values['seconds']:9.3f} {rate}")
+    lines.append(f"{metrics['jobs']} jobs ({metrics['errors']} errors) in {metrics['seconds']:.2f}s, "
+                 f"{metrics['jobs_per_second'] or 0:.1f} jobs/s")
+    if metrics["resumed_from"] is not None:
+        lines.append(f"resumed from line {metrics['resumed_from']}")
+    return "\n".join(lines)
+
+def main():
+    argument_parser = argparse.ArgumentParser(description="JSONL batch runner of the toolset operations")
+    argument_parser.add_argument("-i", type=str, help="JSONL file of jobs")
+    argument_parser.add_argument("-o", type=str, help="JSONL file of results")
+    argument_parser.add_argument("-w", "--workers", type=int, help="Worker processes (0: run in this process)")
+    argument_parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Jobs of one operation sent to a worker at once")
+    argument_parser.add_argument("--unordered", action="store_true", help="Write the results as they complete")
+    argument_parser.add_argument("--checkpoint", type=str, help="Checkpoint file (default: <output>.checkpoint)")
+    argument_parser.add_argument("--checkpoint-interval", type=float, default=CHECKPOINT_INTERVAL, help="Seconds between two checkpoints")
+    argument_parser.add_argument("--dictionary", nargs="+", default=[], help="JSON dictionaries loaded at start by the workers")
+    argument_parser.add_argument("--metrics", type=str, help="Save the metrics of the run as JSON")
+    argument_parser.add_argument("--list", action="store_true", help="List the operations and exit")
+
+    args = argument_parser.parse_args()
+
+    if args.list:
+        for op in operations.OPERATIONS:
+            print(op)
+        return
+    if not args.i or not os.path.isfile(args.i):
+        error("You must provide an existing JSONL file of jobs with the -i option")
+    if not args.o:
+        error("You must provide an output file with the -o option")
+    if args.batch_size < 1 or (args.workers is not None and args.workers < 0):
+        error("The batch size must be positive and the number of workers not negative")
+
+    runner = BatchRunner(args.i, args.o, args.workers, args.batch_size, not args.unordered, args.checkpoint,
+                         args.checkpoint_interval, args.dictionary)
+    if os.path.exists(runner.checkpoint_path):
+        indicator("Checkpoint found, resuming the interrupted run...")
+    try:
+        metrics = runner.run(progress=lambda done, seconds: indicator(f"{done} jobs done ({done / seconds:.0f} jobs/s)"))
+    except ValueError as e:
+        error(str(e))
+    print(format_metrics(metrics), file=sys.stderr)
+    if args.metrics:
+        with open(args.metrics, "w") as file:
+            json.dump(metrics, file, indent=1)
+
+if __name__ == "__main__":
+    main()
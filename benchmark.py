@@ -0,0 +1,443 @@
+from concurrent.futures import ProcessPoolExecutor
+from colorama import Fore, Style
+import multiprocessing
+import subprocess
+import contextlib
+import tempfile
+import argparse
+import random
+import json
+import time
+import sys
+import io
+import os
+
+try:
+    import resource # not on Windows, the peak RSS is then not reported
+except ImportError:
+    resource = None
+
+"""
+Benchmark suite of the toolset
+
+Every primitive (classical ciphers, transposition, xor, AES, hashing, RSA, the
+crackers) is timed on seeded inputs of the requested sizes. Each case runs in a
+fresh process so its peak RSS is its own. The results (MB/s, ops/s, peak RSS)
+can be saved as a JSON baseline, and a later run compared with it fails when a
+case regresses past the threshold.
+
+The pure Python text primitives are slow on huge inputs, each case has a size
+limit above which it is skipped (--no-limit to run them anyway).
+
+The startup.* cases time `python pfs.py <command> --help` in a new interpreter
+(imports and argument parsing, no input): they guard the start time of the
+tools, which dominates when they run thousands of times from scripts.
+
+Usage:
+
+python benchmark.py --list
+python benchmark.py -s 1KB,1MB
+python benchmark.py -c aes -c hash -s 1MB,1GB
+python benchmark.py -c startup --compare baseline.json
+python benchmark.py --save baseline.json
+python benchmark.py --compare baseline.json --threshold 0.2
+"""
+
+KB, MB, GB = 1000, 1000**2, 1000**3
+SIZE_UNITS = {"KB": KB, "MB": MB, "GB": GB, "B": 1}
+DEFAULT_SIZES = "1KB,64KB,1MB"
+SEED = 1234
+MIN_TIME = 0.2 # seconds of runs per case, the best run is kept
+MAX_RUNS = 50
+THRESHOLD = 0.2 # a case regresses when it is 20% slower (or its peak RSS 20% bigger) than the baseline
+
+# common english words, the seeded texts look like english for the crackers
+WORDS = ("the of and to in is you that it he was for on are as with his they at be this have from or one had by word "
+         "but not what all were we when your can said there use an each which she do how their if will up other about "
+         "out many then them these so some her would make like him into time has look two more write go see number no "
+         "way could people my than first water been call who oil its now find long down day did get come made may part").split()
+
+CASES = {} # name => (setup function, size limit, sized)
+# modules a light tool must not import at startup
+HEAVY_MODULES = ("numpy", "scipy", "matplotlib", "PyQt6", "doctest", "tracemalloc", "cProfile")
+
+def error(message: str) -> None:
+    print(Fore.RED + Style.BRIGHT + message + Style.RESET_ALL)
+    os._exit(1)
+
+def indicator(message: str) -> None:
+    print(Fore.GREEN + message + Style.RESET_ALL)
+
+def benchmark_case(name: str, limit: int = None, sized: bool = True):
+    """Register a case: setup(size, rng, folder) prepares the inputs and returns the function to time
+
+    An unsized case (startup time...) runs once per suite with size 0 instead of once per size.
+    """
+    def register(setup):
+        CASES[name] = (setup, limit, sized)
+        return setup
+    return register
+
+def parse_size(text: str) -> int:
+    """
+    >>> parse_size("64KB"), parse_size("1GB"), parse_size("100")
+    (64000, 1000000000, 100)
+    """
+    text = text.strip().upper()
+    for unit in ("KB", "MB", "GB", "B"):
+        if text.endswith(unit):
+            return int(float(text[:-len(unit)]) * SIZE_UNITS[unit])
+    return int(text)
+
+def size_label(size: int) -> str:
+    """
+    >>> size_label(64000), size_label(10**9), size_label(1500), size_label(0)
+    ('64KB', '1GB', '1500B', '-')
+    """
+    if size == 0:
+        return "-"
+    for unit in ("GB", "MB", "KB"):
+        if size % SIZE_UNITS[unit] == 0:
+            return f"{size // SIZE_UNITS[unit]}{unit}"
+    return f"{size}B"
+
+def english_text(size: int, rng: random.Random) -> str:
+    """seeded text of common english words, size characters"""
+    words = rng.choices(WORDS, k=size // 4 + 1) # about 4 characters per word with the space
+    text = " ".join(words)
+    while len(text) < size:
+        text += " " + text
+    return text[:size]
+
+def random_alphabet(rng: random.Random) -> str:
+    letters = list("abcdefghijklmnopqrstuvwxyz")
+    rng.shuffle(letters)
+    return "".join(letters)
+
+def peak_rss() -> int:
+    """peak resident memory of this process in bytes, None if unknown"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if os.uname().sysname == "Darwin" else peak * 1024 # kB on Linux, bytes on macOS
+
+#### Cases
+
+@benchmark_case("caesar.encode", limit=16 * MB)
+def _caesar_encode(size, rng, folder):
+    import caesar
+    text = english_text(size, rng)
+    return lambda: caesar.encode_caesar_cipher(text, 3)
+
+@benchmark_case("caesar.decode", limit=16 * MB)
+def _caesar_decode(size, rng, folder):
+    import caesar
+    text = caesar.encode_caesar_cipher(english_text(size, rng), 3)
+    return lambda: caesar.decode_caesar_cipher(text, 3)
+
+@benchmark_case("mono.encode", limit=16 * MB)
+def _mono_encode(size, rng, folder):
+    import mono_alphabet_cipher
+    text, key = english_text(size, rng), random_alphabet(rng)
+    return lambda: mono_alphabet_cipher.encode(text, key)
+
+@benchmark_case("mono.decode", limit=16 * MB)
+def _mono_decode(size, rng, folder):
+    import mono_alphabet_cipher
+    key = random_alphabet(rng)
+    text = mono_alphabet_cipher.encode(english_text(size, rng), key)
+    return lambda: mono_alphabet_cipher.decode(text, key)
+
+@benchmark_case("poly.encode", limit=16 * MB)
+def _poly_encode(size, rng, folder):
+    import poly_alphabet_cipher
+    text, keys = english_text(size, rng), [random_alphabet(rng) for _ in range(3)]
+    return lambda: poly_alphabet_cipher.encode(text, keys)
+
+@benchmark_case("poly.decode", limit=16 * MB)
+def _poly_decode(size, rng, folder):
+    import poly_alphabet_cipher
+    keys = [random_alphabet(rng) for _ in range(3)]
+    text = poly_alphabet_cipher.encode(english_text(size, rng), keys)
+    return lambda: poly_alphabet_cipher.decode(text, keys)
+
+@benchmark_case("transposition.table_transpose", limit=16 * MB)
+def _transpose(size, rng, folder):
+    import transposition
+    text = english_text(size, rng)
+    return lambda: transposition.table_transpose(text, 7)
+
+@benchmark_case("otp.bytes_xor", limit=64 * MB)
+def _bytes_xor(size, rng, folder):
+    import one_time_padding
+    a, b = rng.randbytes(size), rng.randbytes(size)
+    return lambda: one_time_padding.bytes_xor(a, b)
+
+@benchmark_case("aes.encrypt_ecb")
+def _aes_encrypt(size, rng, folder):
+    import aes128ecb
+    data, key = rng.randbytes(size), rng.randbytes(16)
+    return lambda: aes128ecb.encrypt_aes_ecb(data, key)
+
+@benchmark_case("aes.decrypt_ecb")
+def _aes_decrypt(size, rng, folder):
+    import aes128ecb
+    key = rng.randbytes(16)
+    data = aes128ecb.encrypt_aes_ecb(rng.randbytes(size), key)
+    return lambda: aes128ecb.decrypt_aes_ecb(data, key)
+
+@benchmark_case("file.encrypt_v2")
+def _file_encrypt_v2(size, rng, folder):
+    import file_encryption
+    path = _write_file(folder, size, rng)
+    return lambda: file_encryption.encrypt_file_v2(path, path + ".enc", rng.randbytes(32))
+
+@benchmark_case("hash.hash_file")
+def _hash_file(size, rng, folder):
+    import hash_file_verification
+    path = _write_file(folder, size, rng)
+    return lambda: hash_file_verification.hash_file(path, "sha256")
+
+@benchmark_case("rsa.sign_message")
+def _rsa_sign(size, rng, folder):
+    import rsa_sign_and_verify
+    signer = rsa_sign_and_verify.Signer(generate=True, key_size=2048) # not timed
+    message = rng.randbytes(size)
+    return lambda: signer.sign_message(message)
+
+@benchmark_case("rsa.verify")
+def _rsa_verify(size, rng, folder):
+    import rsa_sign_and_verify
+    signer = rsa_sign_and_verify.Signer(generate=True, key_size=2048)
+    message = rng.randbytes(size)
+    signature = signer.sign_message(message)
+    return lambda: signer.verify(message, signature)
+
+@benchmark_case("crack.caesar", limit=1 * MB)
+def _crack_caesar(size, rng, folder):
+    import caesar, caesar_bruteForcer
+    text = caesar.encode_caesar_cipher(english_text(size, rng), 7)
+    dictionary = os.path.join(folder, "words.json")
+    with open(dictionary, "w") as file:
+        json.dump({word: 1 for word in WORDS}, file)
+    return _quiet(lambda: caesar_bruteForcer.brute_forcer(text, dictionary))
+
+@benchmark_case("crack.mono_frequency", limit=16 * MB)
+def _crack_mono(size, rng, folder):
+    import mono_alphabet_cipher, mono_brute_force
+    text = mono_alphabet_cipher.encode(english_text(size, rng), random_alphabet(rng))
+    return lambda: mono_brute_force.find_e(text)
+
+@benchmark_case("crack.poly_subsets", limit=16 * MB)
+def _crack_poly(size, rng, folder):
+    import poly_alphabet_cipher, poly_crack
+    text = poly_alphabet_cipher.encode(english_text(size, rng), [random_alphabet(rng) for _ in range(3)])
+    return lambda: poly_crack.subsets(text, 10)
+
+@benchmark_case("crack.mono_words", sized=False)
+def _crack_mono_words(size, rng, folder):
+    import mono_alphabet_cipher, word_patterns
+    index = os.path.join(folder, "words.pat")
+    word_patterns.build_index({word: 1 for word in WORDS}, index)
+    text = mono_alphabet_cipher.encode(english_text(120, rng), random_alphabet(rng)) # a short message
+    patterns = word_patterns.PatternIndex(index)
+    return lambda: word_patterns.solve(text, patterns)
+
+@benchmark_case("crack.kasiski", limit=16 * MB)
+def _crack_kasiski(size, rng, folder):
+    import poly_alphabet_cipher, kasiski
+    text = poly_alphabet_cipher.encode(english_text(size, rng), [random_alphabet(rng) for _ in range(7)])
+    return lambda: kasiski.rank_periods(text)
+
+@benchmark_case("classify.triage", limit=16 * MB)
+def _classify(size, rng, folder):
+    import caesar, mono_alphabet_cipher, poly_alphabet_cipher, transposition, cipher_classifier
+    samples = []
+    for i in range(max(1, size // 300)): # samples of 300 characters of every family
+        text = english_text(300, rng)
+        samples.append([text, caesar.encode_caesar_cipher(text, 1 + i % 25),
+                        mono_alphabet_cipher.encode(text, random_alphabet(rng)),
+                        poly_alphabet_cipher.encode(text, [random_alphabet(rng) for _ in range(2 + i % 6)]),
+                        transposition.table_transpose(text, 3 + i % 20)][i % 5])
+    return lambda: cipher_classifier.classify(samples)
+
+def _startup_case(command: str):
+    def setup(size, rng, folder):
+        arguments = [sys.executable, PFS_PATH, command, "--help"]
+        return lambda: subprocess.run(arguments, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+    return setup
+
+PFS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pfs.py")
+STARTUP_COMMANDS = ["caesar", "caesar-crack", "transposition", "mono", "mono-crack", "poly", "poly-crack",
+                    "otp", "aes", "hash", "sign", "keygen"]
+for _command in STARTUP_COMMANDS:
+    benchmark_case(f"startup.{_command}", sized=False)(_startup_case(_command))
+
+def imported_modules(command: str) -> list[str]:
+    """HEAVY_MODULES imported by loading a pfs command (its module and its argument parser)
+
+    >>> [command for command in STARTUP_COMMANDS if imported_modules(command)]
+    []
+    """
+    code = ("import sys, pfs, importlib; importlib.import_module(pfs.COMMANDS[sys.argv[1]][0]); "
+            f"print(' '.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))")
+    output = subprocess.run([sys.executable, "-c", code, command], capture_output=True, text=True,
+                            cwd=os.path.dirname(PFS_PATH), check=True).stdout
+    return output.split()
+
+def _write_file(folder: str, size: int, rng: random.Random, block: int = 16 * MB) -> str:
+    """seeded random file of size bytes, written by blocks"""
+    path = os.path.join(folder, "input.bin")
+    with open(path, "wb") as file:
+        for start in range(0, size, block):
+            file.write(rng.randbytes(min(block, size - start)))
+    return path
+
+def _quiet(function):
+    """the crackers print their progress, it is not part of the measure"""
+    def run():
+        with contextlib.redirect_stdout(io.StringIO()):
+            return function()
+    return run
+
+#### Runner
+
+def run_case(name: str, size: int, seed: int = SEED, min_time: float = MIN_TIME) -> dict:
+    """Time one case on a seeded input of size bytes, the best of the runs is kept
+
+    Returns:
+        dict: case, size, runs, seconds (best run), mb_s, ops_s, peak_rss (bytes or None)
+    """
+    setup = CASES[name][0]
+    rng = random.Random(f"{seed}:{name}:{size}")
+    with tempfile.TemporaryDirectory() as folder:
+        function = setup(size, rng, folder)
+        times = []
+        started = time.perf_counter()
+        while len(times) < MAX_RUNS and (not times or time.perf_counter() - started < min_time):
+            start = time.perf_counter()
+            function()
+            times.append(time.perf_counter() - start)
+    best = max(min(times), 1e-9)
+    return {"case": name, "size": size, "runs": len(times), "seconds": best,
+            "mb_s": size / best / MB if size else None, "ops_s": 1 / best, "peak_rss": peak_rss()}
+
+def _run_isolated(name: str, size: int, seed: int, min_time: float) -> dict:
+    """run a case in a new process, its peak RSS doesn't include the previous cases"""
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+        return executor.submit(run_case, name, size, seed, min_time).result()
+
+def run_suite(names: list[str], sizes: list[int], seed: int = SEED, min_time: float = MIN_TIME,
+              no_limit: bool = False, isolated: bool = True, report=None) -> list[dict]:
+    """Run the cases on every size, a failing case (missing dependency...) is reported and skipped
+
+    Args:
+        report (callable): called with each result as soon as it is measured
+
+    Returns:
+        list[dict]: the results (see run_case), skipped or failed cases have an "error" key
+    """
+    results = []
+    for name in names:
+        _, limit, sized = CASES[name]
+        for size in sizes if sized else [0]:
+            if limit is not None and size > limit and not no_limit:
+                result = {"case": name, "size": size, "error": f"skipped, above the {size_label(limit)} limit"}
+            else:
+                try:
+                    result = _run_isolated(name, size, seed, min_time) if isolated else run_case(name, size, seed, min_time)
+                except Exception as e:
+                    result = {"case": name, "size": size, "error": f"{type(e).__name__}: {e}"}
+            results.append(result)
+            if report is not None:
+                report(result)
+    return results
+
+def result_key(result: dict) -> str:
+    return f"{result['case']}@{size_label(result['size'])}" if result["size"] else result["case"]
+
+def _speed(result: dict) -> str:
+    return f"{result['mb_s']:.1f} MB/s" if result["size"] else f"{1000 / result['ops_s']:.1f} ms"
+
+def compare(results: list[dict], baseline: dict, threshold: float = THRESHOLD) -> list[str]:
+    """Regressions of the results against a baseline (result_key => result)
+
+    >>> base = {"aes@1MB": {"case": "aes", "size": MB, "mb_s": 100.0, "ops_s": 100.0, "peak_rss": 50 * MB},
+    ...         "startup.aes": {"case": "startup.aes", "size": 0, "mb_s": None, "ops_s": 20.0, "peak_rss": None}}
+    >>> compare([{"case": "aes", "size": MB, "mb_s": 70.0, "ops_s": 70.0, "peak_rss": 50 * MB}], base)
+    ['aes@1MB: 70.0 MB/s, baseline 100.0 MB/s (-30%)']
+    >>> compare([{"case": "aes", "size": MB, "mb_s": 95.0, "ops_s": 95.0, "peak_rss": 51 * MB}], base)
+    []
+    >>> compare([{"case": "startup.aes", "size": 0, "mb_s": None, "ops_s": 10.0, "peak_rss": None}], base)
+    ['startup.aes: 100.0 ms, baseline 50.0 ms (-50%)']
+    """
+    regressions = []
+    for result in results:
+        reference = baseline.get(result_key(result))
+        if reference is None or "error" in result or "error" in reference:
+            continue
+        if result["ops_s"] < reference["ops_s"] * (1 - threshold): # same size, the throughput follows ops/s
+            change = result["ops_s"] / reference["ops_s"] - 1
+            regressions.append(f"{result_key(result)}: {_speed(result)}, baseline {_speed(reference)} ({change:+.0%})")
+        if result.get("peak_rss") and reference.get("peak_rss") and result["peak_rss"] > reference["peak_rss"] * (1 + threshold) + 16 * MB:
+            regressions.append(f"{result_key(result)}: peak RSS {result['peak_rss'] / MB:.0f} MB, baseline {reference['peak_rss'] / MB:.0f} MB")
+    return regressions
+
+def format_result(result: dict) -> str:
+    if "error" in result:
+        return f"{result['case']:<32} {size_label(result['size']):>7}  {result['error']}"
+    rss = f"{result['peak_rss'] / MB:8.1f} MB" if result["peak_rss"] else "       n/a"
+    speed = f"{result['mb_s']:10.2f} MB/s" if result["size"] else f"{1000 / result['ops_s']:10.2f} ms  "
+    return (f"{result['case']:<32} {size_label(result['size']):>7} {speed} "
+            f"{result['ops_s']:12.1f} ops/s {rss}  ({result['runs']} runs)")
+
+def main():
+    argument_parser = argparse.ArgumentParser(description="Benchmark suite with regression baselines")
+    argument_parser.add_argument("-c", "--case", action="append", help="Run the cases whose name starts with this prefix (repeatable)")
+    argument_parser.add_argument("-s", "--sizes", type=str, default=DEFAULT_SIZES, help="Comma separated input sizes (1KB to 1GB)")
+    argument_parser.add_argument("--seed", type=int, default=SEED, help="Seed of the inputs")
+    argument_parser.add_argument("--min-time", type=float, default=MIN_TIME, help="Minimum measured time per case in seconds")
+    argument_parser.add_argument("--no-limit", action="store_true", help="Run the slow cases above their size limit")
+    argument_parser.add_argument("--in-process", action="store_true", help="Run the cases in this process (faster, shared peak RSS)")
+    argument_parser.add_argument("--save", type=str, help="Save the results as a JSON baseline")
+    argument_parser.add_argument("--compare", type=str, help="Compare with a JSON baseline, fails on regression")
+    argument_parser.add_argument("--threshold", type=float, default=THRESHOLD, help="Allowed slowdown before a regression (0.2 = 20%%)")
+    argument_parser.add_argument("--list", action="store_true", help="List the cases and exit")
+
+    args = argument_parser.parse_args()
+
+    if args.list:
+        for name, (_, limit, sized) in CASES.items():
+            print(f"{name:<32} {'no input' if not sized else 'no limit' if limit is None else 'limit ' + size_label(limit)}")
+        return
+    names = [name for name in CASES if not args.case or any(name.startswith(prefix) for prefix in args.case)]
+    if not names:
+        error("No case matches the -c prefixes, see --list")
+    try:
+        sizes = [parse_size(size) for size in args.sizes.split(",")]
+    except ValueError:
+        error("Invalid size, use for example 1KB,64KB,1MB,1GB")
+    baseline = None
+    if args.compare:
+        if not os.path.exists(args.compare):
+            error("The baseline file does not exist")
+        with open(args.compare, "r") as file:
+            baseline = {result_key(result): result for result in json.load(file)["results"]}
+
+    indicator(f"{len(names)} cases x {len(sizes)} sizes, seed {args.seed}")
+    results = run_suite(names, sizes, args.seed, args.min_time, args.no_limit, not args.in_process,
+                        report=lambda result: print(format_result(result)))
+
+    if args.save:
+        with open(args.save, "w") as file:
+            json.dump({"seed": args.seed, "created": time.strftime("%Y-%m-%d %H:%M:%S"), "results": results}, file, indent=2)
+        indicator(f"Baseline saved in {args.save}")
+    if baseline is not None:
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print("\n".join(regressions))
+            error(f"{len(regressions)} regression(s) past the {args.threshold:.0%} threshold")
+        indicator(f"No regression past the {args.threshold:.0%} threshold")
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,15 @@
 import argparse
 import json
 import os
+import profiling
+import daemon_client
 """ INSTRUCTIONS
 made to brute force a caesar cipher
     -i: text to decode
     -o: output file name
     -w: path to the dictionnary
     --print-only: print the output only
+    --profile: print the time and memory of each phase (table or json)
     
     example:
         python caesar_bruteForcer.py -i "khoor" -o "output.txt" -w "dico.json"
@@ -48,11 +51,30 @@ def decode_caesar_cipher(text:str, decalage:int) -> str:
         elif letter == "\n": output += "\n"
     return output
 
-def brute_forcer(text, path_dico, verbose=False):
-    dico = import_dico(path_dico)
+def brute_forcer(text, path_dico, verbose=False, cancelled=None):
+    with profiling.phase("load dictionary"):
+        dico = import_dico(path_dico)
+    with profiling.phase("transform", hot=True):
+        best_shift, best_matching_words = _best_shift(text, dico, verbose, cancelled)
+    
+    print(f"Best shift: {best_shift}, matching words: {best_matching_words}")
+    if best_matching_words == 0:
+        print("No matching words found")
+        return best_shift, "No matching words found"
+    else:
+        return best_shift, decode_caesar_cipher(text, best_shift)
+
+def _best_shift(text, dico, verbose=False, cancelled=None):
+    """try the 26 shifts, returns the shift with the most dictionary words and that number of words
+
+    cancelled() returning True stops before the next shift, the best shift so far is returned
+    (anytime.py gives a plausible shift within a few ms and refines it)
+    """
     best_matching_words = 0
     best_shift = 0
     for i in range(26):
+        if cancelled is not None and cancelled():
+            break
         output = decode_caesar_cipher(text, i)  
         matching_words = 0
         for word in output.split():
@@ -63,25 +85,20 @@ def brute_forcer(text, path_dico, verbose=False):
             best_shift = i
         if verbose: print(f"Shift: {i}, matching words: {matching_words}")
         if verbose: print(output)
-        
+    return best_shift, best_matching_words
     
-    print(f"Best shift: {best_shift}, matching words: {best_matching_words}")
-    if best_matching_words == 0:
-        print("No matching words found")
-        return best_shift, "No matching words found"
-    else:
-        return best_shift, decode_caesar_cipher(text, best_shift)
-    
-if __name__ == "__main__":
+def main():
     # Create the parser
     argument_parser = argparse.ArgumentParser(description="Caesar cipher")
     argument_parser.add_argument("-i", type=str, help="Text to cipher")
     argument_parser.add_argument("-o", type=str, help="Output file name")
     argument_parser.add_argument('-w', type=str, help="Path to the dictionnary")
     argument_parser.add_argument("--print-only", action="store_true", help="Print the output only")
+    profiling.add_arguments(argument_parser)
 
     # Parse the arguments
     args = argument_parser.parse_args()
+    profiling.start(args)
 
     # check inputs
     if not args.i:
@@ -100,18 +117,27 @@ if __name__ == "__main__":
         if not os.path.exists(args.i):
             print("The file does not exist")
             exit(1)
-        with open(args.i, "r") as file:
+        with profiling.phase("load input"), open(args.i, "r") as file:
             text = file.read()
     else:
         text = args.i
     
-    # brute force
-    best_shift, output_text = brute_forcer(text, args.w)
+    # brute force, on the daemon if one is running (its dictionary is already loaded)
+    result = daemon_client.try_call("crack.caesar", {"text": text, "dictionary": os.path.abspath(args.w)})
+    if result is not None:
+        best_shift, output_text = result["shift"], result["text"] or "No matching words found"
+        print(f"Best shift: {best_shift}, matching words: {result['matching_words']}")
+        if not result["matching_words"]:
+            print("No matching words found")
+    else:
+        best_shift, output_text = brute_forcer(text, args.w)
     
     # Print or save the output
     if args.print_only:
         print(output_text)
     else:
-        with open(args.o, "w") as file:
+        with profiling.phase("write output"), open(args.o, "w") as file:
             file.write(output_text)
-    
\ No newline at end of file
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+import signal
+import json
+import time
+import zlib
+import os
+
+"""
+Checkpoints of long searches, to resume them after a crash or a preemption
+
+A search calls due() at each step (a clock read) and save(state) when it
+returns True: the state (any JSON: best key, counters, the path of the search
+in its tree...) is written compressed to a temporary file, synced, then renamed
+over the checkpoint, a crash during a write leaves the previous checkpoint.
+On start, load() returns the state of the interrupted run, and remove() deletes
+the checkpoint once the search is over.
+
+The checkpoint records the identity of the search (input hash, parameters): a
+checkpoint of another search is refused instead of resumed.
+
+With stop_on_signal(), SIGTERM (a spot instance being reclaimed, a job
+scheduler) makes due() return True at the next step and stop_requested tells
+the search to stop once the state is saved.
+
+The time spent writing is kept in overhead(), the interval is raised when the
+writes take more than MAX_OVERHEAD of the run.
+
+>>> import tempfile
+>>> path = os.path.join(tempfile.mkdtemp(), "search.ckpt")
+>>> checkpoint = Checkpoint(path, interval=0, identity={"text": "abc"})
+>>> checkpoint.load() is None, checkpoint.due()
+(True, True)
+>>> checkpoint.save({"best": "key", "path": [3, 0, 1]})
+>>> Checkpoint(path, identity={"text": "abc"}).load()
+{'best': 'key', 'path': [3, 0, 1]}
+>>> Checkpoint(path, identity={"text": "xyz"}).load()
+Traceback (most recent call last):
+ValueError: The checkpoint belongs to another search, remove it to start over
+"""
+
+VERSION = 1
+CHECKPOINT_INTERVAL = 30.0 # seconds between two checkpoints
+MAX_OVERHEAD = 0.01 # share of the run spent writing checkpoints
+
+class Checkpoint:
+    """Periodic atomic snapshots of the state of a search
+
+    Args:
+        path (str): checkpoint file
+        interval (float): seconds between two checkpoints
+        identity: JSON of the input and parameters of the search
+    """
+    def __init__(self, path: str, interval: float = CHECKPOINT_INTERVAL, identity=None):
+        self.path = path
+        self.interval = interval
+        self.identity = identity
+        self.started = time.monotonic()
+        self.last = self.started
+        self.writes = 0
+        self.write_seconds = 0.0
+        self.stop_requested = False
+
+    def load(self):
+        """state of the interrupted search, None if there is no checkpoint
+
+        Raises:
+            ValueError: if the checkpoint belongs to another search or is damaged
+        """
+        if not os.path.exists(self.path):
+            return None
+        try:
+            with open(self.path, "rb") as file:
+                checkpoint = json.loads(zlib.decompress(file.read()))
+        except (zlib.error, ValueError):
+            raise ValueError(f"{self.path} is not a checkpoint or is damaged") from None
+        if checkpoint.get("version") != VERSION or checkpoint.get("identity") != self.identity:
+            raise ValueError("The checkpoint belongs to another search, remove it to start over")
+        return checkpoint["state"]
+
+    def due(self) -> bool:
+        """a checkpoint should be saved now (interval elapsed or stop requested)"""
+        return self.stop_requested or time.monotonic() - self.last >= self.interval
+
+    def save(self, state) -> None:
+        """atomically replace the checkpoint with a state"""
+        start = time.monotonic()
+        data = zlib.compress(json.dumps({"version": VERSION, "identity": self.identity, "state": state},
+                                        separators=(",", ":")).encode())
+        temporary = self.path + ".tmp"
+        with open(temporary, "wb") as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, self.path)
+        self.last = time.monotonic()
+        self.writes += 1
+        self.write_seconds += self.last - start
+        # slow storage: space the writes so they stay under MAX_OVERHEAD of the run
+        if self.write_seconds > MAX_OVERHEAD * (self.last - self.started):
+            self.interval = max(self.interval, (self.last - start) / MAX_OVERHEAD)
+
+    def overhead(self) -> float:
+        """share of the run spent writing checkpoints"""
+        elapsed = time.monotonic() - self.started
+        return self.write_seconds / elapsed if elapsed > 0 else 0.0
+
+    def remove(self) -> None:
+        """the search is over, its checkpoint is not needed anymore"""
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def stop_on_signal(self, signals=(signal.SIGTERM,)) -> None:
+        """save and stop at the next step of the search on these signals (main thread only)"""
+        def request(signal_number, frame):
+            self.stop_requested = True
+        for signal_number in signals:
+            signal.signal(signal_number, request)
@@ -0,0 +1,278 @@
+from colorama import Fore, Style
+import numpy as np
+import argparse
+import profiling
+import json
+import time
+import sys
+import os
+
+"""
+Cipher-type classifier for bulk ciphertext triage
+
+Tells which tool of the toolset a ciphertext most likely comes from, with
+statistics computed in one vectorized pass over a whole batch of samples
+(the samples are joined in one byte array, every count is a np.bincount):
+
+- index of coincidence (IoC): about 0.066 for english letters, 0.038 for
+  uniform letters. A substitution of one alphabet keeps it, a poly-alphabet
+  cipher flattens it
+- periodic IoC: mean IoC of the columns text[i::p]. For a poly-alphabet
+  ciphertext it peaks back to english at the number of keys p (the columns
+  count every character, like poly_alphabet_cipher.py)
+- chi-squared distance (per letter) of the letter counts to english, for
+  each of the 26 rotations: 0 is a transposition (the letters are not
+  changed) or a plain text, another minimum is a caesar shift
+- share of the common english bigrams between two letters: high in a plain
+  text, low once a transposition mixed the letters
+
+Labels: plain, caesar, mono, poly, transposition or unknown (too short,
+random or binary data). With --crack each sample goes to the cracker of its
+family (operations.py): crack.caesar (or the shift of the classifier without
+a dictionary), crack.mono_frequency and crack.poly_subsets. The toolset has no
+transposition cracker, those samples are only labelled.
+
+Usage:
+
+python cipher_classifier.py -i samples.txt                  # one sample per line
+python cipher_classifier.py -i samples.jsonl -o labels.jsonl # {"id": ..., "text": ...} lines
+python cipher_classifier.py -i samples.txt --crack -w words_dictionary.json
+"""
+
+alphabet = 'abcdefghijklmnopqrstuvwxyz'
+
+# letter frequencies of english texts, a to z
+ENGLISH = np.array([8.167, 1.492, 2.782, 4.253, 12.702, 2.228, 2.015, 6.094, 6.966, 0.153, 0.772, 4.025, 2.406,
+                    6.749, 7.507, 1.929, 0.095, 5.987, 6.327, 9.056, 2.758, 0.978, 2.360, 0.150, 1.974, 0.074]) / 100
+COMMON_BIGRAMS = ("th", "he", "in", "er", "an", "re", "on", "at", "en", "nd", "ti", "es", "or", "te", "of", "ed",
+                  "is", "it", "al", "ar", "st", "to", "nt", "ng", "se", "ha", "as", "ou", "io", "le")
+
+MIN_LETTERS = 20 # shorter samples are labelled unknown
+MAX_PERIOD = 20 # periods tried for the poly-alphabet ciphers
+BATCH = 10000 # samples classified at once by the command line
+# thresholds, calibrated on english texts of 100 to 2000 letters
+MONO_IOC = 0.052 # above: one alphabet (plain, caesar, mono, transposition)
+POLY_IOC = 0.052 # mean column IoC of the period of a poly-alphabet ciphertext
+POLY_GAIN = 0.01 # and its gain over the IoC of the whole text,
+GAIN_NOISE = 2 # plus GAIN_NOISE / letters of sampling noise
+MIN_COLUMN = 20 # letters per column for a period to be tried, the IoC of shorter columns is noise
+ENGLISH_CHI = 0.5 # chi-squared per letter under which the letters are distributed like english,
+CHI_NOISE = 50 # plus CHI_NOISE / letters of sampling noise
+PLAIN_BIGRAMS = 0.28 # share of common bigrams above which the text was not transposed
+
+# rotations of the english frequencies: ROTATED[s] is the distribution of a caesar shift s
+ROTATED = np.stack([np.roll(ENGLISH, shift) for shift in range(26)])
+_BIGRAM_TABLE = np.zeros(26 * 26, dtype=bool)
+_BIGRAM_TABLE[[(ord(a) - 97) * 26 + ord(b) - 97 for a, b in COMMON_BIGRAMS]] = True
+
+def error(message: str) -> None:
+    print(Fore.RED + Style.BRIGHT + message + Style.RESET_ALL)
+    os._exit(1)
+
+def indicator(message: str) -> None:
+    print(Fore.GREEN + message + Style.RESET_ALL, file=sys.stderr)
+
+def _pack(texts: list[str]) -> tuple:
+    """the samples as one lowercase byte array, with the sample and position of every byte
+
+    The samples are located by their lengths, any character (NUL included) can be in a sample:
+
+    >>> _pack(["a\\0b", "cd"])[1].tolist()
+    [0, 0, 0, 1, 1]
+    """
+    encoded = [text.lower().encode("ascii", "ignore") for text in texts]
+    lengths = np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded))
+    data = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+    sample = np.repeat(np.arange(len(encoded)), lengths) # sample of every byte
+    starts = np.cumsum(lengths) - lengths
+    position = np.arange(len(data)) - np.repeat(starts, lengths) # index of the character in its sample
+    return data, sample, position
+
+def _ioc(counts: np.ndarray) -> np.ndarray:
+    """index of coincidence of the last axis of letter counts, nan without two letters"""
+    total = counts.sum(axis=-1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return (counts * (counts - 1)).sum(axis=-1) / (total * (total - 1))
+
+def statistics(texts: list[str], max_period: int = MAX_PERIOD) -> dict:
+    """Statistics of a batch of samples, computed together
+
+    Returns:
+        dict: arrays of one value per sample: letters, ioc, chi (chi-squared per letter to english for each
+        shift, shape (n, 26)), bigrams (share of common english bigrams) and period_ioc (mean column IoC
+        for the periods 1 to max_period, shape (n, max_period))
+
+    >>> stats = statistics(["hello world", "ab"])
+    >>> stats["letters"].tolist(), round(float(stats["ioc"][0]), 3)
+    ([10, 2], 0.089)
+    """
+    n = len(texts)
+    data, sample, position = _pack(texts)
+    is_letter = (data >= 97) & (data <= 122)
+    letter = data[is_letter].astype(np.int64) - 97
+    letter_sample = sample[is_letter]
+    counts = np.bincount(letter_sample * 26 + letter, minlength=n * 26).reshape(n, 26)
+    letters = counts.sum(axis=1)
+
+    # chi-squared of the counts to the english distribution rotated by each shift:
+    # sum((c - N p)^2 / (N p)) = sum(c^2 / p) / N - N, divided by N to compare the lengths
+    with np.errstate(divide="ignore", invalid="ignore"):
+        squared = (counts.astype(np.float64) ** 2) @ (1 / ROTATED).T
+        chi = (squared / letters[:, None] - letters[:, None]) / letters[:, None]
+
+    # bigrams of two adjacent letters of the same sample
+    pairs = is_letter[:-1] & is_letter[1:] & (sample[:-1] == sample[1:])
+    codes = (data[:-1][pairs].astype(np.int64) - 97) * 26 + data[1:][pairs] - 97
+    pair_sample = sample[:-1][pairs]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        bigrams = np.bincount(pair_sample, weights=_BIGRAM_TABLE[codes], minlength=n) / np.bincount(pair_sample, minlength=n)
+
+    letter_position = position[is_letter]
+    period_ioc = np.empty((n, max_period))
+    for period in range(1, max_period + 1):
+        column = letter_sample * period + letter_position % period
+        column_counts = np.bincount(column * 26 + letter, minlength=n * period * 26).reshape(n, period, 26)
+        if period == 1:
+            period_ioc[:, 0] = _ioc(counts)
+            continue
+        columns_ioc = _ioc(column_counts) # nan for the columns of less than two letters
+        with np.errstate(divide="ignore", invalid="ignore"):
+            period_ioc[:, period - 1] = np.nansum(columns_ioc, axis=1) / (~np.isnan(columns_ioc)).sum(axis=1)
+    return {"letters": letters, "ioc": period_ioc[:, 0], "chi": chi, "bigrams": bigrams, "period_ioc": period_ioc}
+
+def classify(texts: list[str], max_period: int = MAX_PERIOD) -> list[dict]:
+    """Label the likely cipher family of each sample
+
+    Returns:
+        list[dict]: for each sample its label and statistics, with the shift of a caesar sample
+        and the period of a poly-alphabet sample
+
+    >>> import caesar
+    >>> text = ("it was the best of times it was the worst of times it was the age of wisdom it was the age of "
+    ...         "foolishness it was the epoch of belief it was the epoch of incredulity it was the season of light")
+    >>> [(result["label"], result.get("shift")) for result in classify([text, caesar.encode_caesar_cipher(text, 3)])]
+    [('plain', None), ('caesar', 3)]
+    """
+    stats = statistics(texts, max_period)
+    best_shift = np.argmin(np.nan_to_num(stats["chi"], nan=np.inf), axis=1)
+    results = []
+    for i in range(len(texts)):
+        letters, ioc = int(stats["letters"][i]), float(stats["ioc"][i])
+        chi = stats["chi"][i]
+        shift = int(best_shift[i])
+        result = {"label": "unknown", "letters": letters, "ioc": round(ioc, 4) if letters > 1 else None,
+                  "chi": round(float(chi[0]), 3) if letters else None,
+                  "bigrams": round(float(stats["bigrams"][i]), 3) if not np.isnan(stats["bigrams"][i]) else None}
+        # periodic IoC over the periods whose columns are long enough
+        period_ioc = stats["period_ioc"][i, 1:max(1, letters // MIN_COLUMN)]
+        peak = float(np.nanmax(period_ioc)) if len(period_ioc) and not np.isnan(period_ioc).all() else 0.0
+        if letters < MIN_LETTERS:
+            pass
+        elif ioc >= MONO_IOC and chi[shift] < ENGLISH_CHI + CHI_NOISE / letters: # english letters, shifted or not
+            if shift == 0:
+                result["label"] = "plain" if stats["bigrams"][i] >= PLAIN_BIGRAMS else "transposition"
+            else:
+                result["label"], result["shift"] = "caesar", shift
+        elif peak >= POLY_IOC and peak - ioc >= POLY_GAIN + GAIN_NOISE / letters:
+            # the multiples of the period peak too, the first period with most of the gain is the key count
+            result["label"] = "poly"
+            result["period"] = int(np.flatnonzero(period_ioc >= ioc + 0.6 * (peak - ioc))[0]) + 2
+            result["period_ioc"] = round(peak, 4)
+        elif ioc >= MONO_IOC:
+            result["label"] = "mono"
+        results.append(result)
+    return results
+
+#### Routing
+
+# label => operation of operations.py cracking it
+CRACKERS = {"caesar": "crack.caesar", "mono": "crack.mono_frequency", "poly": "crack.poly_subsets"}
+
+def crack(text: str, result: dict, dictionary: str = None) -> dict:
+    """Run the cracker of the family of a classified sample
+
+    Args:
+        text (str): the sample
+        result (dict): its classification
+        dictionary (str): JSON dictionary for crack.caesar, without it the shift of the classifier is used
+
+    Returns:
+        dict: {"operation": ..., "result": ...}, None for the families without a cracker
+    """
+    import operations
+    label = result["label"]
+    if label == "caesar" and dictionary is None:
+        return {"operation": "caesar.decode", "result": operations.run("caesar.decode", {"text": text, "shift": result["shift"]})}
+    if label not in CRACKERS:
+        return None
+    params = {"text": text}
+    if label == "caesar":
+        params["dictionary"] = dictionary
+    elif label == "poly":
+        params["length"] = max(10, 2 * result["period"] + 1) # the ratios show the period and its first multiple
+    return {"operation": CRACKERS[label], "result": operations.run(CRACKERS[label], params)}
+
+def read_samples(path: str):
+    """(id, text) of the samples of a file: one per line, or {"id": ..., "text": ...} lines for a .jsonl file"""
+    jsonl = path.endswith(".jsonl")
+    with open(path, "r", encoding="UTF-8") as file:
+        for number, line in enumerate(file, 1):
+            if not line.strip():
+                continue
+            if jsonl:
+                record = json.loads(line)
+                yield record.get("id", number), record["text"]
+            else:
+                yield number, line.rstrip("\n")
+
+def main():
+    argument_parser = argparse.ArgumentParser(description="Cipher-type classifier for bulk ciphertext triage")
+    argument_parser.add_argument("-i", type=str, help="Samples: one per line, or a .jsonl file of {\"id\", \"text\"}")
+    argument_parser.add_argument("-o", type=str, help="JSONL output file (default: print)")
+    argument_parser.add_argument("--crack", action="store_true", help="Run the cracker of the family of each sample")
+    argument_parser.add_argument("-w", type=str, help="JSON dictionary for the caesar cracker")
+    argument_parser.add_argument("--max-period", type=int, default=MAX_PERIOD, help="Largest poly-alphabet period tried")
+    argument_parser.add_argument("--batch", type=int, default=BATCH, help="Samples classified at once")
+    profiling.add_arguments(argument_parser)
+
+    args = argument_parser.parse_args()
+    profiling.start(args)
+
+    if not args.i or not os.path.exists(args.i):
+        error("You must provide an existing file of samples with the -i option")
+    if args.w and not os.path.exists(args.w):
+        error("The dictionary does not exist")
+    if args.max_period < 1 or args.batch < 1:
+        error("The period and the batch size must be positive")
+    dictionary = os.path.abspath(args.w) if args.w else None
+
+    output = open(args.o, "w") if args.o else sys.stdout
+    labels = {}
+    start = time.perf_counter()
+    samples = read_samples(args.i)
+    try:
+        while True:
+            with profiling.phase("load input"):
+                batch = [sample for _, sample in zip(range(args.batch), samples)]
+            if not batch:
+                break
+            with profiling.phase("transform", hot=True):
+                results = classify([text for _, text in batch], args.max_period)
+            with profiling.phase("write output"):
+                for (sample_id, text), result in zip(batch, results):
+                    labels[result["label"]] = labels.get(result["label"], 0) + 1
+                    if args.crack:
+                        result["crack"] = crack(text, result, dictionary)
+                    output.write(json.dumps({"id": sample_id, **result}) + "\n")
+    except (ValueError, KeyError) as e:
+        error(f"Invalid sample line: {e}")
+    finally:
+        if args.o:
+            output.close()
+    seconds = time.perf_counter() - start
+    total = sum(labels.values())
+    indicator(f"{total} samples in {seconds:.2f}s ({total / seconds * 60:.0f} samples/min): "
+              + ", ".join(f"{label} {count}" for label, count in sorted(labels.items())))
+
+if __name__ == "__main__":
+    main()
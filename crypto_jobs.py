@@ -0,0 +1,49 @@
+# encoding: utf-8
+from PyQt6.QtCore import QObject, QRunnable, pyqtSignal
+import file_encryption
+import time
+
+"""
+Worker jobs of EncryptionApp: a file_encryption function run in a QThreadPool
+"""
+
+class JobSignals(QObject):
+    """signals of a CryptoJob, a QRunnable can't emit signals itself"""
+    progress = pyqtSignal("qint64", "qint64") # bytes done, total bytes
+    finished = pyqtSignal()
+    failed = pyqtSignal(str)
+    cancelled = pyqtSignal()
+
+class CryptoJob(QRunnable):
+    """run a file_encryption function in a worker thread of a QThreadPool
+
+    the function must accept the progress and cancelled keyword arguments
+    """
+    def __init__(self, function, *args):
+        super().__init__()
+        self.function = function
+        self.args = args
+        self.signals = JobSignals()
+        self.done = 0
+        self.total = 0
+        self.started_at = None
+        self._cancelled = False
+
+    def cancel(self) -> None:
+        """ask the job to stop, it stops before its next chunk"""
+        self._cancelled = True
+
+    def report(self, done:int, total:int) -> None:
+        self.done, self.total = done, total
+        self.signals.progress.emit(done, total)
+
+    def run(self) -> None:
+        self.started_at = time.perf_counter()
+        try:
+            self.function(*self.args, progress=self.report, cancelled=lambda: self._cancelled)
+        except file_encryption.Cancelled:
+            self.signals.cancelled.emit()
+        except Exception as e:
+            self.signals.failed.emit(str(e))
+        else:
+            self.signals.finished.emit()
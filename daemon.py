@@ -0,0 +1,265 @@
+from concurrent.futures import ProcessPoolExecutor
+from colorama import Fore, Style
+from daemon_client import AUTH_TIMEOUT, default_address, parse_address, proof, running, token_path
+import multiprocessing
+import secrets
+import hmac
+import operations
+import argparse
+import asyncio
+import signal
+import json
+import time
+import os
+
+"""
+Local daemon running the operations of the toolset with warm caches
+
+A tool started from a script pays the Python start, its imports and its setup
+(dictionary load, RSA key import, AES key schedule) on every run. The daemon
+keeps all of that in memory and answers JSON requests on a Unix socket (or a
+localhost TCP port): a small request takes about a millisecond.
+
+Only the user can reach the daemon: the Unix socket is 0600 in a private folder,
+and on TCP a client must prove it knows the token the daemon writes to a 0600
+file at start (and the daemon proves it too, see daemon_client.py):
+{"nonce": client nonce} is answered by {"nonce": daemon nonce, "proof": HMAC}
+and the client sends {"proof": HMAC} before its requests.
+
+Protocol: one JSON object per line, {"id": 1, "op": "caesar.encode", "params": {...}}
+(see operations.py), answered by {"id": 1, "ok": true, "result": {...}} or
+{"id": 1, "ok": false, "error": "..."}. Requests can be pipelined, the responses
+of a connection come back in the order of the requests.
+
+The fast operations run in the event loop, the file operations in threads and
+the pure Python CPU work (crackers, large texts) on a process pool whose
+workers keep their own warm caches. Backpressure: a connection stops being
+read when PIPELINE_DEPTH of its responses are pending, and at most MAX_PENDING
+requests run or wait for the pool over all the connections.
+
+The tools that support it (caesar_bruteForcer, hash_file_verification,
+rsa_sign_and_verify) send their work to the daemon when it is running, see
+daemon_client.py.
+
+Usage:
+
+python daemon.py
+python daemon.py --dictionary words_dictionary.json --rsa-key private_key.pem -w 4
+python daemon.py --address tcp:127.0.0.1:8765
+python daemon_client.py --stop
+"""
+
+MAX_REQUEST = 64 * 1024 * 1024 # bytes of one request line
+PIPELINE_DEPTH = 64 # pending responses of a connection before it stops being read
+MAX_PENDING = 256 # requests running or waiting for a worker, over all the connections
+
+def error(message: str) -> None:
+    print(Fore.RED + Style.BRIGHT + message + Style.RESET_ALL)
+    os._exit(1)
+
+def indicator(message: str) -> None:
+    print(Fore.GREEN + message + Style.RESET_ALL)
+
+def write_token(path: str) -> bytes:
+    """Write a new random token to path, readable by the user only"""
+    token = secrets.token_hex(32).encode()
+    if os.path.exists(path):
+        os.remove(path)
+    descriptor = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600) # never readable by others, even briefly
+    with os.fdopen(descriptor, "wb") as file:
+        file.write(token)
+    return token
+
+class Daemon:
+    """asyncio server of the operations
+
+    Args:
+        workers (int): processes of the pool, the number of CPUs if None
+        dictionaries (list[str]): JSON dictionaries loaded at start in every process
+        rsa_keys (list[str]): PEM keys imported at start in every process
+        max_pending (int): requests running or waiting for a worker at once
+        pipeline_depth (int): pending responses of a connection before it stops being read
+    """
+    def __init__(self, workers: int = None, dictionaries: list[str] = (), rsa_keys: list[str] = (),
+                 max_pending: int = MAX_PENDING, pipeline_depth: int = PIPELINE_DEPTH):
+        self.workers = workers or os.cpu_count() or 1
+        self.dictionaries = [os.path.abspath(path) for path in dictionaries]
+        self.rsa_keys = [os.path.abspath(path) for path in rsa_keys]
+        self.max_pending = max_pending
+        self.pipeline_depth = pipeline_depth
+        self.started_at = time.time()
+        self.requests = 0
+        self.errors = 0
+        self.connections = 0
+        self.in_progress = 0 # requests running or waiting for a slot
+        self.token = None # set on TCP, the clients must prove they know it
+        self.builtins = {"ping": self.ping, "stats": self.stats, "shutdown": self.shutdown}
+
+    def ping(self) -> dict:
+        return {"pid": os.getpid(), "uptime": round(time.time() - self.started_at, 3)}
+
+    def stats(self) -> dict:
+        return {"pid": os.getpid(), "uptime": round(time.time() - self.started_at, 3), "requests": self.requests,
+                "errors": self.errors, "connections": self.connections, "workers": self.workers,
+                "in_progress": self.in_progress, "caches": operations.cache_info()}
+
+    def shutdown(self) -> dict:
+        self.stopping.set()
+        return {"stopping": True}
+
+    async def dispatch(self, line: bytes) -> dict:
+        """run one request line, the errors are returned in the response"""
+        request_id = None
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("A request is a JSON object")
+            request_id = request.get("id")
+            op, params = request.get("op"), request.get("params") or {}
+            if not isinstance(params, dict):
+                raise ValueError("params must be a JSON object")
+            self.requests += 1
+            if op in self.builtins:
+                return {"id": request_id, "ok": True, "result": self.builtins[op]()}
+            where = operations.kind(op, params)
+            self.in_progress += 1
+            try:
+                async with self.slots: # waits when MAX_PENDING requests are in progress
+                    if where == "inline":
+                        result = operations.run(op, params)
+                    elif where == "thread":
+                        result = await asyncio.to_thread(operations.run, op, params)
+                    else:
+                        result = await asyncio.get_running_loop().run_in_executor(self.pool, operations.run, op, params)
+            finally:
+                self.in_progress -= 1
+            return {"id": request_id, "ok": True, "result": result}
+        except Exception as e:
+            self.errors += 1
+            return {"id": request_id, "ok": False, "error": operations.error_message(e)}
+
+    async def _send(self, pending: asyncio.Queue, writer: asyncio.StreamWriter) -> None:
+        """write the responses in the order of the requests, None ends the connection"""
+        broken = False
+        while (task := await pending.get()) is not None:
+            response = await task
+            if broken: # the client left, the remaining requests still run to completion
+                continue
+            try:
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain() # a slow client slows the daemon down, not the other way around
+            except ConnectionError:
+                broken = True
+
+    async def _authenticate(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> bool:
+        """TCP handshake, True if the client knows the token"""
+        try:
+            client_nonce = str(json.loads(await asyncio.wait_for(reader.readline(), AUTH_TIMEOUT))["nonce"])
+            daemon_nonce = secrets.token_hex(16)
+            writer.write(json.dumps({"nonce": daemon_nonce, "proof": proof(self.token, b"daemon", client_nonce, daemon_nonce)}).encode() + b"\n")
+            await writer.drain()
+            client_proof = json.loads(await asyncio.wait_for(reader.readline(), AUTH_TIMEOUT))["proof"]
+        except (ValueError, KeyError, TypeError, asyncio.TimeoutError, ConnectionError):
+            return False
+        return hmac.compare_digest(str(client_proof), proof(self.token, b"client", client_nonce, daemon_nonce))
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """one client connection: its requests are read while the previous ones run"""
+        if self.token is not None and not await self._authenticate(reader, writer):
+            self.errors += 1
+            writer.close()
+            return
+        self.connections += 1
+        pending = asyncio.Queue(self.pipeline_depth) # full queue = the connection is not read anymore
+        sender = asyncio.create_task(self._send(pending, writer))
+        try:
+            while not self.stopping.is_set():
+                try:
+                    line = await reader.readline()
+                except ValueError: # longer than MAX_REQUEST, the rest of the stream can't be parsed
+                    await pending.put(asyncio.ensure_future(self._too_large()))
+                    break
+                if not line:
+                    break
+                if line.strip():
+                    await pending.put(asyncio.ensure_future(self.dispatch(line)))
+            await pending.put(None)
+            await sender
+        except (ConnectionError, asyncio.CancelledError): # the client left or the daemon is stopping
+            sender.cancel()
+        finally:
+            writer.close()
+            self.connections -= 1
+
+    async def _too_large(self) -> dict:
+        self.errors += 1
+        return {"id": None, "ok": False, "error": f"Request larger than {MAX_REQUEST} bytes"}
+
+    async def serve(self, address: str) -> None:
+        """serve until a shutdown request or SIGINT/SIGTERM"""
+        loop = asyncio.get_running_loop()
+        self.stopping = asyncio.Event()
+        self.slots = asyncio.Semaphore(self.max_pending)
+        operations.warm(self.dictionaries, self.rsa_keys)
+        self.pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"),
+                                        initializer=operations.warm, initargs=(self.dictionaries, self.rsa_keys))
+        # start the workers now, the first requests don't wait for them
+        await asyncio.gather(*(loop.run_in_executor(self.pool, operations.cache_info) for _ in range(self.workers)))
+
+        scheme, location = parse_address(address)
+        if scheme == "unix":
+            if os.path.exists(location): # stale socket of a daemon that died
+                os.remove(location)
+            server = await asyncio.start_unix_server(self.handle, location, limit=MAX_REQUEST)
+            os.chmod(location, 0o600) # only the user can send requests
+        else:
+            self.token = write_token(token_path(location[1]))
+            server = await asyncio.start_server(self.handle, *location, limit=MAX_REQUEST)
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(signal_number, self.stopping.set)
+            except NotImplementedError: # Windows, Ctrl+C raises KeyboardInterrupt instead
+                pass
+        indicator(f"Listening on {address} with {self.workers} workers")
+        try:
+            async with server:
+                await self.stopping.wait()
+        finally:
+            self.pool.shutdown(cancel_futures=True)
+            if scheme == "unix" and os.path.exists(location):
+                os.remove(location)
+            if self.token is not None and os.path.exists(token_path(location[1])):
+                os.remove(token_path(location[1]))
+
+def main():
+    argument_parser = argparse.ArgumentParser(description="Local daemon with warm caches")
+    argument_parser.add_argument("--address", type=str, help="unix:PATH or tcp:HOST:PORT (default: PFS_DAEMON or a per-user socket)")
+    argument_parser.add_argument("-w", "--workers", type=int, help="Processes of the pool for the CPU heavy operations")
+    argument_parser.add_argument("--dictionary", nargs="+", default=[], help="JSON dictionaries to load at start")
+    argument_parser.add_argument("--rsa-key", nargs="+", default=[], help="PEM keys to import at start")
+    argument_parser.add_argument("--max-pending", type=int, default=MAX_PENDING, help="Requests in progress at once before the clients wait")
+
+    args = argument_parser.parse_args()
+
+    try:
+        args.address = args.address or default_address()
+        parse_address(args.address)
+    except (ValueError, PermissionError) as e:
+        error(str(e))
+    if running(args.address):
+        error(f"A daemon is already running on {args.address}")
+    for path in args.dictionary + args.rsa_key:
+        if not os.path.exists(path):
+            error(f"{path} does not exist")
+    if args.workers is not None and args.workers < 1 or args.max_pending < 1:
+        error("The number of workers and pending requests must be positive")
+
+    daemon = Daemon(args.workers, args.dictionary, args.rsa_key, args.max_pending)
+    try:
+        asyncio.run(daemon.serve(args.address))
+    except KeyboardInterrupt:
+        pass
+    indicator("Daemon stopped")
+
+if __name__ == "__main__":
+    main()
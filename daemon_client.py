@@ -0,0 +1,265 @@
+import socket
+import struct
+import json
+import sys
+import os
+
+"""
+Thin client of the pfs daemon (daemon.py)
+
+The client only imports the standard library, a request to a running daemon
+costs a connection and a JSON line instead of a Python start with the imports,
+the dictionary load or the key import of a tool.
+
+The answers of the daemon are trusted (rsa.verify, hash.file), so the client
+only talks to a daemon of the same user: the default socket is in a private
+(0700) folder, $XDG_RUNTIME_DIR or <tmp>/pfs-<uid>, and the owner of a Unix
+socket (and of the process behind it, SO_PEERCRED on Linux) must be the user.
+A TCP port can be opened by anyone, the daemon writes a random token to a 0600
+file next to the socket and both sides prove they know it before a request.
+
+The tools call try_call(): it returns None when no daemon is running (or when
+PFS_NO_DAEMON is set), and the tool then does the work itself. The address of
+the daemon is read from PFS_DAEMON: "unix:/path/to.sock" or "tcp:host:port".
+
+Usage:
+
+python daemon_client.py --ping
+python daemon_client.py caesar.encode '{"text": "hello", "shift": 3}'
+python daemon_client.py hash.file '{"path": "/data/file.bin"}'
+python daemon_client.py --stats
+python daemon_client.py --stop
+"""
+
+TIMEOUT = 60 # seconds waited for a response
+AUTH_TIMEOUT = 5 # seconds waited for the handshake of a TCP connection
+
+class DaemonError(Exception):
+    """The daemon ran the request and it failed (unknown operation, invalid parameters...)"""
+
+def _owned(path: str, private: bool = False) -> bool:
+    """path belongs to the user (and only the user can access it if private), always True without uids (Windows)"""
+    if not hasattr(os, "getuid"):
+        return True
+    status = os.stat(path)
+    return status.st_uid == os.getuid() and not (private and status.st_mode & 0o077)
+
+def runtime_dir() -> str:
+    """Private folder of the daemon files (socket, token): $XDG_RUNTIME_DIR or a 0700 folder in the temporary folder
+
+    Raises:
+        PermissionError: if the folder exists and belongs to someone else or others can access it
+    """
+    directory = os.environ.get("XDG_RUNTIME_DIR")
+    if directory and os.path.isdir(directory) and _owned(directory, private=True):
+        return directory
+    import tempfile
+    user = os.getuid() if hasattr(os, "getuid") else os.environ.get("USERNAME", "user")
+    directory = os.path.join(tempfile.gettempdir(), f"pfs-{user}")
+    try:
+        os.mkdir(directory, 0o700)
+    except FileExistsError:
+        pass
+    if not os.path.isdir(directory) or not _owned(directory, private=True):
+        raise PermissionError(f"{directory} is not a private folder of the user, remove it")
+    return directory
+
+def default_address() -> str:
+    """PFS_DAEMON, else a socket in the private runtime folder (localhost TCP on Windows)"""
+    if os.environ.get("PFS_DAEMON"):
+        return os.environ["PFS_DAEMON"]
+    if not hasattr(socket, "AF_UNIX"):
+        return "tcp:127.0.0.1:8765"
+    return "unix:" + os.path.join(runtime_dir(), "pfs-daemon.sock")
+
+def token_path(port: int) -> str:
+    """File of the token of the TCP daemon on port, PFS_DAEMON_TOKEN overrides it"""
+    return os.environ.get("PFS_DAEMON_TOKEN") or os.path.join(runtime_dir(), f"pfs-daemon-{port}.token")
+
+def read_token(port: int) -> bytes:
+    """Token of the TCP daemon on port
+
+    Raises:
+        PermissionError: if the token file can be read by others or belongs to someone else
+    """
+    path = token_path(port)
+    if not _owned(path, private=True):
+        raise PermissionError(f"{path} must belong to the user and be readable by the user only (0600)")
+    with open(path, "rb") as file:
+        return file.read().strip()
+
+def proof(token: bytes, role: bytes, client_nonce: str, daemon_nonce: str) -> str:
+    """HMAC proving the knowledge of the token for one connection, role is b"client" or b"daemon"
+
+    >>> proof(b"t", b"client", "01", "02") != proof(b"t", b"daemon", "01", "02")
+    True
+    """
+    import hmac
+    return hmac.new(token, role + b":" + client_nonce.encode() + b":" + daemon_nonce.encode(), "sha256").hexdigest()
+
+def parse_address(address: str) -> tuple:
+    """
+    >>> parse_address("unix:/tmp/pfs.sock"), parse_address("tcp:127.0.0.1:8765")
+    (('unix', '/tmp/pfs.sock'), ('tcp', ('127.0.0.1', 8765)))
+    """
+    scheme, _, location = address.partition(":")
+    if scheme == "unix":
+        return "unix", location
+    if scheme == "tcp":
+        host, _, port = location.rpartition(":")
+        return "tcp", (host, int(port))
+    raise ValueError(f"Invalid daemon address {address}, use unix:PATH or tcp:HOST:PORT")
+
+class DaemonClient:
+    """Connection to the daemon, requests can be pipelined with call_many
+
+    >>> with DaemonClient() as client: # doctest: +SKIP
+    ...     client.call("caesar.encode", text="hello", shift=3)
+    {'text': 'khoor'}
+    """
+    def __init__(self, address: str = None, timeout: float = TIMEOUT):
+        scheme, location = parse_address(address or default_address())
+        family = socket.AF_UNIX if scheme == "unix" else socket.AF_INET
+        self.socket = socket.socket(family, socket.SOCK_STREAM)
+        self.socket.settimeout(timeout)
+        self.file = None
+        try:
+            if scheme == "unix" and not _owned(location): # a socket of another user is never connected to
+                raise PermissionError(f"{location} belongs to another user, it is not our daemon")
+            self.socket.connect(location)
+            self.file = self.socket.makefile("rwb")
+            if scheme == "unix":
+                self._check_peer()
+            else:
+                self._authenticate(read_token(location[1]))
+        except BaseException:
+            if self.file is not None:
+                self.file.close()
+            self.socket.close()
+            raise
+        self._next_id = 0
+
+    def _check_peer(self) -> None:
+        """the process listening on the Unix socket runs as the user (Linux)"""
+        if not hasattr(socket, "SO_PEERCRED"):
+            return
+        credentials = self.socket.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+        _, uid, _ = struct.unpack("3i", credentials)
+        if uid != os.getuid():
+            raise PermissionError("The daemon runs as another user")
+
+    def _authenticate(self, token: bytes) -> None:
+        """TCP handshake: the daemon proves it knows the token, then the client does"""
+        import hmac
+        import secrets
+        client_nonce = secrets.token_hex(16)
+        self.file.write(json.dumps({"nonce": client_nonce}).encode() + b"\n")
+        self.file.flush()
+        try:
+            challenge = json.loads(self.file.readline())
+            daemon_nonce, daemon_proof = challenge["nonce"], challenge["proof"]
+        except (ValueError, KeyError, TypeError):
+            raise PermissionError("The daemon did not answer the handshake, it is not our daemon") from None
+        if not hmac.compare_digest(str(daemon_proof), proof(token, b"daemon", client_nonce, str(daemon_nonce))):
+            raise PermissionError("The daemon does not know the token, it is not our daemon")
+        self.file.write(json.dumps({"proof": proof(token, b"client", client_nonce, daemon_nonce)}).encode() + b"\n")
+        self.file.flush()
+
+    def call_many(self, requests: list[tuple]) -> list:
+        """Send every (operation, params) request before reading the responses
+
+        Returns:
+            list: the result of each request, or a DaemonError for the failed ones
+        """
+        first = self._next_id
+        for op, params in requests:
+            self.file.write(json.dumps({"id": self._next_id, "op": op, "params": params}).encode() + b"\n")
+            self._next_id += 1
+        self.file.flush()
+        results = []
+        for expected in range(first, self._next_id):
+            line = self.file.readline()
+            if not line:
+                raise ConnectionError("The daemon closed the connection")
+            response = json.loads(line)
+            if response.get("id") != expected:
+                raise ConnectionError("Out of order response from the daemon")
+            results.append(response["result"] if response["ok"] else DaemonError(response["error"]))
+        return results
+
+    def call(self, op: str, **params):
+        """Run one operation on the daemon
+
+        Raises:
+            DaemonError: if the operation failed on the daemon
+        """
+        result = self.call_many([(op, params)])[0]
+        if isinstance(result, DaemonError):
+            raise result
+        return result
+
+    def close(self) -> None:
+        self.file.close()
+        self.socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def running(address: str = None) -> bool:
+    """a daemon answers on the address (a stale socket file doesn't count)"""
+    try:
+        with DaemonClient(address, timeout=1) as client:
+            client.call("ping")
+        return True
+    except (OSError, ValueError, DaemonError):
+        return False
+
+def try_call(op: str, params: dict, address: str = None):
+    """Run an operation on the daemon if one is running
+
+    Returns:
+        dict: the result, None if no daemon is running, PFS_NO_DAEMON is set, the daemon failed
+        or it could not be verified as a daemon of the user (the caller then runs the operation
+        itself and reports its own errors)
+    """
+    if os.environ.get("PFS_NO_DAEMON"):
+        return None
+    try:
+        address = address or default_address()
+        scheme, location = parse_address(address)
+        if scheme == "unix" and not os.path.exists(location): # the usual case, no connection attempt
+            return None
+        with DaemonClient(address) as client:
+            return client.call(op, **params)
+    except (OSError, DaemonError, ValueError):
+        return None
+
+def main():
+    # no argparse: this client must start as fast as possible
+    arguments = sys.argv[1:]
+    if not arguments or arguments[0] in ("-h", "--help"):
+        print("usage: daemon_client.py (--ping | --stats | --stop | OPERATION [JSON PARAMS])")
+        return
+    op = {"--ping": "ping", "--stats": "stats", "--stop": "shutdown"}.get(arguments[0], arguments[0])
+    try:
+        params = json.loads(arguments[1]) if len(arguments) > 1 else {}
+        with DaemonClient() as client:
+            print(json.dumps(client.call(op, **params)))
+    except json.JSONDecodeError:
+        print("The parameters must be a JSON object", file=sys.stderr)
+        sys.exit(2)
+    except PermissionError as e: # a daemon is there but it is not ours
+        print(str(e), file=sys.stderr)
+        sys.exit(1)
+    except OSError:
+        print(f"No daemon is running on {default_address()}, start it with python daemon.py", file=sys.stderr)
+        sys.exit(1)
+    except DaemonError as e:
+        print(str(e), file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -2,7 +2,7 @@
 # import
 import argparse
 import os
-import doctest
+import profiling
 from sys import exit
 
 # define
@@ -56,9 +56,11 @@ def main():
     argument_parser.add_argument("-d", action="store_true", help="Decode")
     argument_parser.add_argument("-o", type=str, help="Output file name")
     argument_parser.add_argument("--print-only", action="store_true", help="Print the output only")
+    profiling.add_arguments(argument_parser)
 
     # Parse the arguments
     args = argument_parser.parse_args()
+    profiling.start(args)
 
     # Check the arguments
     if not args.i:
@@ -83,24 +85,25 @@ def main():
         if not os.path.exists(args.i):
             print("The file does not exist")
             exit(1)
-        with open(args.i, "r") as file:
+        with profiling.phase("load input"), open(args.i, "r") as file:
             text = file.read()
     else:
         text = args.i
     
 
     # Process the text
-    if args.e:
-        output = encode_caesar_cipher(text, args.K)
-    
-    if args.d:
-        output = decode_caesar_cipher(text, args.K)
+    with profiling.phase("transform", hot=True):
+        if args.e:
+            output = encode_caesar_cipher(text, args.K)
+        
+        if args.d:
+            output = decode_caesar_cipher(text, args.K)
     
     # Print or save the output
     if args.print_only:
         print(output)
     else:
-        with open(args.o, "w") as file:
+        with profiling.phase("write output"), open(args.o, "w") as file:
             file.write(output)
             
 
@@ -109,5 +112,6 @@ def main():
 
 
 if __name__ == "__main__":
+    import doctest # only when run as a script, not when imported by pfs.py
     doctest.testmod()
     main()
\ No newline at end of file
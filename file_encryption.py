@@ -0,0 +1,445 @@
+from Crypto.Cipher import AES
+from Crypto.Random import get_random_bytes
+from Crypto.Util.Padding import pad, unpad
+from concurrent.futures import ThreadPoolExecutor
+from key_derivation import PasswordKey, FileKey
+import struct
+import os
+
+"""
+Chunked AES file encryption used by EncryptionApp
+
+File format v1: 1 mode byte (1 => ECB, 2 => CBC) + 16 bytes IV + padded ciphertext.
+The IV is written for ECB too, so the data always starts at byte 17.
+It has no integrity check and must be decrypted from start to end.
+
+File format v2 (AES-GCM container):
+    header: magic "PFS2" + version (1 byte) + chunk size (4 bytes) + nonce prefix (8 bytes)
+            + extension length (2 bytes) + extension (key derivation parameters for example)
+    chunks: the plaintext is cut in chunks of chunk size bytes (the last one may be shorter or empty),
+            each chunk is encrypted independently: ciphertext + 16 bytes GCM tag.
+            nonce = nonce prefix + chunk index (4 bytes)
+            the header, the chunk index and a last-chunk flag are authenticated with each chunk,
+            so a modified header, a reordered, truncated or tampered chunk is detected.
+    footer: chunk count (8 bytes) + plaintext size (8 bytes) + magic "PFSI"
+
+A key_derivation.PasswordKey can be given instead of a key for v2 files: its salt and
+KDF parameters are stored at the start of the extension and read back to decrypt.
+A key_derivation.FileKey (any file hashed into a key) works with both formats.
+
+Any byte range of a v2 file can be decrypted by reading only the chunks it covers,
+and the chunks are processed in parallel.
+
+The files are processed by chunks, they are never fully in memory, and the
+progress/cancelled callbacks let a worker thread report progress and stop cleanly.
+"""
+
+CHUNK_SIZE = 1024 * 1024 # must be a multiple of AES.block_size
+HEADER_SIZE = 1 + 16
+
+V2_MAGIC = b"PFS2"
+V2_VERSION = 2
+V2_HEADER = struct.Struct(">4sBI8sH") # magic, version, chunk size, nonce prefix, extension length
+V2_FOOTER = struct.Struct(">QQ4s") # chunk count, plaintext size, magic
+V2_FOOTER_MAGIC = b"PFSI"
+TAG_SIZE = 16
+MODE_V2 = AES.MODE_GCM # the mode byte of the app for the v2 container
+WORKERS = min(8, os.cpu_count() or 1)
+
+class Cancelled(Exception):
+    """Raised when an operation is cancelled, the partial output is removed"""
+
+class IntegrityError(ValueError):
+    """Raised when a chunk of a v2 file fails authentication (tampered file or wrong key)
+
+    chunk, start and end are None when the layout of the file (size, index footer) is wrong, reason tells why.
+    """
+    def __init__(self, chunk:int, start:int, end:int, reason: str = None):
+        super().__init__(reason or f"chunk {chunk} (bytes {start} to {end}) failed authentication, the file was modified or the key is wrong")
+        self.chunk = chunk
+        self.start = start
+        self.end = end
+
+def _new_cipher(key: bytes, mode: int, iv: bytes):
+    if mode == AES.MODE_ECB:
+        return AES.new(key, mode)
+    return AES.new(key, mode, iv)
+
+def resolve_key(key, extension: bytes) -> bytes:
+    """AES key of a file, a PasswordKey is derived with the parameters of the header extension
+    and a FileKey is the (cached) hash of its key file"""
+    if isinstance(key, (PasswordKey, FileKey)):
+        return key.derive(extension)
+    return key
+
+def read_mode(input_file: str) -> int:
+    """Read the mode of an encrypted file (MODE_V2 for a v2 container), None if the file is too short to be ours"""
+    with open(input_file, "rb") as f:
+        header = f.read(HEADER_SIZE)
+    if header[:len(V2_MAGIC)] == V2_MAGIC:
+        return MODE_V2
+    if len(header) < HEADER_SIZE:
+        return None
+    return header[0]
+
+def data_offset(encrypted_file: str) -> int:
+    """Size of the header of an encrypted file, the ciphertext starts after it"""
+    if read_mode(encrypted_file) == MODE_V2:
+        with open(encrypted_file, "rb") as f:
+            return len(read_header_v2(f)[0])
+    return HEADER_SIZE
+
+def write_buffers(f, buffers) -> None:
+    """Write several buffers with one os.writev call when available, without joining them first"""
+    views = [memoryview(buffer).cast("B") for buffer in buffers if len(buffer)]
+    if not hasattr(os, "writev"): # Windows
+        for view in views:
+            f.write(view)
+        return
+    f.flush()
+    while views: # writev may write only a part of the buffers
+        written = os.writev(f.fileno(), views)
+        while views and written >= len(views[0]):
+            written -= len(views[0])
+            views.pop(0)
+        if views:
+            views[0] = views[0][written:]
+
+def _check_paths(input_file: str, output_file: str) -> None:
+    """Refuse an output that is the input file: opening it with "wb" would truncate the data before it is read"""
+    if os.path.exists(output_file) and os.path.samefile(input_file, output_file):
+        raise ValueError("The output file is the input file, choose another output")
+
+def _process(input_file: str, output_file: str, transform, progress, cancelled, skip: int = 0, header: bytes = b"") -> None:
+    """Stream input_file through transform(chunk, is_last) into output_file
+
+    The chunks are read with readinto in two preallocated buffers (the current chunk and the
+    read-ahead one), transform works on a memoryview of the buffer and returns the list of
+    buffers to write, so the data is never copied between the disk and the cipher.
+
+    The output is removed if anything goes wrong or if the operation is cancelled.
+    """
+    _check_paths(input_file, output_file) # before the try, the cleanup would remove the input
+    total = os.path.getsize(input_file)
+    done = skip
+    chunk, next_chunk = bytearray(CHUNK_SIZE), bytearray(CHUNK_SIZE)
+    try:
+        with open(input_file, "rb") as src, open(output_file, "wb", buffering=0) as dst:
+            src.seek(skip)
+            length = src.readinto(chunk)
+            buffers = [header] # the header is written with the first chunk
+            while True:
+                if cancelled is not None and cancelled():
+                    raise Cancelled()
+                next_length = src.readinto(next_chunk) # read ahead to know if chunk is the last one
+                buffers += transform(memoryview(chunk)[:length], next_length == 0)
+                write_buffers(dst, buffers)
+                done += length
+                if progress is not None:
+                    progress(done, total)
+                if next_length == 0:
+                    break
+                chunk, next_chunk, length, buffers = next_chunk, chunk, next_length, []
+    except BaseException:
+        if os.path.exists(output_file):
+            os.remove(output_file)
+        raise
+
+def encrypt_file(input_file: str, output_file: str, key: bytes, mode: int = AES.MODE_CBC, progress=None, cancelled=None) -> None:
+    """Encrypt a file by chunks
+
+    Args:
+        input_file (str): file to encrypt
+        output_file (str): encrypted file, removed if the operation fails or is cancelled
+        key (bytes): AES key (16, 24 or 32 bytes)
+        mode (int): AES.MODE_ECB or AES.MODE_CBC for a v1 file, MODE_V2 for a v2 container
+        progress (callable): called with (bytes done, total bytes) after each chunk
+        cancelled (callable): polled before each chunk, the operation stops when it returns True
+
+    The memory used doesn't depend on the file size (two chunk buffers):
+
+    >>> import tempfile, tracemalloc
+    >>> path = os.path.join(tempfile.mkdtemp(), "data.bin")
+    >>> with open(path, "wb") as f: _ = f.write(os.urandom(16 * CHUNK_SIZE + 5))
+    >>> tracemalloc.start()
+    >>> encrypt_file(path, path + ".enc", b"k" * 16)
+    >>> decrypt_file(path + ".enc", path + ".dec", b"k" * 16)
+    2
+    >>> tracemalloc.get_traced_memory()[1] < 2.5 * CHUNK_SIZE
+    True
+    >>> tracemalloc.stop()
+    >>> open(path, "rb").read() == open(path + ".dec", "rb").read()
+    True
+
+    The output can't be the input file, the file is left untouched:
+
+    >>> encrypt_file(path, path, b"k" * 16)
+    Traceback (most recent call last):
+    ValueError: The output file is the input file, choose another output
+    >>> encrypt_file(path, path, b"k" * 16, mode=MODE_V2)
+    Traceback (most recent call last):
+    ValueError: The output file is the input file, choose another output
+    >>> open(path, "rb").read() == open(path + ".dec", "rb").read()
+    True
+    """
+    if mode == MODE_V2:
+        encrypt_file_v2(input_file, output_file, key, progress, cancelled)
+        return
+    if isinstance(key, PasswordKey):
+        raise ValueError("A password needs the GCM (v2) container, the v1 format has no room for the salt")
+    key = resolve_key(key, b"")
+    iv = get_random_bytes(16) # the iv is generated anyway because we always have IV = [1:17] ; data = [17:]
+    cipher = _new_cipher(key, mode, iv)
+
+    def transform(chunk, is_last):
+        aligned = len(chunk) - len(chunk) % AES.block_size
+        cipher.encrypt(chunk[:aligned], output=chunk[:aligned]) # in place in the read buffer
+        if not is_last:
+            return [chunk]
+        return [chunk[:aligned], cipher.encrypt(pad(bytes(chunk[aligned:]), AES.block_size))] # only the last block is padded
+
+    # 1 => ECB # 2 => CBC
+    _process(input_file, output_file, transform, progress, cancelled, header=bytes([mode]) + iv)
+
+def decrypt_file(input_file: str, output_file: str, key: bytes, progress=None, cancelled=None) -> int:
+    """Decrypt a file by chunks, the format (v1 or v2) and the mode are read from the file
+
+    Args:
+        input_file (str): encrypted file
+        output_file (str): decrypted file, removed if the operation fails or is cancelled
+        key (bytes): AES key (16, 24 or 32 bytes)
+        progress (callable): called with (bytes done, total bytes) after each chunk
+        cancelled (callable): polled before each chunk, the operation stops when it returns True
+
+    Raises:
+        ValueError: if the file is not encrypted by us or the key is wrong
+
+    Returns:
+        int: the mode used by the file
+    """
+    with open(input_file, "rb") as f:
+        header = f.read(HEADER_SIZE)
+    if header[:len(V2_MAGIC)] == V2_MAGIC:
+        decrypt_file_v2(input_file, output_file, key, progress, cancelled)
+        return MODE_V2
+    if len(header) < HEADER_SIZE or header[0] not in (AES.MODE_ECB, AES.MODE_CBC):
+        raise ValueError("The file was not encrypted by this application")
+    if isinstance(key, PasswordKey):
+        raise ValueError("The file was not encrypted with a password (v1 format), use its key")
+    key = resolve_key(key, b"")
+    mode, iv = header[0], header[1:]
+    if (os.path.getsize(input_file) - HEADER_SIZE) % AES.block_size != 0:
+        raise ValueError("The ciphertext is not a multiple of the block size")
+    cipher = _new_cipher(key, mode, iv)
+
+    def transform(chunk, is_last):
+        cipher.decrypt(chunk, output=chunk) # in place in the read buffer
+        if not is_last:
+            return [chunk]
+        last_block = unpad(bytes(chunk[-AES.block_size:]), AES.block_size) # fails with a wrong key
+        return [chunk[:len(chunk) - AES.block_size + len(last_block)]]
+
+    _process(input_file, output_file, transform, progress, cancelled, skip=HEADER_SIZE)
+    return mode
+
+def _chunk_nonce(nonce_prefix: bytes, index: int) -> bytes:
+    return nonce_prefix + index.to_bytes(4, "big")
+
+def _chunk_aad(header: bytes, index: int, is_last: bool) -> bytes:
+    return header + index.to_bytes(8, "big") + (b"\x01" if is_last else b"\x00")
+
+def encrypt_chunk(key: bytes, header: bytes, nonce_prefix: bytes, index: int, chunk: bytes, is_last: bool) -> bytes:
+    """Encrypt and authenticate one chunk, returns ciphertext + tag"""
+    cipher = AES.new(key, AES.MODE_GCM, nonce=_chunk_nonce(nonce_prefix, index))
+    cipher.update(_chunk_aad(header, index, is_last))
+    data = bytearray(len(chunk) + TAG_SIZE) # ciphertext and tag are written in one buffer, no concatenation
+    view = memoryview(data)
+    cipher.encrypt(chunk, output=view[:len(chunk)])
+    view[len(chunk):] = cipher.digest()
+    return data
+
+def decrypt_chunk(key: bytes, header: bytes, nonce_prefix: bytes, chunk_size: int, index: int, data: bytes, is_last: bool) -> bytes:
+    """Authenticate and decrypt one chunk (ciphertext + tag), raises IntegrityError if it was modified"""
+    cipher = AES.new(key, AES.MODE_GCM, nonce=_chunk_nonce(nonce_prefix, index))
+    cipher.update(_chunk_aad(header, index, is_last))
+    data = memoryview(data)
+    try:
+        return cipher.decrypt_and_verify(data[:-TAG_SIZE], data[-TAG_SIZE:])
+    except ValueError:
+        start = index * chunk_size
+        raise IntegrityError(index, start, start + max(0, len(data) - TAG_SIZE)) from None
+
+def make_header_v2(chunk_size: int = CHUNK_SIZE, extension: bytes = b"") -> bytes:
+    """Build a v2 header with a random nonce prefix"""
+    return V2_HEADER.pack(V2_MAGIC, V2_VERSION, chunk_size, get_random_bytes(8), len(extension)) + extension
+
+def read_header_v2(f) -> tuple:
+    """Read the header of a v2 file from the start of f
+
+    Returns:
+        tuple: (raw header bytes, chunk size, nonce prefix, extension)
+    """
+    fixed = f.read(V2_HEADER.size)
+    if len(fixed) < V2_HEADER.size:
+        raise ValueError("The file was not encrypted by this application")
+    magic, version, chunk_size, nonce_prefix, extension_length = V2_HEADER.unpack(fixed)
+    if magic != V2_MAGIC:
+        raise ValueError("The file was not encrypted by this application")
+    if version != V2_VERSION:
+        raise ValueError(f"Unsupported container version {version}")
+    if chunk_size == 0 or chunk_size > 1 << 30:
+        raise ValueError("Invalid chunk size")
+    extension = f.read(extension_length)
+    return fixed + extension, chunk_size, nonce_prefix, extension
+
+def _chunk_length(index: int, count: int, chunk_size: int, total: int) -> int:
+    """Length of a stored chunk (ciphertext + tag), the last one is shorter"""
+    if index == count - 1:
+        return total - (count - 1) * chunk_size + TAG_SIZE
+    return chunk_size + TAG_SIZE
+
+def read_footer_v2(f, header: bytes, chunk_size: int) -> tuple:
+    """Read the index footer of a v2 file and check the file size against it
+
+    The header, the chunks and the footer must make up the whole file, no byte is left unauthenticated.
+
+    Raises:
+        IntegrityError: if the footer is missing or inconsistent, or the file has missing or extra bytes
+
+    Returns:
+        tuple: (chunk count, plaintext size)
+    """
+    file_size = f.seek(0, os.SEEK_END)
+    if file_size < len(header) + V2_FOOTER.size:
+        raise IntegrityError(None, None, None, "The file is shorter than a header and an index footer, it is truncated")
+    f.seek(-V2_FOOTER.size, os.SEEK_END)
+    count, size, magic = V2_FOOTER.unpack(f.read(V2_FOOTER.size))
+    if magic != V2_FOOTER_MAGIC:
+        raise IntegrityError(None, None, None, "The index footer is missing, the file is truncated")
+    if count != max(1, -(-size // chunk_size)):
+        raise IntegrityError(None, None, None, "The index footer is inconsistent, the file was modified")
+    if file_size != len(header) + size + count * TAG_SIZE + V2_FOOTER.size:
+        raise IntegrityError(None, None, None, f"The file is {file_size} bytes instead of the "
+                             f"{len(header) + size + count * TAG_SIZE + V2_FOOTER.size} of its index, bytes were added or removed")
+    return count, size
+
+def encrypt_file_v2(input_file: str, output_file: str, key: bytes, progress=None, cancelled=None,
+                    chunk_size: int = CHUNK_SIZE, workers: int = WORKERS, extension: bytes = b"") -> None:
+    """Encrypt a file into a v2 container, the chunks are encrypted in parallel
+
+    Args:
+        input_file (str): file to encrypt
+        output_file (str): encrypted file, removed if the operation fails or is cancelled
+        key (bytes): AES key (16, 24 or 32 bytes)
+        progress (callable): called with (bytes done, total bytes) after each group of chunks
+        cancelled (callable): polled before each group of chunks, the operation stops when it returns True
+        chunk_size (int): plaintext bytes per chunk
+        workers (int): number of chunks encrypted at the same time
+        extension (bytes): extra bytes stored (and authenticated) in the header
+    """
+    if isinstance(key, PasswordKey): # the salt and the KDF parameters go in the header
+        extension = key.extension + extension
+    key = resolve_key(key, extension)
+    header = make_header_v2(chunk_size, extension)
+    nonce_prefix = header[9:17]
+    total = os.path.getsize(input_file)
+    count = max(1, -(-total // chunk_size)) # an empty file still has one (empty) last chunk
+    if count >= 1 << 32:
+        raise ValueError("Too many chunks for the 4 bytes chunk counter of the nonce, use bigger chunks")
+    _check_paths(input_file, output_file)
+    try:
+        with open(input_file, "rb") as src, open(output_file, "wb") as dst, ThreadPoolExecutor(max_workers=workers) as executor:
+            dst.write(header)
+            for first in range(0, count, workers): # a group of chunks is in memory at a time
+                if cancelled is not None and cancelled():
+                    raise Cancelled()
+                indexes = range(first, min(first + workers, count))
+                chunks = [src.read(chunk_size) for _ in indexes]
+                futures = [executor.submit(encrypt_chunk, key, header, nonce_prefix, index, chunk, index == count - 1)
+                           for index, chunk in zip(indexes, chunks)]
+                for future in futures:
+                    dst.write(future.result())
+                if progress is not None:
+                    progress(min(total, (indexes[-1] + 1) * chunk_size), total)
+            dst.write(V2_FOOTER.pack(count, total, V2_FOOTER_MAGIC))
+    except BaseException:
+        if os.path.exists(output_file):
+            os.remove(output_file)
+        raise
+
+def decrypt_file_v2(input_file: str, output_file: str, key: bytes, progress=None, cancelled=None, workers: int = WORKERS) -> None:
+    """Decrypt a v2 container, the chunks are authenticated and decrypted in parallel
+
+    Raises:
+        IntegrityError: if a chunk was modified (or the key is wrong), with its index and plaintext byte range,
+        or if the file size doesn't match its index footer
+        ValueError: if the file is not a v2 container or output_file is input_file
+
+    >>> import tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), "data.bin")
+    >>> with open(path, "wb") as f: _ = f.write(b"data" * 1000)
+    >>> encrypt_file_v2(path, path + ".enc", b"k" * 16)
+    >>> data = open(path + ".enc", "rb").read() # bytes slipped between the last chunk and the footer
+    >>> with open(path + ".enc", "wb") as f: _ = f.write(data[:-V2_FOOTER.size] + b"extra" + data[-V2_FOOTER.size:])
+    >>> decrypt_file_v2(path + ".enc", path + ".dec", b"k" * 16)
+    Traceback (most recent call last):
+    file_encryption.IntegrityError: The file is 4060 bytes instead of the 4055 of its index, bytes were added or removed
+    >>> with open(path + ".enc", "r+b") as f: _ = f.truncate(V2_HEADER.size + 10)
+    >>> decrypt_file_v2(path + ".enc", path + ".dec", b"k" * 16)
+    Traceback (most recent call last):
+    file_encryption.IntegrityError: The file is shorter than a header and an index footer, it is truncated
+    >>> os.path.exists(path + ".dec")
+    False
+    """
+    _check_paths(input_file, output_file)
+    try:
+        with open(input_file, "rb") as src, open(output_file, "wb") as dst, ThreadPoolExecutor(max_workers=workers) as executor:
+            header, chunk_size, nonce_prefix, extension = read_header_v2(src)
+            key = resolve_key(key, extension)
+            count, total = read_footer_v2(src, header, chunk_size)
+            src.seek(len(header))
+            for first in range(0, count, workers):
+                if cancelled is not None and cancelled():
+                    raise Cancelled()
+                indexes = range(first, min(first + workers, count))
+                chunks = [src.read(_chunk_length(index, count, chunk_size, total)) for index in indexes]
+                futures = [executor.submit(decrypt_chunk, key, header, nonce_prefix, chunk_size, index, data, index == count - 1)
+                           for index, data in zip(indexes, chunks)]
+                for future in futures:
+                    dst.write(future.result())
+                if progress is not None:
+                    progress(min(total, (indexes[-1] + 1) * chunk_size), total)
+    except BaseException:
+        if os.path.exists(output_file):
+            os.remove(output_file)
+        raise
+
+def decrypt_range(input_file: str, key: bytes, start: int, length: int) -> bytes:
+    """Decrypt a byte range of a v2 container, only the chunks covering the range are read
+
+    Args:
+        input_file (str): v2 encrypted file
+        key (bytes): AES key
+        start (int): first plaintext byte
+        length (int): number of bytes, the range is cut at the end of the plaintext
+
+    Raises:
+        IntegrityError: if a chunk of the range was modified (or the key is wrong)
+
+    Returns:
+        bytes: the plaintext bytes of the range
+    """
+    with open(input_file, "rb") as f:
+        header, chunk_size, nonce_prefix, extension = read_header_v2(f)
+        key = resolve_key(key, extension)
+        count, total = read_footer_v2(f, header, chunk_size)
+        end = min(start + length, total)
+        if start >= end:
+            return b""
+        output = bytearray()
+        for index in range(start // chunk_size, (end - 1) // chunk_size + 1):
+            f.seek(len(header) + index * (chunk_size + TAG_SIZE))
+            data = f.read(_chunk_length(index, count, chunk_size, total))
+            output += decrypt_chunk(key, header, nonce_prefix, chunk_size, index, data, index == count - 1)
+        offset = start - (start // chunk_size) * chunk_size
+        return bytes(memoryview(output)[offset:offset + end - start])
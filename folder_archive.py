@@ -0,0 +1,326 @@
+from colorama import Fore, Style
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from Crypto.Random import get_random_bytes
+from Crypto.Util.Padding import pad
+from file_encryption import encrypt_chunk, decrypt_chunk, resolve_key, Cancelled, TAG_SIZE
+from key_derivation import PasswordKey, ALGORITHMS
+import argparse
+import struct
+import tarfile
+import zlib
+import lzma
+import os
+import profiling
+
+"""
+Streaming compress-then-encrypt pipeline for folders
+
+A folder is streamed through tar framing, cut in blocks, each block is compressed
+(zlib or lzma) and encrypted (AES-GCM) on a thread pool, and the frames are written
+in order straight to the output file: no temporary file, and only a few blocks
+are in memory at a time. The extraction streams the other way.
+
+Archive format:
+    header: magic "PFSA" + version (1 byte) + compression (1 byte) + block size (4 bytes)
+            + nonce prefix (8 bytes) + extension length (2 bytes) + extension
+    frames: frame length (4 bytes) + compressed block encrypted with AES-GCM + tag,
+            nonce = nonce prefix + frame index, the header, the index and a last-frame
+            flag are authenticated. The last frame is an empty end marker, so a
+            truncated archive is detected.
+
+Usage:
+
+python folder_archive.py -c logs/ -o logs.pfsa -K key.key --compression lzma -l 6 -w 8
+python folder_archive.py -x logs.pfsa -o restored/ -K key.key
+python folder_archive.py -c logs/ -o logs.pfsa -K "my password" --kdf scrypt
+"""
+
+ARCHIVE_MAGIC = b"PFSA"
+ARCHIVE_VERSION = 1
+ARCHIVE_HEADER = struct.Struct(">4sBBI8sH") # magic, version, compression, block size, nonce prefix, extension length
+FRAME_LENGTH = struct.Struct(">I")
+BLOCK_SIZE = 4 * 1024 * 1024
+COMPRESSIONS = {"zlib": 1, "lzma": 2}
+
+def error(message: str) -> None:
+    print(Fore.RED + Style.BRIGHT + message + Style.RESET_ALL)
+    os._exit(1)
+
+def indicator(message: str) -> None:
+    print(Fore.GREEN + message + Style.RESET_ALL)
+
+def compress_block(block: bytes, compression: int, level: int) -> bytes:
+    if compression == COMPRESSIONS["lzma"]:
+        return lzma.compress(block, preset=level)
+    return zlib.compress(block, level)
+
+def decompress_block(block: bytes, compression: int) -> bytes:
+    if compression == COMPRESSIONS["lzma"]:
+        return lzma.decompress(block)
+    return zlib.decompress(block)
+
+class EncryptedBlockWriter:
+    """File-like object cutting the written stream in blocks, compressed and encrypted on a thread pool
+
+    At most 2 * workers blocks are pending, the frames are written in order.
+    """
+    def __init__(self, output, key: bytes, compression: int = COMPRESSIONS["zlib"], level: int = 6,
+                 workers: int = None, block_size: int = BLOCK_SIZE, extension: bytes = b"", cancelled=None):
+        if isinstance(key, PasswordKey): # the salt and the KDF parameters go in the header
+            extension = key.extension + extension
+        key = resolve_key(key, extension)
+        self.output = output
+        self.key = key
+        self.compression = compression
+        self.level = level
+        self.block_size = block_size
+        self.cancelled = cancelled
+        self.workers = workers or min(8, os.cpu_count() or 1)
+        self.nonce_prefix = get_random_bytes(8)
+        self.header = ARCHIVE_HEADER.pack(ARCHIVE_MAGIC, ARCHIVE_VERSION, compression, block_size,
+                                          self.nonce_prefix, len(extension)) + extension
+        self.executor = ThreadPoolExecutor(max_workers=self.workers)
+        self.pending = deque()
+        self.buffer = bytearray()
+        self.index = 0
+        self.written = 0 # bytes of the tar stream received
+        self.output.write(self.header)
+
+    def _frame(self, block: bytes, index: int, is_last: bool) -> bytes:
+        payload = b"" if is_last else compress_block(block, self.compression, self.level) # the end marker is empty
+        data = encrypt_chunk(self.key, self.header, self.nonce_prefix, index, payload, is_last)
+        return FRAME_LENGTH.pack(len(data)) + data
+
+    def _submit(self, block: bytes, is_last: bool = False) -> None:
+        self.pending.append(self.executor.submit(self._frame, block, self.index, is_last))
+        self.index += 1
+        while len(self.pending) > 2 * self.workers: # backpressure, the memory stays bounded
+            self.output.write(self.pending.popleft().result())
+
+    def write(self, data) -> int:
+        if self.cancelled is not None and self.cancelled():
+            raise Cancelled()
+        self.buffer += data
+        self.written += len(data)
+        while len(self.buffer) >= self.block_size:
+            self._submit(bytes(self.buffer[:self.block_size]))
+            del self.buffer[:self.block_size]
+        return len(data)
+
+    def close(self) -> None:
+        """flush the last block and write the end marker"""
+        try:
+            if self.buffer:
+                self._submit(bytes(self.buffer))
+                self.buffer = bytearray()
+            self._submit(b"", is_last=True)
+            while self.pending:
+                self.output.write(self.pending.popleft().result())
+        finally:
+            self.executor.shutdown()
+
+    def abort(self) -> None:
+        """stop the workers without writing the end marker (failed or cancelled archive), nothing to do after close()"""
+        self.pending.clear()
+        self.executor.shutdown(cancel_futures=True)
+
+class DecryptedBlockReader:
+    """File-like object reading the frames of an archive, decrypted and decompressed on a thread pool"""
+    def __init__(self, source, key: bytes, workers: int = None, cancelled=None, progress=None):
+        self.source = source
+        self.cancelled = cancelled
+        self.progress = progress
+        self.workers = workers or min(8, os.cpu_count() or 1)
+
+        fixed = source.read(ARCHIVE_HEADER.size)
+        if len(fixed) < ARCHIVE_HEADER.size:
+            raise ValueError("The file is not an encrypted archive")
+        magic, version, self.compression, self.block_size, self.nonce_prefix, extension_length = ARCHIVE_HEADER.unpack(fixed)
+        if magic != ARCHIVE_MAGIC:
+            raise ValueError("The file is not an encrypted archive")
+        if version != ARCHIVE_VERSION:
+            raise ValueError(f"Unsupported archive version {version}")
+        self.extension = source.read(extension_length)
+        self.header = fixed + self.extension
+        self.key = resolve_key(key, self.extension)
+
+        self.executor = ThreadPoolExecutor(max_workers=self.workers)
+        self.pending = deque()
+        self.index = 0
+        self.ended = False # the end marker was read
+        self.buffer = memoryview(b"")
+        self.total = os.fstat(source.fileno()).st_size if hasattr(source, "fileno") else 0
+
+    def _block(self, data: bytes, index: int) -> tuple:
+        """decrypt and decompress a frame, returns (block, is_last)"""
+        is_last = len(data) == TAG_SIZE # only the end marker is empty, a compressed block never is
+        block = decrypt_chunk(self.key, self.header, self.nonce_prefix, self.block_size, index, data, is_last)
+        return (b"" if is_last else decompress_block(block, self.compression)), is_last
+
+    def _fill(self) -> None:
+        """read frames ahead until 2 * workers are pending or the archive ends"""
+        while not self.ended and len(self.pending) < 2 * self.workers:
+            length = self.source.read(FRAME_LENGTH.size)
+            if len(length) < FRAME_LENGTH.size:
+                raise ValueError("The archive is truncated")
+            data = self.source.read(FRAME_LENGTH.unpack(length)[0])
+            if len(data) < TAG_SIZE:
+                raise ValueError("The archive is truncated")
+            self.pending.append(self.executor.submit(self._block, data, self.index))
+            self.index += 1
+            if len(data) == TAG_SIZE: # the end marker
+                self.ended = True
+
+    def read(self, size: int = -1) -> bytes:
+        if self.cancelled is not None and self.cancelled():
+            raise Cancelled()
+        chunks = []
+        while size < 0 or size > 0:
+            if len(self.buffer) == 0:
+                self._fill()
+                if not self.pending:
+                    break
+                block, is_last = self.pending.popleft().result()
+                if is_last:
+                    if self.pending or self.source.read(1): # data after the end marker
+                        raise ValueError("The archive was modified after its end marker")
+                    self.pending.clear()
+                    break
+                self.buffer = memoryview(block)
+                if self.progress is not None:
+                    self.progress(self.source.tell(), self.total)
+            n = len(self.buffer) if size < 0 else min(size, len(self.buffer))
+            chunks.append(bytes(self.buffer[:n]))
+            self.buffer = self.buffer[n:]
+            if size > 0:
+                size -= n
+        return b"".join(chunks)
+
+    def close(self) -> None:
+        self.executor.shutdown(cancel_futures=True)
+
+def folder_size(folder: str) -> int:
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(folder) for name in names
+               if os.path.isfile(os.path.join(root, name)))
+
+def archive_folder(folder: str, output_file: str, key: bytes, compression: str = "zlib", level: int = 6, workers: int = None,
+                   progress=None, cancelled=None, extension: bytes = b"") -> None:
+    """Stream a folder through tar, compression and AES-GCM into output_file
+
+    Args:
+        folder (str): folder to archive, it keeps its name in the archive
+        output_file (str): encrypted archive, removed if the operation fails or is cancelled
+        key (bytes): AES key (16, 24 or 32 bytes)
+        compression (str): "zlib" or "lzma"
+        level (int): compression level (0-9)
+        workers (int): number of blocks compressed and encrypted at the same time
+        progress (callable): called with (bytes done, total bytes) after each file
+        cancelled (callable): polled on each write, the operation stops when it returns True
+        extension (bytes): extra bytes stored (and authenticated) in the header
+    """
+    total = folder_size(folder)
+    try:
+        with open(output_file, "wb") as f:
+            writer = EncryptedBlockWriter(f, key, COMPRESSIONS[compression], level, workers, extension=extension, cancelled=cancelled)
+            try:
+                with tarfile.open(fileobj=writer, mode="w|", bufsize=tarfile.RECORDSIZE) as tar:
+                    def report(tarinfo):
+                        if progress is not None:
+                            progress(min(writer.written, total), total)
+                        return tarinfo
+                    tar.add(folder, arcname=os.path.basename(os.path.abspath(folder)), filter=report)
+                writer.close()
+            finally:
+                writer.abort()
+            if progress is not None:
+                progress(total, total)
+    except BaseException:
+        if os.path.exists(output_file):
+            os.remove(output_file)
+        raise
+
+def extract_archive(input_file: str, output_folder: str, key: bytes, workers: int = None, progress=None, cancelled=None) -> None:
+    """Stream an encrypted archive back to a folder
+
+    The files are extracted as they are decrypted, a failed or cancelled extraction leaves
+    the files extracted so far in output_folder.
+
+    Raises:
+        IntegrityError: if a frame was modified or the key is wrong
+        ValueError: if the archive is truncated or is not an archive
+    """
+    with open(input_file, "rb") as f:
+        reader = DecryptedBlockReader(f, key, workers, cancelled, progress)
+        try:
+            with tarfile.open(fileobj=reader, mode="r|") as tar:
+                if hasattr(tarfile, "data_filter"): # no absolute paths, links or devices out of output_folder
+                    tar.extractall(output_folder, filter="data")
+                else:
+                    tar.extractall(output_folder)
+            reader.read() # check the end marker
+        finally:
+            reader.close()
+
+def read_archive_extension(input_file: str) -> bytes:
+    """Extension bytes stored in the header of an archive"""
+    with open(input_file, "rb") as f:
+        fixed = f.read(ARCHIVE_HEADER.size)
+        if len(fixed) < ARCHIVE_HEADER.size or fixed[:4] != ARCHIVE_MAGIC:
+            raise ValueError("The file is not an encrypted archive")
+        return f.read(ARCHIVE_HEADER.unpack(fixed)[-1])
+
+def load_key(key: str) -> bytes:
+    """Key file content if key is an existing file, else a text key padded to 32 bytes (like EncryptionApp)"""
+    if os.path.exists(key):
+        with open(key, "rb") as file:
+            return file.read()
+    if len(key.encode()) > 32:
+        error("Key value is too long, must be 32 bytes max")
+    key = key.encode()
+    return key if len(key) == 32 else pad(key, 32)
+
+def main():
+    argument_parser = argparse.ArgumentParser(description="Streaming compress-then-encrypt folder archives")
+    argument_parser.add_argument("-c", type=str, help="Folder to compress and encrypt")
+    argument_parser.add_argument("-x", type=str, help="Archive to decrypt and extract")
+    argument_parser.add_argument("-o", type=str, help="Output archive (with -c) or output folder (with -x)")
+    argument_parser.add_argument("-K", type=str, help="Key file or text key")
+    argument_parser.add_argument("--compression", type=str, default="zlib", choices=list(COMPRESSIONS), help="Compression algorithm")
+    argument_parser.add_argument("-l", "--level", type=int, default=6, help="Compression level (0-9)")
+    argument_parser.add_argument("-w", "--workers", type=int, help="Number of compression/encryption threads")
+    argument_parser.add_argument("--kdf", type=str, choices=list(ALGORITHMS), help="Derive the key from the -K password (the parameters are read from the archive to extract)")
+    profiling.add_arguments(argument_parser)
+
+    args = argument_parser.parse_args()
+    profiling.start(args)
+
+    if bool(args.c) == bool(args.x):
+        error("You must provide one action: -c FOLDER or -x ARCHIVE")
+    if not args.o:
+        error("You must provide an output with the -o option")
+    if not args.K:
+        error("You must provide a key with the -K option")
+    if not 0 <= args.level <= 9:
+        error("The compression level must be between 0 and 9")
+    with profiling.phase("load key"):
+        key = PasswordKey(args.K, args.kdf) if args.kdf else load_key(args.K)
+
+    if args.c:
+        if not os.path.isdir(args.c):
+            error("The folder does not exist")
+        with profiling.phase("transform", hot=True): # reading, compression, encryption and writing are pipelined
+            archive_folder(args.c, args.o, key, args.compression, args.level, args.workers)
+        indicator(f"{args.c} archived in {args.o} ({folder_size(args.c)} -> {os.path.getsize(args.o)} bytes)")
+    else:
+        if not os.path.exists(args.x):
+            error("The archive does not exist")
+        try:
+            with profiling.phase("transform", hot=True):
+                extract_archive(args.x, args.o, key, args.workers)
+        except ValueError as e:
+            error(f"Error extracting the archive: {e}")
+        indicator(f"{args.x} extracted in {args.o}")
+
+if __name__ == "__main__":
+    main()
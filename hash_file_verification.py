@@ -2,54 +2,224 @@ from Crypto.Hash import SHA256
 from Crypto.Hash import SHA1
 from Crypto.Hash import MD5
 from colorama import Fore, Style
+from concurrent.futures import ThreadPoolExecutor
 import os
 import argparse
+import profiling
+import daemon_client
+
+"""
+Usage:
+
+python hash_file_verification.py -f file.bin -t sha256
+python hash_file_verification.py -f file.bin -t sha256 --true-hash "..."
+python hash_file_verification.py --dedupe artifacts/ backups/ -t sha256 -w 16
+
+The dedupe mode only reads what it has to: files are grouped by size first,
+then by a hash of their first and last few KB, and only the files still
+colliding after that are hashed in full.
+"""
+
+CHUNK_SIZE = 1024 * 1024 # bytes read at once when hashing a full file
+EDGE_SIZE = 4096 # bytes hashed at the start and at the end of a file in the partial pass
 
 def error(message: str) -> None:
     print(Fore.RED + Style.BRIGHT + message + Style.RESET_ALL)
     os._exit(1)
 
-def hash_file(file_path: str, hash_type: str) -> str:
+def new_hasher(hash_type: str):
+    """Create an empty hash object of the given type (sha1, sha256, md5)"""
     if hash_type == "sha1":
-        h = SHA1.new()
+        return SHA1.new()
     elif hash_type == "sha256":
-        h = SHA256.new()
+        return SHA256.new()
     elif hash_type == "md5":
-        h = MD5.new()
+        return MD5.new()
     else:
         error("Invalid hash type")
-        
+
+def hash_file(file_path: str, hash_type: str) -> str:
+    h = new_hasher(hash_type)
+    with open(file_path, "rb") as file:
+        while True: # read by chunks, the file is never fully in memory
+            with profiling.phase("load input"):
+                chunk = file.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            with profiling.phase("transform", hot=True):
+                h.update(chunk)
+
+    return h.hexdigest()
+
+def partial_hash(file_path: str, hash_type: str, edge_size: int = EDGE_SIZE) -> str:
+    """Hash only the first and the last `edge_size` bytes of a file
+
+    Args:
+        file_path (str): file to hash
+        hash_type (str): hash type (sha1, sha256, md5)
+        edge_size (int): number of bytes read at each end of the file
+
+    Returns:
+        str: hex digest of the head and tail of the file
+    """
+    h = new_hasher(hash_type)
     with open(file_path, "rb") as file:
-        h.update(file.read())
-    
+        h.update(file.read(edge_size))
+        size = os.fstat(file.fileno()).st_size
+        if size > edge_size: # the tail is only needed when it is not already in the head
+            file.seek(max(edge_size, size - edge_size))
+            h.update(file.read(edge_size))
     return h.hexdigest()
 
+def collect_files(paths: list[str]) -> list[str]:
+    """List the regular files in the given paths, directories are walked recursively
+
+    A file reached twice (the same folder given twice, a file and its folder) is listed once,
+    under the path it was first found with.
+    """
+    files = []
+    seen = set()
+    def add(file_path):
+        real_path = os.path.realpath(file_path)
+        if real_path not in seen:
+            seen.add(real_path)
+            files.append(file_path)
+    for path in paths:
+        if os.path.isfile(path):
+            add(path)
+            continue
+        for root, _, names in os.walk(path):
+            for name in names:
+                file_path = os.path.join(root, name)
+                if os.path.isfile(file_path) and not os.path.islink(file_path):
+                    add(file_path)
+    return files
+
+def _split_groups(groups: list[list[str]], key, executor: ThreadPoolExecutor) -> dict:
+    """Split every group of files by the value of key(file), keep only the groups with collisions
+
+    Returns:
+        dict: {(index of the parent group, key value): [files]}
+    """
+    files = [file_path for group in groups for file_path in group]
+    group_index = {file_path: i for i, group in enumerate(groups) for file_path in group}
+
+    buckets = {}
+    for file_path, value in zip(files, executor.map(key, files)):
+        if value is None: # unreadable file, it can't be a duplicate
+            continue
+        buckets.setdefault((group_index[file_path], value), []).append(file_path)
+    return {k: group for k, group in buckets.items() if len(group) > 1}
+
+def find_duplicates(paths: list[str], hash_type: str = "sha256", workers: int = 8, edge_size: int = EDGE_SIZE) -> list[dict]:
+    """Find the identical files in the given paths
+
+    The files are grouped by size, then by a hash of their first and last `edge_size` bytes,
+    and only the files still colliding after that are fully hashed. Each stage runs over a thread pool.
+
+    Args:
+        paths (list[str]): files or directories to scan
+        hash_type (str): hash type used for the partial and full hashes (sha1, sha256, md5)
+        workers (int): number of threads used for each stage
+        edge_size (int): number of bytes hashed at each end of a file in the partial pass
+
+    Returns:
+        list[dict]: one dict per group of duplicates with the keys "hash", "size", "files" and "reclaimable"
+        (bytes freed by keeping only one file of the group, the hardlinks of a file count as one file),
+        sorted by reclaimable bytes
+    """
+    def safe(function):
+        def wrapper(file_path):
+            try:
+                return function(file_path)
+            except OSError:
+                return None
+        return wrapper
+
+    files = collect_files(paths)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # hardlinks share their data, deleting one frees nothing: only one path per inode is compared
+        links = {}
+        for file_path, status in zip(files, executor.map(safe(os.stat), files)):
+            if status is not None:
+                links.setdefault((status.st_dev, status.st_ino), []).append(file_path)
+        files = [group[0] for group in links.values()]
+        links = {group[0]: group for group in links.values()}
+
+        by_size = _split_groups([files], safe(os.path.getsize), executor)
+        size_of = {file_path: size for (_, size), group in by_size.items() for file_path in group}
+
+        by_edges = _split_groups(list(by_size.values()), safe(lambda f: partial_hash(f, hash_type, edge_size)), executor)
+        # files of at most 2*edge_size bytes were fully read by the partial hash, it already is their full hash
+        hashes = {tuple(group): digest for (_, digest), group in by_edges.items() if size_of[group[0]] <= 2 * edge_size}
+        large = [group for group in by_edges.values() if size_of[group[0]] > 2 * edge_size]
+
+        by_content = _split_groups(large, safe(lambda f: hash_file(f, hash_type)), executor)
+        hashes.update({tuple(group): digest for (_, digest), group in by_content.items()})
+
+    duplicates = []
+    for group, digest in hashes.items():
+        size = size_of[group[0]]
+        duplicates.append({
+            "hash": digest,
+            "size": size,
+            "files": sorted(file_path for first in group for file_path in links[first]), # with their hardlinks
+            "reclaimable": size * (len(group) - 1), # one copy of the data is kept
+        })
+    duplicates.sort(key=lambda d: d["reclaimable"], reverse=True)
+    return duplicates
+
 def main():
     argument_parser = argparse.ArgumentParser(description="Hash file verification")
     argument_parser.add_argument("-f", type=str, help="File to hash")
     argument_parser.add_argument("-t", type=str, help="Hash type (sha1, sha256, md5)")
     argument_parser.add_argument("--true-hash", type=str, help="The true hash of the file")
-    
+    argument_parser.add_argument("--dedupe", nargs="+", type=str, help="Files or folders to scan for duplicates")
+    argument_parser.add_argument("-w", "--workers", type=int, default=8, help="Number of threads used by the dedupe mode")
+    profiling.add_arguments(argument_parser)
+
     args = argument_parser.parse_args()
-    
+    profiling.start(args)
+
+    if not args.t:
+        error("You must provide a hash type with the -t option")
+    new_hasher(args.t) # exit early on an invalid hash type
+
+    if args.dedupe:
+        if args.workers < 1:
+            error("The number of workers must be at least 1")
+        for path in args.dedupe:
+            if not os.path.exists(path):
+                error(f"{path} does not exist")
+        with profiling.phase("transform", hot=True):
+            duplicates = find_duplicates(args.dedupe, args.t, args.workers)
+        for duplicate in duplicates:
+            print(f"{duplicate['hash']} ({duplicate['size']} bytes, {duplicate['reclaimable']} reclaimable)")
+            for file_path in duplicate["files"]:
+                print(f"    {file_path}")
+        total = sum(duplicate["reclaimable"] for duplicate in duplicates)
+        print(f"{len(duplicates)} duplicate groups, {total} bytes reclaimable")
+        return
+
     if not args.f:
         error("You must provide a file to hash with the -f option")
     else:
         if not os.path.exists(args.f):
             error("The file does not exist")
-        
-    if not args.t:
-        error("You must provide a hash type with the -t option")
-    
-    hashed = hash_file(args.f, args.t)
+
+    result = daemon_client.try_call("hash.file", {"path": os.path.abspath(args.f), "hash_type": args.t})
+    if result is not None: # a daemon is running, pycryptodome is already imported there
+        hashed = result["hash"]
+    else:
+        hashed = hash_file(args.f, args.t) # the read and hash phases are timed chunk by chunk
     print(hashed)
-    
+
     if args.true_hash:
         if hashed == args.true_hash:
             print('the hashes are the same')
         else:
             print("the hash are different")
             # test to change the hash to the true hash
-    
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,134 @@
+# encoding: utf-8
+from PyQt6.QtWidgets import QAbstractScrollArea, QWidget, QVBoxLayout, QHBoxLayout, QLineEdit, QLabel
+from PyQt6.QtGui import QPainter, QFontDatabase
+import mmap
+import os
+
+"""
+Virtualized hex viewer used by EncryptionApp
+
+The file is memory mapped and only the visible rows are rendered: the pages are
+read by the OS when a row is painted, so multi-GB files are browsed instantly
+with a bounded memory use.
+
+The mapping is read-only, a viewed file must be closed (close_file) before it is
+truncated or rewritten.
+"""
+
+BYTES_PER_ROW = 16
+MAX_SCROLL = 2**30 # a QScrollBar holds an int, bigger files scroll by several rows per step
+
+class HexViewer(QAbstractScrollArea):
+    """hex + ascii view of a memory mapped file, one row = BYTES_PER_ROW bytes"""
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.path = None
+        self.offset = 0 # bytes of the file before the displayed data (a header for example)
+        self._file = None
+        self._map = None
+        self.setFont(QFontDatabase.systemFont(QFontDatabase.SystemFont.FixedFont))
+        self.verticalScrollBar().valueChanged.connect(self.viewport().update)
+
+    def open_file(self, path:str, offset:int=0) -> None:
+        """display the content of the file starting at offset"""
+        self.close_file()
+        size = os.path.getsize(path)
+        self.path = path
+        self.offset = min(offset, size)
+        if size > 0: # an empty file can't be mapped
+            self._file = open(path, "rb")
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._update_scrollbar()
+        self.verticalScrollBar().setValue(0)
+        self.viewport().update()
+
+    def close_file(self) -> None:
+        """release the mapping of the current file"""
+        if self._map is not None:
+            self._map.close()
+            self._file.close()
+        self.path, self._file, self._map = None, None, None
+        self._update_scrollbar()
+        self.viewport().update()
+
+    def data_size(self) -> int:
+        return len(self._map) - self.offset if self._map is not None else 0
+
+    def row_count(self) -> int:
+        return (self.data_size() + BYTES_PER_ROW - 1) // BYTES_PER_ROW
+
+    def visible_rows(self) -> int:
+        return max(1, self.viewport().height() // self.fontMetrics().height())
+
+    def rows_per_step(self) -> int:
+        return max(1, -(-self.row_count() // MAX_SCROLL))
+
+    def first_row(self) -> int:
+        return self.verticalScrollBar().value() * self.rows_per_step()
+
+    def _update_scrollbar(self) -> None:
+        bar = self.verticalScrollBar()
+        bar.setRange(0, max(0, self.row_count() - self.visible_rows()) // self.rows_per_step())
+        bar.setPageStep(max(1, self.visible_rows() // self.rows_per_step()))
+
+    def jump_to(self, position:int) -> None:
+        """scroll to the row containing the byte at position (relative to the displayed data)"""
+        self.verticalScrollBar().setValue(max(0, position) // BYTES_PER_ROW // self.rows_per_step())
+
+    def resizeEvent(self, event) -> None:
+        super().resizeEvent(event)
+        self._update_scrollbar()
+
+    def row_text(self, row:int) -> str:
+        """text of one row: address, hex bytes and printable ascii"""
+        start = self.offset + row * BYTES_PER_ROW
+        data = self._map[start:start + BYTES_PER_ROW]
+        hex_part = data.hex(" ").ljust(BYTES_PER_ROW * 3 - 1)
+        ascii_part = "".join(chr(b) if 32 <= b < 127 else "." for b in data)
+        return f"{row * BYTES_PER_ROW:010x}  {hex_part}  {ascii_part}"
+
+    def paintEvent(self, event) -> None:
+        painter = QPainter(self.viewport())
+        if self._map is None:
+            painter.drawText(4, self.fontMetrics().ascent(), "no file")
+            return
+        line_height = self.fontMetrics().height()
+        first = self.first_row()
+        last = min(self.row_count(), first + self.visible_rows() + 1)
+        for i, row in enumerate(range(first, last)): # only the visible rows are read and rendered
+            painter.drawText(4, i * line_height + self.fontMetrics().ascent(), self.row_text(row))
+
+class HexView(QWidget):
+    """HexViewer with a title and a jump-to-offset box"""
+    def __init__(self, title:str, parent=None):
+        super().__init__(parent)
+        self.viewer = HexViewer()
+        self.title = QLabel(title)
+        self.jump_edit = QLineEdit()
+        self.jump_edit.setPlaceholderText("Go to offset (0x... or decimal)")
+        self.jump_edit.returnPressed.connect(self.jump)
+
+        top_layout = QHBoxLayout()
+        top_layout.addWidget(self.title)
+        top_layout.addWidget(self.jump_edit)
+        layout = QVBoxLayout()
+        layout.addLayout(top_layout)
+        layout.addWidget(self.viewer)
+        self.setLayout(layout)
+
+    def open_file(self, path:str, offset:int=0) -> None:
+        self.viewer.open_file(path, offset)
+
+    def close_file(self) -> None:
+        self.viewer.close_file()
+
+    def jump(self) -> None:
+        """jump to the offset typed in the jump box"""
+        text = self.jump_edit.text().strip().lower()
+        try:
+            position = int(text, 16) if text.startswith("0x") else int(text)
+        except ValueError:
+            self.jump_edit.setStyleSheet("color: red")
+            return
+        self.jump_edit.setStyleSheet("")
+        self.viewer.jump_to(position)
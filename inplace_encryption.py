@@ -0,0 +1,278 @@
+from Crypto.Cipher import AES
+from Crypto.Hash import SHA256
+from Crypto.Random import get_random_bytes
+from Crypto.Util.Padding import pad
+from colorama import Fore, Style
+import argparse
+import struct
+import mmap
+import zlib
+import os
+import profiling
+
+"""
+In-place AES encryption of huge files
+
+The file is encrypted window by window directly in a memory mapping of itself
+(cipher.encrypt(view, output=view)), so no free space for a second copy and no
+copy in memory are needed. Only modes that keep the size of the data work:
+CTR for any file, ECB for files whose size is a multiple of 16 bytes (no padding).
+
+A small journal (<file>.journal) holds the offset of the window being processed
+and, for each JOURNAL_BLOCK of it, the checksums of its bytes before and after
+the transformation (no data, the plaintext is never copied to the journal). Both
+modes transform a block independently of the others, so if a run is interrupted
+the next run with the same arguments compares each block of the window with its
+checksums, transforms the ones still original, keeps the done ones and resumes
+after the window. The window is transformed front to back, the block holding
+the interruption point is done up to a split point: it is found by trying each
+split (byte for CTR, AES block for ECB) against the checksum of the original block. For CTR the nonce is saved in <file>.nonce, it is needed to decrypt.
+
+Usage:
+
+python inplace_encryption.py -i disk.img -K key.key -e --mode ctr
+python inplace_encryption.py -i disk.img -K key.key -d --mode ctr
+python inplace_encryption.py -i aligned.bin -K "0x546869732069732061206b6579" -e --mode ecb
+"""
+
+WINDOW_SIZE = 16 * 1024 * 1024 # bytes transformed between two journal updates
+JOURNAL_BLOCK = 4096 # bytes per checksum pair, a multiple of the AES block size (8 bytes of journal per 4 KiB)
+JOURNAL_MAGIC = b"PFJ2"
+JOURNAL_HEADER = struct.Struct(">4sBB8s8sQI") # magic, mode, decrypt, nonce, key check, window offset, window length
+JOURNAL_CHECKSUMS = struct.Struct(">II") # crc32 of a block before and after the transformation
+MODES = {"ecb": AES.MODE_ECB, "ctr": AES.MODE_CTR}
+
+def error(message: str) -> None:
+    print(Fore.RED + Style.BRIGHT + message + Style.RESET_ALL)
+    os._exit(1)
+
+def indicator(message: str) -> None:
+    print(Fore.GREEN + message + Style.RESET_ALL)
+
+def _key_check(key: bytes, nonce: bytes) -> bytes:
+    """short fingerprint of the key, a run can't be resumed with another key"""
+    return SHA256.new(key + nonce).digest()[:8]
+
+def _write_journal(journal_path: str, header: bytes, checksums: bytes) -> None:
+    """atomically replace the journal, it is on disk before the window is modified"""
+    temporary = journal_path + ".tmp"
+    with open(temporary, "wb") as f:
+        f.write(header)
+        f.write(checksums)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, journal_path)
+
+def _read_journal(journal_path: str) -> tuple:
+    """Returns: (mode, decrypt, nonce, key check, window offset, window length, [(before, after) checksums of each block])"""
+    with open(journal_path, "rb") as f:
+        header = f.read(JOURNAL_HEADER.size)
+        if len(header) < JOURNAL_HEADER.size:
+            raise ValueError("The journal is corrupted")
+        magic, mode, decrypt, nonce, key_check, offset, length = JOURNAL_HEADER.unpack(header)
+        data = f.read()
+    blocks = -(-length // JOURNAL_BLOCK)
+    if magic != JOURNAL_MAGIC or len(data) != blocks * JOURNAL_CHECKSUMS.size:
+        raise ValueError("The journal is corrupted")
+    return mode, bool(decrypt), nonce, key_check, offset, length, list(JOURNAL_CHECKSUMS.iter_unpack(data))
+
+def _new_cipher(key: bytes, mode: int, nonce: bytes, offset: int, decrypt: bool):
+    """cipher of the window starting at offset, CTR starts at the counter of that block"""
+    if mode == AES.MODE_CTR:
+        cipher = AES.new(key, AES.MODE_CTR, nonce=nonce, initial_value=offset // AES.block_size)
+        return cipher.encrypt # CTR decryption is the same operation
+    cipher = AES.new(key, AES.MODE_ECB)
+    return cipher.decrypt if decrypt else cipher.encrypt
+
+def _window_checksums(view, transform) -> bytes:
+    """before and after checksums of each block of a window, the window itself is not modified"""
+    scratch = bytearray(JOURNAL_BLOCK)
+    checksums = bytearray()
+    for start in range(0, len(view), JOURNAL_BLOCK):
+        with view[start:start + JOURNAL_BLOCK] as block, memoryview(scratch)[:len(block)] as output:
+            transform(block, output=output) # the blocks are in order, the CTR counter follows
+            checksums += JOURNAL_CHECKSUMS.pack(zlib.crc32(block), zlib.crc32(output))
+    return bytes(checksums)
+
+def _split_block(block, key: bytes, mode: int, nonce: bytes, decrypt: bool, offset: int, before: int):
+    """original bytes of a block transformed up to an unknown split point, None if no split matches
+
+    The block is T(original)[:split] + original[split:], undoing T on the whole block gives the
+    original prefix of every split, the crc32 of each candidate is computed from the running crc
+    of that prefix.
+    """
+    undone = _new_cipher(key, mode, nonce, offset, not decrypt)(bytes(block)) # the same operation for CTR
+    step = 1 if mode == AES.MODE_CTR else AES.block_size # ECB writes whole AES blocks
+    prefix_crc = 0
+    for split in range(0, len(block) + 1, step):
+        if split:
+            prefix_crc = zlib.crc32(undone[split - step:split], prefix_crc)
+        if zlib.crc32(block[split:], prefix_crc) == before:
+            return undone[:split] + bytes(block[split:])
+    return None
+
+def _recover_window(f, key: bytes, mode: int, nonce: bytes, decrypt: bool, offset: int, length: int, checksums: list) -> None:
+    """finish the window of an interrupted run, block by block
+
+    Raises:
+        ValueError: if a block matches neither checksum nor a split of the two (modified since the interruption)
+    """
+    with mmap.mmap(f.fileno(), length, offset=offset) as mapping:
+        with memoryview(mapping) as view:
+            for index, (before, after) in enumerate(checksums):
+                start = index * JOURNAL_BLOCK
+                with view[start:start + JOURNAL_BLOCK] as block:
+                    current = zlib.crc32(block)
+                    if current == after: # written before the interruption
+                        continue
+                    if current != before: # the block of the interruption point
+                        original = _split_block(block, key, mode, nonce, decrypt, offset + start, before)
+                        if original is None:
+                            raise ValueError(f"The block at byte {offset + start} changed since the interruption, the run can't be resumed")
+                        block[:] = original
+                    _new_cipher(key, mode, nonce, offset + start, decrypt)(block, output=block)
+                    if zlib.crc32(block) != after:
+                        raise ValueError(f"The block at byte {offset + start} doesn't match the journal once transformed")
+        mapping.flush()
+
+def transform_in_place(path: str, key: bytes, mode: str = "ctr", decrypt: bool = False, nonce: bytes = None,
+                       window_size: int = WINDOW_SIZE, progress=None) -> bytes:
+    """Encrypt or decrypt a file in place, resuming an interrupted run if a journal exists
+
+    Args:
+        path (str): file to transform
+        key (bytes): AES key (16, 24 or 32 bytes)
+        mode (str): "ctr" or "ecb" (the file size must be a multiple of 16 bytes)
+        decrypt (bool): decrypt instead of encrypt (the same operation for CTR)
+        nonce (bytes): 8 bytes CTR nonce, random if None when encrypting, required when decrypting
+        window_size (int): bytes mapped and transformed at once, rounded to the mmap granularity
+        progress (callable): called with (bytes done, total bytes) after each window
+
+    Raises:
+        ValueError: if the mode can't work in place, the nonce is missing or the journal belongs to another run
+
+    Returns:
+        bytes: the CTR nonce (empty for ECB)
+
+    A run killed in the middle of a window is resumed, the block of the interruption point included:
+
+    >>> import tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), "disk.img")
+    >>> data = os.urandom(1 << 20)
+    >>> with open(path, "wb") as f: _ = f.write(data)
+    >>> key, nonce = b"k" * 16, b"n" * 8
+    >>> with open(path, "r+b") as f, mmap.mmap(f.fileno(), 0) as mapping, memoryview(mapping) as view:
+    ...     header = JOURNAL_HEADER.pack(JOURNAL_MAGIC, AES.MODE_CTR, False, nonce, _key_check(key, nonce), 0, len(view))
+    ...     _write_journal(path + ".journal", header, _window_checksums(view, _new_cipher(key, AES.MODE_CTR, nonce, 0, False)))
+    ...     with view[:100000] as done: # killed after 100000 bytes
+    ...         _new_cipher(key, AES.MODE_CTR, nonce, 0, False)(done, output=done)
+    >>> transform_in_place(path, key, "ctr") == nonce
+    True
+    >>> transform_in_place(path, key, "ctr", decrypt=True, nonce=nonce) == nonce
+    True
+    >>> open(path, "rb").read() == data, os.path.exists(path + ".journal")
+    (True, False)
+    """
+    aes_mode = MODES[mode]
+    size = os.path.getsize(path)
+    if aes_mode == AES.MODE_ECB and size % AES.block_size != 0:
+        raise ValueError("ECB in place needs a file size multiple of 16 bytes, use CTR")
+    window_size = max(mmap.ALLOCATIONGRANULARITY, window_size - window_size % mmap.ALLOCATIONGRANULARITY)
+    journal_path = path + ".journal"
+
+    offset = 0
+    if os.path.exists(journal_path): # resume an interrupted run
+        journal_mode, journal_decrypt, journal_nonce, key_check, offset, length, checksums = _read_journal(journal_path)
+        if journal_mode != aes_mode or journal_decrypt != decrypt:
+            raise ValueError("The journal belongs to another operation, finish it first")
+        nonce = journal_nonce[:8] if aes_mode == AES.MODE_CTR else b""
+        if key_check != _key_check(key, journal_nonce):
+            raise ValueError("The journal was made with another key")
+        with open(path, "r+b") as f: # the window may be half transformed, only its original blocks are left to do
+            _recover_window(f, key, aes_mode, nonce, decrypt, offset, length, checksums)
+        offset += length
+    elif aes_mode == AES.MODE_CTR:
+        if nonce is None:
+            if decrypt:
+                raise ValueError("The CTR nonce is needed to decrypt")
+            nonce = get_random_bytes(8)
+        if not decrypt:
+            with open(path + ".nonce", "w") as f: # saved before the data changes
+                f.write(nonce.hex())
+    else:
+        nonce = b""
+
+    stored_nonce = nonce.ljust(8, b"\x00")
+    key_check = _key_check(key, stored_nonce)
+    with open(path, "r+b") as f:
+        while offset < size:
+            length = min(window_size, size - offset)
+            with mmap.mmap(f.fileno(), length, offset=offset) as mapping:
+                with memoryview(mapping) as view:
+                    header = JOURNAL_HEADER.pack(JOURNAL_MAGIC, aes_mode, decrypt, stored_nonce, key_check, offset, length)
+                    # a second pass of AES in a scratch block (CPU only) instead of a copy of the window on disk
+                    _write_journal(journal_path, header, _window_checksums(view, _new_cipher(key, aes_mode, nonce, offset, decrypt)))
+                    transform = _new_cipher(key, aes_mode, nonce, offset, decrypt)
+                    transform(view, output=view) # in place, no copy of the window
+                mapping.flush() # on disk before the journal moves to the next window
+            offset += length
+            if progress is not None:
+                progress(offset, size)
+    if os.path.exists(journal_path):
+        os.remove(journal_path)
+    return nonce
+
+def load_key(key: str) -> bytes:
+    """Key file content if key is an existing file, hex key with 0x prefix, else a text key padded to 16 bytes (like aes128ecb)"""
+    if os.path.exists(key):
+        with open(key, "rb") as file:
+            return file.read()
+    if key[:2] == "0x":
+        key = bytes.fromhex(key[2:])
+    else:
+        key = key.encode()
+    return key if len(key) in (16, 24, 32) else pad(key, AES.block_size)[:32]
+
+def main():
+    argument_parser = argparse.ArgumentParser(description="In-place AES encryption of huge files")
+    argument_parser.add_argument("-i", type=str, help="File to encrypt or decrypt in place")
+    argument_parser.add_argument("-K", type=str, help="Key file, 0x hex key or text key")
+    argument_parser.add_argument("-e", action="store_true", help="Encode")
+    argument_parser.add_argument("-d", action="store_true", help="Decode")
+    argument_parser.add_argument("--mode", type=str, default="ctr", choices=list(MODES), help="AES mode")
+    argument_parser.add_argument("--nonce", type=str, help="CTR nonce in hex (default: read from <file>.nonce when decoding)")
+    argument_parser.add_argument("--window", type=int, default=WINDOW_SIZE, help="Bytes transformed between two journal updates")
+    profiling.add_arguments(argument_parser)
+
+    args = argument_parser.parse_args()
+    profiling.start(args)
+
+    if not args.i or not os.path.isfile(args.i):
+        error("You must provide an existing file with the -i option")
+    if not args.K:
+        error("You must provide a key with the -K option")
+    if args.e == args.d:
+        error("You must provide one action: -e for encoding or -d for decoding")
+
+    nonce = bytes.fromhex(args.nonce) if args.nonce else None
+    if args.mode == "ctr" and args.d and nonce is None and not os.path.exists(args.i + ".journal"):
+        if not os.path.exists(args.i + ".nonce"):
+            error("You must provide the CTR nonce with --nonce or a <file>.nonce file")
+        with open(args.i + ".nonce", "r") as f:
+            nonce = bytes.fromhex(f.read().strip())
+    if os.path.exists(args.i + ".journal"):
+        indicator("Journal found, resuming the interrupted run...")
+
+    try:
+        with profiling.phase("load key"):
+            key = load_key(args.K)
+        with profiling.phase("transform", hot=True):
+            nonce = transform_in_place(args.i, key, args.mode, args.d, nonce, args.window)
+    except ValueError as e:
+        error(str(e))
+    indicator(f"{args.i} {'decrypted' if args.d else 'encrypted'} in place")
+    if args.mode == "ctr" and args.e:
+        print(f"Nonce: {nonce.hex()} (saved in {args.i}.nonce)")
+
+if __name__ == "__main__":
+    main()
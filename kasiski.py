@@ -0,0 +1,171 @@
+import numpy as np
+
+"""
+Kasiski examination of poly-alphabet ciphertexts with a suffix array
+
+A repeated sequence of the plain text enciphered by the same part of the key
+gives a repeated sequence of the ciphertext, and the distance between the two
+is a multiple of the period. The repeats are found with a suffix array and its
+LCP array (longest common prefix of neighbour suffixes) instead of comparing
+every pair of substrings, which is quadratic and can't handle MB texts:
+
+- suffix array: prefix doubling in numpy, the suffixes are sorted by their
+  first 2^k characters with one argsort per k (O(n log n) each, log of the
+  longest repeat rounds)
+- LCP: binary lifting over the ranks kept at each doubling step, exact and
+  vectorized over all the neighbour pairs
+- the suffixes sharing their first min_length letters are neighbours in the
+  suffix array: each group is one repeated n-gram with all its positions
+
+The distances between consecutive positions of a repeat are reduced to a
+histogram of their factors (how many distances each candidate period divides),
+and combined with the periodic index of coincidence of cipher_classifier.py to
+rank the periods. Positions count every character, like poly_alphabet_cipher.py.
+
+Usage:
+
+>>> import poly_alphabet_cipher
+>>> keys = ["qwertyuiopasdfghjklzxcvbnm", "mnbvcxzlkjhgfdsapoiuytrewq", "plokmijnuhbygvtfcrdxeszwaq"]
+>>> text = poly_alphabet_cipher.encode("the cat and the dog saw the man and the cat ran to the dog " * 20, keys)
+>>> rank_periods(text)[0]["period"]
+3
+"""
+
+MIN_LENGTH = 3 # letters of the shortest repeat
+MAX_PERIOD = 20 # periods ranked
+
+def suffix_array(data: np.ndarray) -> tuple:
+    """Suffix array of a byte array by prefix doubling
+
+    Returns:
+        tuple: (suffix array, ranks) where ranks[k][i] is the rank of data[i:i+2**k] among the
+        prefixes of that length (a prefix cut by the end of the data ranks apart)
+
+    >>> suffix_array(np.frombuffer(b"banana", dtype=np.uint8))[0].tolist()
+    [5, 3, 1, 0, 4, 2]
+    """
+    n = len(data)
+    order = np.argsort(data, kind="stable")
+    sorted_data = data[order]
+    rank = np.empty(n, dtype=np.int64) # dense ranks: all the prefixes are different once the largest is n - 1
+    rank[order] = np.cumsum(np.concatenate(([0], sorted_data[1:] != sorted_data[:-1])))
+    ranks = [rank.astype(np.int32)]
+    step = 1
+    while n > 1 and rank[order[-1]] < n - 1:
+        following = np.full(n, -1, dtype=np.int64) # the prefix ends before the data: lowest
+        following[:n - step] = rank[step:]
+        key = rank * (int(rank.max()) + 2) + following + 1
+        order = np.argsort(key) # equal keys are equal prefixes, their order doesn't matter
+        sorted_key = key[order]
+        rank = np.empty(n, dtype=np.int64)
+        rank[order] = np.cumsum(np.concatenate(([0], sorted_key[1:] != sorted_key[:-1])))
+        ranks.append(rank.astype(np.int32))
+        step *= 2
+    return order, ranks
+
+def lcp_array(order: np.ndarray, ranks: list[np.ndarray]) -> np.ndarray:
+    """lcp[i]: common prefix length of the suffixes order[i] and order[i + 1]
+
+    >>> order, ranks = suffix_array(np.frombuffer(b"banana", dtype=np.uint8))
+    >>> lcp_array(order, ranks).tolist()
+    [1, 3, 0, 0, 2]
+    """
+    n = len(order)
+    first, second = order[:-1].astype(np.int64), order[1:].astype(np.int64)
+    lcp = np.zeros(n - 1, dtype=np.int64)
+    # equal ranks at level k: the next 2**k characters are equal, the largest steps first
+    for level in reversed(range(len(ranks))):
+        a, b = first + lcp, second + lcp
+        inside = (a < n) & (b < n)
+        equal = np.zeros(n - 1, dtype=bool)
+        equal[inside] = ranks[level][a[inside]] == ranks[level][b[inside]]
+        lcp += equal * (1 << level)
+    return lcp
+
+def _groups(text: str, min_length: int) -> tuple:
+    """suffixes starting with min_length letters, sorted, with the group of their first min_length characters"""
+    data = np.frombuffer(text.lower().encode("ascii", "replace"), dtype=np.uint8)
+    order, ranks = suffix_array(data)
+    lcp = lcp_array(order, ranks) if len(order) > 1 else np.zeros(0, dtype=np.int64)
+    is_letter = (data >= 97) & (data <= 122)
+    letters = np.ones(len(data), dtype=bool) # the suffix starts with min_length letters
+    for i in range(min_length):
+        letters[:len(data) - i] &= is_letter[i:]
+        letters[len(data) - i:] = False
+    # a new group starts where the common prefix with the previous suffix is too short
+    starts = np.concatenate(([True], lcp < min_length))
+    group = np.cumsum(starts) - 1
+    keep = letters[order]
+    return order[keep], group[keep], lcp, keep
+
+def repeats(text: str, min_length: int = MIN_LENGTH):
+    """Every repeated n-gram of min_length letters or more with all its positions
+
+    Yields:
+        tuple: (repeat, positions), the repeat is the longest prefix shared by all the positions
+
+    >>> [(repeat, positions.tolist()) for repeat, positions in repeats("the cat and the dog and the cat")]
+    [('and the ', [8, 20]), ('cat', [4, 28]), ('the ', [0, 12, 24])]
+    """
+    positions, group, lcp, keep = _groups(text, min_length)
+    if len(positions) == 0:
+        return
+    boundaries = np.flatnonzero(np.concatenate(([True], group[1:] != group[:-1], [True])))
+    suffix_index = np.flatnonzero(keep) # index in the suffix array of each kept suffix
+    for begin, end in zip(boundaries[:-1], boundaries[1:]):
+        if end - begin < 2:
+            continue
+        # the shared prefix of the group is the smallest lcp between its neighbour suffixes
+        length = int(lcp[suffix_index[begin]:suffix_index[end - 1]].min())
+        found = np.sort(positions[begin:end])
+        yield text[found[0]:found[0] + length].lower(), found
+
+def distances(text: str, min_length: int = MIN_LENGTH) -> np.ndarray:
+    """distances between consecutive positions of every repeated n-gram
+
+    >>> distances("abcxyzabcxyzabc").tolist()
+    [6, 6, 6, 6, 6, 6, 6]
+    """
+    positions, group, _, _ = _groups(text, min_length)
+    order = np.lexsort((positions, group))
+    positions, group = positions[order], group[order]
+    same = group[1:] == group[:-1]
+    return np.diff(positions)[same]
+
+def factor_histogram(found: np.ndarray, max_period: int = MAX_PERIOD) -> np.ndarray:
+    """histogram[f]: number of distances divisible by f, for f up to max_period (0 and 1 unused)
+
+    >>> factor_histogram(np.array([6, 12, 9]), 6).tolist()
+    [0, 0, 2, 3, 1, 0, 2]
+    """
+    histogram = np.zeros(max_period + 1, dtype=np.int64)
+    for factor in range(2, max_period + 1):
+        histogram[factor] = np.count_nonzero(found % factor == 0)
+    return histogram
+
+def rank_periods(text: str, max_period: int = MAX_PERIOD, min_length: int = MIN_LENGTH) -> list[dict]:
+    """Periods ranked by the Kasiski factors and the periodic index of coincidence
+
+    The factor score of a period is the share of distances it divides above chance (1 / period),
+    its multiples score lower. The IoC score is the gain of the mean column IoC over the IoC of
+    the whole text. Each score is scaled to 1 for the best period, the rank is their mean.
+
+    Returns:
+        list[dict]: {"period", "score", "kasiski", "ioc", "distances"} from the most likely period
+    """
+    import cipher_classifier
+    found = distances(text, min_length)
+    histogram = factor_histogram(found, max_period)
+    periods = np.arange(2, max_period + 1)
+    kasiski_score = histogram[2:] / len(found) - 1 / periods if len(found) else np.zeros(len(periods))
+    period_ioc = cipher_classifier.statistics([text], max_period)["period_ioc"][0]
+    ioc_score = np.nan_to_num(period_ioc[1:] - period_ioc[0])
+
+    def scaled(values):
+        best = values.max()
+        return np.clip(values / best, 0, None) if best > 0 else np.zeros(len(values))
+    score = (scaled(kasiski_score) + scaled(ioc_score)) / 2
+    ranking = np.argsort(-score, kind="stable")
+    return [{"period": int(periods[i]), "score": round(float(score[i]), 3), "kasiski": round(float(kasiski_score[i]), 4),
+             "ioc": round(float(period_ioc[i + 1]), 4) if not np.isnan(period_ioc[i + 1]) else None, # JSON has no NaN
+             "distances": int(histogram[periods[i]])} for i in ranking]
@@ -0,0 +1,323 @@
+from Crypto.Protocol.KDF import scrypt, PBKDF2
+from Crypto.Hash import SHA256
+from Crypto.Random import get_random_bytes
+from collections import OrderedDict
+from threading import Lock
+from colorama import Fore, Style
+import argparse
+import struct
+import time
+import os
+import profiling
+
+"""
+Password based key derivation (scrypt or PBKDF2-HMAC-SHA256)
+
+A typed password is a weak AES key: it is short, guessable and fast to try.
+The AES key is derived from the password with a slow KDF whose parameters are
+calibrated on the machine for a target derivation time. The salt and the
+parameters are stored in the file header (the v2 / archive extension field), so
+the file can be decrypted on any machine.
+
+Any file can also be the key (FileKey): its content is streamed through SHA256.
+
+Derived keys are kept in an in-process cache (LRU with a time to live): a batch
+encrypted with one PasswordKey shares the same salt and pays the KDF once.
+
+Usage:
+
+python key_derivation.py --calibrate
+python key_derivation.py --calibrate -a pbkdf2 -t 1
+"""
+
+KDF_MAGIC = b"KDF1"
+KDF_PARAMS = struct.Struct(">4sB16sIBB") # magic, algorithm, salt, cost (scrypt N or PBKDF2 iterations), r, p
+SCRYPT = 1
+PBKDF2_SHA256 = 2
+ALGORITHMS = {"scrypt": SCRYPT, "pbkdf2": PBKDF2_SHA256}
+TARGET_TIME = 0.5 # seconds per derivation
+KEY_SIZE = 32
+
+# bounds of the parameters, a header can't ask for an absurd amount of work or memory
+MIN_SCRYPT_N, MAX_SCRYPT_N = 2**14, 2**20 # 16 MB to 1 GB of memory with r = 8
+MIN_ITERATIONS, MAX_ITERATIONS = 100_000, 100_000_000
+
+FILE_KEY_PREFIX = b"PFS key file\x00"
+FILE_CHUNK_SIZE = 1024 * 1024
+
+def error(message: str) -> None:
+    print(Fore.RED + Style.BRIGHT + message + Style.RESET_ALL)
+    os._exit(1)
+
+def indicator(message: str) -> None:
+    print(Fore.GREEN + message + Style.RESET_ALL)
+
+def derive(password: bytes, params: dict, key_size: int = KEY_SIZE) -> bytes:
+    """Derive a key from the password, without cache
+
+    Args:
+        password (bytes): password
+        params (dict): algorithm, salt, cost, r, p (see new_params)
+        key_size (int): size of the derived key in bytes
+
+    Returns:
+        bytes: derived key
+
+    >>> params = {"algorithm": PBKDF2_SHA256, "salt": bytes(16), "cost": 1000, "r": 0, "p": 0}
+    >>> derive(b"password", params, 16).hex()
+    '7460518eb1741d7be7b2914828b97011'
+    """
+    if params["algorithm"] == SCRYPT:
+        return scrypt(password, params["salt"], key_size, N=params["cost"], r=params["r"], p=params["p"])
+    if params["algorithm"] == PBKDF2_SHA256:
+        return PBKDF2(password, params["salt"], key_size, count=params["cost"], hmac_hash_module=SHA256)
+    raise ValueError(f"Unknown key derivation algorithm {params['algorithm']}")
+
+# calibration results of this process, the machine doesn't change between two files
+_calibrated = {}
+
+def calibrate(algorithm: str = "scrypt", target: float = TARGET_TIME) -> dict:
+    """Benchmark the machine and pick the parameters of a derivation taking about target seconds
+
+    The cost is measured once with a small work factor and scaled linearly
+    (scrypt N is rounded to a power of 2). The result is cached for the process.
+
+    Returns:
+        dict: algorithm, cost, r, p (no salt)
+    """
+    if (algorithm, target) in _calibrated:
+        return dict(_calibrated[algorithm, target])
+    salt = bytes(16)
+    if algorithm == "scrypt":
+        start = time.perf_counter()
+        scrypt(b"calibration", salt, KEY_SIZE, N=MIN_SCRYPT_N, r=8, p=1)
+        elapsed = max(time.perf_counter() - start, 1e-6)
+        n = MIN_SCRYPT_N
+        while n < MAX_SCRYPT_N and elapsed * (2 * n) / MIN_SCRYPT_N <= target * 1.5:
+            n *= 2
+        params = {"algorithm": SCRYPT, "cost": n, "r": 8, "p": 1}
+    elif algorithm == "pbkdf2":
+        sample = 20_000
+        start = time.perf_counter()
+        PBKDF2(b"calibration", salt, KEY_SIZE, count=sample, hmac_hash_module=SHA256)
+        elapsed = max(time.perf_counter() - start, 1e-6)
+        iterations = min(MAX_ITERATIONS, max(MIN_ITERATIONS, int(sample * target / elapsed)))
+        params = {"algorithm": PBKDF2_SHA256, "cost": iterations, "r": 0, "p": 0}
+    else:
+        raise ValueError(f"Unknown key derivation algorithm {algorithm}, use one of {list(ALGORITHMS)}")
+    _calibrated[algorithm, target] = params
+    return dict(params)
+
+def new_params(algorithm: str = "scrypt", target: float = TARGET_TIME) -> dict:
+    """Calibrated parameters with a new random salt"""
+    params = calibrate(algorithm, target)
+    params["salt"] = get_random_bytes(16)
+    return params
+
+def encode_params(params: dict) -> bytes:
+    """Pack the parameters for a file header
+
+    >>> params = {"algorithm": SCRYPT, "salt": bytes(16), "cost": 2**14, "r": 8, "p": 1}
+    >>> decode_params(encode_params(params)) == params
+    True
+    """
+    return KDF_PARAMS.pack(KDF_MAGIC, params["algorithm"], params["salt"], params["cost"], params["r"], params["p"])
+
+def decode_params(extension: bytes) -> dict:
+    """Unpack the parameters at the start of a header extension, None if there are none
+
+    Raises:
+        ValueError: if the parameters are out of the allowed bounds (corrupted or malicious header)
+    """
+    if len(extension) < KDF_PARAMS.size or extension[:len(KDF_MAGIC)] != KDF_MAGIC:
+        return None
+    _, algorithm, salt, cost, r, p = KDF_PARAMS.unpack(extension[:KDF_PARAMS.size])
+    if algorithm == SCRYPT:
+        if not MIN_SCRYPT_N <= cost <= MAX_SCRYPT_N or cost & (cost - 1) or not 1 <= r <= 32 or not 1 <= p <= 16:
+            raise ValueError("Invalid scrypt parameters in the header")
+    elif algorithm == PBKDF2_SHA256:
+        if not MIN_ITERATIONS <= cost <= MAX_ITERATIONS:
+            raise ValueError("Invalid PBKDF2 parameters in the header")
+    else:
+        raise ValueError(f"Unknown key derivation algorithm {algorithm} in the header")
+    return {"algorithm": algorithm, "salt": salt, "cost": cost, "r": r, "p": p}
+
+class KeyCache:
+    """Thread-safe LRU cache of derived keys, an entry expires ttl seconds after it was derived
+
+    The entries are keyed by a SHA256 of the password, the parameters and the key size.
+    """
+    def __init__(self, maxsize: int = 32, ttl: float = 600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._keys = OrderedDict() # fingerprint => (key, expiry time)
+        self._derivations = {} # fingerprint => Lock held while the key is derived
+        self._lock = Lock()
+
+    def _lookup(self, fingerprint: bytes) -> bytes:
+        """cached key or None, the caller holds the lock"""
+        entry = self._keys.get(fingerprint)
+        if entry is None or entry[1] <= time.monotonic():
+            return None
+        self._keys.move_to_end(fingerprint)
+        return entry[0]
+
+    def _fingerprint(self, password: bytes, params: dict, key_size: int) -> bytes:
+        return SHA256.new(encode_params(params) + key_size.to_bytes(2, "big") + password).digest()
+
+    def get(self, password: bytes, params: dict, key_size: int = KEY_SIZE) -> bytes:
+        """Return the derived key, the KDF only runs on a miss or an expired entry
+
+        Threads asking for the same key at the same time wait for a single derivation
+        (a batch starts several jobs at once, and scrypt may use hundreds of MB).
+        """
+        fingerprint = self._fingerprint(password, params, key_size)
+        return self.get_or_compute(fingerprint, lambda: derive(password, params, key_size))
+
+    def get_or_compute(self, fingerprint: bytes, compute) -> bytes:
+        """Return the cached key of fingerprint, compute() is called on a miss or an expired entry"""
+        with self._lock:
+            key = self._lookup(fingerprint)
+            if key is not None:
+                return key
+            derivation = self._derivations.setdefault(fingerprint, Lock())
+        with derivation: # derived outside of the cache lock, the KDF is slow
+            with self._lock:
+                key = self._lookup(fingerprint)
+            if key is not None:
+                return key
+            key = compute()
+            with self._lock:
+                self._keys[fingerprint] = (key, time.monotonic() + self.ttl)
+                self._keys.move_to_end(fingerprint)
+                while len(self._keys) > self.maxsize:
+                    self._keys.popitem(last=False)
+                self._derivations.pop(fingerprint, None)
+        return key
+
+    def clear(self) -> None:
+        with self._lock:
+            self._keys.clear()
+
+DERIVED_KEYS = KeyCache()
+FILE_KEYS = KeyCache(maxsize=64) # keys of key files, keyed by path, size and modification time
+
+def hash_key_file(path: str, key_size: int = KEY_SIZE, chunk_size: int = FILE_CHUNK_SIZE) -> bytes:
+    """Key derived from the content of any file, streamed through SHA256 (never fully in memory)
+
+    >>> import tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), "photo.jpg")
+    >>> with open(path, "wb") as f: _ = f.write(b"not really a photo")
+    >>> hash_key_file(path, 16).hex()
+    'fda8950344ace3e2d00f729600d99d47'
+    """
+    hasher = SHA256.new(FILE_KEY_PREFIX) # domain separation, the key isn't the plain SHA256 of the file
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    with open(path, "rb") as f:
+        while (length := f.readinto(buffer)):
+            hasher.update(view[:length])
+    return hasher.digest()[:key_size]
+
+class PasswordKey:
+    """A password used as key, the AES key is derived with a KDF
+
+    The salt is drawn once per PasswordKey, so every file encrypted with the same
+    instance (a batch) shares the parameters and the derived key is computed once.
+    file_encryption (v2) and folder_archive accept a PasswordKey wherever a key is
+    expected: the parameters are written in, or read from, the header extension.
+
+    Args:
+        password (str | bytes): the password
+        algorithm (str): "scrypt" or "pbkdf2", used when encrypting
+        target (float): derivation time targeted by the calibration, in seconds
+        key_size (int): size of the derived AES key
+    """
+    def __init__(self, password, algorithm: str = "scrypt", target: float = TARGET_TIME, key_size: int = KEY_SIZE):
+        self.password = password.encode() if isinstance(password, str) else password
+        self.algorithm = algorithm
+        self.target = target
+        self.key_size = key_size
+        self._params = None # calibrated on the first encryption only
+        self._lock = Lock()
+        self.derivation_time = 0.0 # duration of the last derive call, 0 when the cache answered quickly
+
+    @property
+    def params(self) -> dict:
+        with self._lock: # the jobs of a batch must share one salt
+            if self._params is None:
+                self._params = new_params(self.algorithm, self.target)
+            return self._params
+
+    @property
+    def extension(self) -> bytes:
+        """header bytes of the parameters used to encrypt"""
+        return encode_params(self.params)
+
+    def derive(self, extension: bytes = None) -> bytes:
+        """Derive the key for the parameters of a header extension (the own parameters if None)
+
+        Raises:
+            ValueError: if the extension holds no key derivation parameters
+        """
+        params = self.params if extension is None else decode_params(extension)
+        if params is None:
+            raise ValueError("The file has no key derivation parameters, it was not encrypted with a password")
+        start = time.perf_counter()
+        key = DERIVED_KEYS.get(self.password, params, self.key_size)
+        self.derivation_time = time.perf_counter() - start
+        return key
+
+class FileKey:
+    """Any file (an image, a document...) used as key material
+
+    The AES key is a streaming SHA256 of the file content. The result is cached
+    by (path, size, modification time), so repeated operations with a big key
+    file hash it once, and a modified file is hashed again.
+
+    Args:
+        path (str): key file, of any size
+        key_size (int): size of the derived AES key
+    """
+    def __init__(self, path: str, key_size: int = KEY_SIZE):
+        self.path = os.path.realpath(path)
+        self.key_size = key_size
+        self.derivation_time = 0.0 # duration of the last derive call, about 0 when the cache answered
+
+    def derive(self, extension: bytes = None) -> bytes:
+        """Hash the key file (or return the cached key), the header extension isn't used"""
+        status = os.stat(self.path)
+        fingerprint = SHA256.new(f"{self.path}\x00{status.st_size}\x00{status.st_mtime_ns}\x00{self.key_size}".encode()).digest()
+        start = time.perf_counter()
+        key = FILE_KEYS.get_or_compute(fingerprint, lambda: hash_key_file(self.path, self.key_size))
+        self.derivation_time = time.perf_counter() - start
+        return key
+
+def main():
+    argument_parser = argparse.ArgumentParser(description="Password based key derivation")
+    argument_parser.add_argument("--calibrate", action="store_true", help="Benchmark the machine and print the KDF parameters")
+    argument_parser.add_argument("-a", "--algorithm", type=str, default="scrypt", choices=list(ALGORITHMS), help="KDF algorithm")
+    argument_parser.add_argument("-t", "--target", type=float, default=TARGET_TIME, help="Target derivation time in seconds")
+    profiling.add_arguments(argument_parser)
+
+    args = argument_parser.parse_args()
+    profiling.start(args)
+
+    if not args.calibrate:
+        error("You must provide an action: --calibrate")
+    if args.target <= 0:
+        error("The target time must be positive")
+    with profiling.phase("calibrate", hot=True):
+        params = new_params(args.algorithm, args.target)
+    start = time.perf_counter()
+    with profiling.phase("derive key", hot=True):
+        derive(b"calibration", params)
+    elapsed = time.perf_counter() - start
+    if args.algorithm == "scrypt":
+        indicator(f"scrypt N={params['cost']} r={params['r']} p={params['p']} ({128 * params['cost'] * params['r'] // 2**20} MB)")
+    else:
+        indicator(f"PBKDF2-HMAC-SHA256 iterations={params['cost']}")
+    print(f"Derivation time: {elapsed:.3f}s (target {args.target}s)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+from colorama import Fore, Style
+import argparse
+import secrets
+import string
+import os
+import profiling
+
+"""
+Key generation for the whole toolset, from the OS CSPRNG
+
+- printable keys (AES text keys): os.urandom is read in large blocks and the
+  bytes are mapped to the charset with bytes.translate, the rejected bytes are
+  deleted in the same C call (no modulo bias, no per-character Python loop)
+- random bytes keys (AES key files)
+- alphabet permutations (mono/poly alphabet ciphers): Fisher-Yates shuffle
+  driven by secrets.token_bytes blocks (rejection sampling for each index)
+
+The bulk functions draw all the randomness of N keys at once, thousands of keys
+take a few milliseconds.
+
+Usage:
+
+python key_generator.py -n 1000 -l 32 -o keys.txt
+python key_generator.py --type alphabet -n 5
+python key_generator.py --type bytes -l 32 -n 10
+"""
+
+# printable ASCII without space and the characters that break quoting: " ' / \
+PRINTABLE = bytes(c for c in range(33, 127) if c not in b"\"'/\\")
+ALPHABET = string.ascii_lowercase
+BLOCK_SIZE = 64 * 1024
+
+# a random byte b < LIMIT is mapped to PRINTABLE[b % len(PRINTABLE)], the others are rejected (uniform output)
+_LIMIT = 256 - 256 % len(PRINTABLE)
+_TABLE = bytes(PRINTABLE[b % len(PRINTABLE)] if b < _LIMIT else 0 for b in range(256))
+_REJECTED = bytes(range(_LIMIT, 256))
+
+def error(message: str) -> None:
+    print(Fore.RED + Style.BRIGHT + message + Style.RESET_ALL)
+    os._exit(1)
+
+def indicator(message: str) -> None:
+    print(Fore.GREEN + message + Style.RESET_ALL)
+
+def random_printable(size: int) -> bytes:
+    """Uniform random bytes of the PRINTABLE charset
+
+    Args:
+        size (int): number of characters
+
+    Returns:
+        bytes: the characters
+
+    >>> key = random_printable(1000)
+    >>> len(key), set(key) <= set(PRINTABLE)
+    (1000, True)
+    """
+    output = bytearray()
+    while len(output) < size:
+        missing = size - len(output)
+        block = os.urandom(max(BLOCK_SIZE if missing > BLOCK_SIZE else 0, missing * 256 // _LIMIT + 16))
+        output += block.translate(_TABLE, _REJECTED) # map and reject in one pass
+    return bytes(output[:size])
+
+def printable_key(size: int = 32) -> bytes:
+    """One printable key, used for the text keys of the AES tools"""
+    return random_printable(size)
+
+def printable_keys(count: int, size: int = 32) -> list[bytes]:
+    """count printable keys of size characters, drawn in one block
+
+    >>> keys = printable_keys(500, 16)
+    >>> len(keys), {len(key) for key in keys}
+    (500, {16})
+    """
+    data = random_printable(count * size)
+    return [data[i:i + size] for i in range(0, count * size, size)]
+
+def random_keys(count: int, size: int = 32) -> list[bytes]:
+    """count random binary keys (AES key files), drawn in one os.urandom call"""
+    data = os.urandom(count * size)
+    return [data[i:i + size] for i in range(0, count * size, size)]
+
+def _random_bytes(block_size: int = 4096):
+    """endless iterator over CSPRNG bytes, drawn by blocks"""
+    while True:
+        yield from secrets.token_bytes(block_size)
+
+def _fisher_yates(alphabet: str, pool) -> str:
+    """Fisher-Yates shuffle, j is drawn uniformly in [0, i] from the bytes of pool (rejection sampling)"""
+    letters = list(alphabet)
+    for i in range(len(letters) - 1, 0, -1):
+        limit = 256 - 256 % (i + 1)
+        b = next(pool)
+        while b >= limit:
+            b = next(pool)
+        j = b % (i + 1)
+        letters[i], letters[j] = letters[j], letters[i]
+    return "".join(letters)
+
+def alphabet_permutation(alphabet: str = ALPHABET) -> str:
+    """Random permutation of the alphabet (key of the mono/poly alphabet ciphers)
+
+    Fisher-Yates shuffle driven by secrets, every permutation is equally likely.
+
+    >>> key = alphabet_permutation()
+    >>> sorted(key) == list(ALPHABET)
+    True
+    """
+    return alphabet_permutations(1, alphabet)[0]
+
+def alphabet_permutations(count: int, alphabet: str = ALPHABET) -> list[str]:
+    """count random permutations of the alphabet, the randomness is drawn by blocks for all of them"""
+    if len(alphabet) > 256: # a byte can't index the alphabet
+        return ["".join(sorted(alphabet, key=lambda _: secrets.randbits(64))) for _ in range(count)]
+    pool = _random_bytes(min(BLOCK_SIZE, 64 * count))
+    return [_fisher_yates(alphabet, pool) for _ in range(count)]
+
+def generate(key_type: str, count: int, size: int = 32) -> list[str]:
+    """count keys of a type as text lines: printable keys as is, binary keys in hex, alphabets"""
+    if key_type == "printable":
+        return [key.decode("ascii") for key in printable_keys(count, size)]
+    if key_type == "bytes":
+        return [key.hex() for key in random_keys(count, size)]
+    if key_type == "alphabet":
+        return alphabet_permutations(count)
+    raise ValueError(f"Unknown key type {key_type}")
+
+def main():
+    argument_parser = argparse.ArgumentParser(description="Bulk key generation from the OS CSPRNG")
+    argument_parser.add_argument("--type", type=str, default="printable", choices=["printable", "bytes", "alphabet"], help="Kind of key")
+    argument_parser.add_argument("-n", type=int, default=1, help="Number of keys")
+    argument_parser.add_argument("-l", type=int, default=32, help="Key length (characters or bytes)")
+    argument_parser.add_argument("-o", type=str, help="Output file (one key per line), else the keys are printed")
+    profiling.add_arguments(argument_parser)
+
+    args = argument_parser.parse_args()
+    profiling.start(args)
+
+    if args.n < 1 or args.l < 1:
+        error("The number and the length of the keys must be positive")
+
+    with profiling.phase("transform", hot=True):
+        keys = generate(args.type, args.n, args.l)
+    if args.o:
+        with profiling.phase("write output"), open(args.o, "w") as file:
+            file.write("\n".join(keys) + "\n")
+        indicator(f"{args.n} keys written in {args.o}")
+    else:
+        print("\n".join(keys))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+from Crypto.Hash import SHA256
+from colorama import Fore, Style
+from concurrent.futures import ThreadPoolExecutor
+from rsa_sign_and_verify import Signer, hash_stream
+from hash_file_verification import collect_files
+import argparse
+import json
+import os
+import profiling
+
+"""
+Merkle-root signature manifests
+
+Every file of a folder is hashed (in parallel), the digests are the leaves of a
+Merkle tree and only the root is signed: one RSA operation for the whole folder.
+Each file gets an inclusion proof in the manifest, so one file can be checked
+against the signed root without rehashing the others.
+
+Usage:
+
+python merkle_manifest.py --sign release/ -priv_k private_key.pem -o manifest.json
+python merkle_manifest.py --verify release/lib/a.so release/bin/b -r release/ -m manifest.json -pub_k public_key.pem
+"""
+
+MANIFEST_VERSION = 1
+LEAF_PREFIX = b"\x00" # domain separation, a leaf can't be taken for an inner node
+NODE_PREFIX = b"\x01"
+
+def error(message: str) -> None:
+    print(Fore.RED + Style.BRIGHT + message + Style.RESET_ALL)
+    os._exit(1)
+
+def indicator(message: str) -> None:
+    print(Fore.GREEN + message + Style.RESET_ALL)
+
+def leaf_hash(name: str, digest: bytes) -> bytes:
+    """Hash of a leaf, it binds the relative path of the file to its digest"""
+    return SHA256.new(LEAF_PREFIX + name.encode("utf-8") + b"\x00" + digest).digest()
+
+def node_hash(left: bytes, right: bytes) -> bytes:
+    return SHA256.new(NODE_PREFIX + left + right).digest()
+
+def build_tree(leaves: list[bytes]) -> list[list[bytes]]:
+    """Build the levels of a Merkle tree, from the leaves (level 0) to the root (last level)
+
+    An unpaired node is carried up to the next level as is.
+
+    >>> len(build_tree([b"a", b"b", b"c"]))
+    3
+    >>> build_tree([b"a", b"b", b"c"])[1][1]
+    b'c'
+    """
+    if not leaves:
+        raise ValueError("A Merkle tree needs at least one leaf")
+    levels = [list(leaves)]
+    while len(levels[-1]) > 1:
+        level = levels[-1]
+        parents = [node_hash(level[i], level[i + 1]) for i in range(0, len(level) - 1, 2)]
+        if len(level) % 2 == 1:
+            parents.append(level[-1])
+        levels.append(parents)
+    return levels
+
+def inclusion_proof(levels: list[list[bytes]], index: int) -> list[tuple]:
+    """Siblings needed to recompute the root from the leaf at index
+
+    Returns:
+        list[tuple]: ("L" or "R", sibling hash) from the leaf to the root, the side is where the sibling is
+    """
+    proof = []
+    for level in levels[:-1]:
+        sibling = index ^ 1
+        if sibling < len(level): # an unpaired node has no sibling at this level
+            proof.append(("L" if sibling < index else "R", level[sibling]))
+        index //= 2
+    return proof
+
+def root_from_proof(leaf: bytes, proof: list[tuple]) -> bytes:
+    """Recompute the root from a leaf and its inclusion proof
+
+    >>> levels = build_tree([bytes([i]) * 32 for i in range(5)])
+    >>> all(root_from_proof(levels[0][i], inclusion_proof(levels, i)) == levels[-1][0] for i in range(5))
+    True
+    """
+    node = leaf
+    for side, sibling in proof:
+        node = node_hash(sibling, node) if side == "L" else node_hash(node, sibling)
+    return node
+
+def sign_tree(root_dir: str, private_key_path: str, workers: int = None) -> dict:
+    """Hash a folder in parallel, sign the Merkle root and build the manifest
+
+    Args:
+        root_dir (str): folder to sign, the manifest uses paths relative to it
+        private_key_path (str): path to the PEM private key
+        workers (int): number of hashing threads
+
+    Returns:
+        dict: the manifest, with the signed root and one inclusion proof per file
+
+    Raises:
+        ValueError: if the folder has no file (a Merkle tree needs a leaf) or the key can't be imported
+    """
+    paths = sorted(collect_files([root_dir]))
+    if not paths:
+        raise ValueError(f"{root_dir} has no file to sign")
+    names = [os.path.relpath(path, root_dir).replace(os.sep, "/") for path in paths]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        digests = list(executor.map(lambda path: hash_stream(path).digest(), paths))
+
+    levels = build_tree([leaf_hash(name, digest) for name, digest in zip(names, digests)])
+    root = levels[-1][0]
+
+    signer = Signer()
+    signer.import_key(private_key_path=private_key_path)
+    signature = signer.sign_digest(root) # the only RSA operation
+
+    files = {}
+    for index, (name, digest) in enumerate(zip(names, digests)):
+        files[name] = {
+            "digest": digest.hex(),
+            "proof": [[side, sibling.hex()] for side, sibling in inclusion_proof(levels, index)],
+        }
+    return {
+        "version": MANIFEST_VERSION,
+        "hash": "sha256",
+        "root": root.hex(),
+        "signature": signature.hex(),
+        "files": files,
+    }
+
+def verify_root(manifest: dict, public_key_path: str) -> bool:
+    """Check the signature of the manifest root"""
+    signer = Signer()
+    signer.import_key(public_key_path=public_key_path)
+    return signer.verify_digest(bytes.fromhex(manifest["root"]), bytes.fromhex(manifest["signature"]))
+
+def verify_file(manifest: dict, name: str, path: str) -> bool:
+    """Check one file against the manifest root, only this file is hashed
+
+    The signature of the root must be checked separately with verify_root.
+
+    Args:
+        manifest (dict): the manifest
+        name (str): relative path of the file in the manifest
+        path (str): path of the file on disk
+
+    Returns:
+        bool: True if the file is the one that was signed
+    """
+    entry = manifest["files"].get(name)
+    if entry is None:
+        return False
+    leaf = leaf_hash(name, hash_stream(path).digest())
+    proof = [(side, bytes.fromhex(sibling)) for side, sibling in entry["proof"]]
+    return root_from_proof(leaf, proof).hex() == manifest["root"]
+
+def main():
+    argument_parser = argparse.ArgumentParser(description="Merkle-root signature manifests")
+    argument_parser.add_argument("--sign", type=str, help="Folder to sign")
+    argument_parser.add_argument("--verify", nargs="+", type=str, help="Files to verify against the manifest")
+    argument_parser.add_argument("-m", "--manifest", type=str, help="Manifest to verify against")
+    argument_parser.add_argument("-o", "--output", type=str, default="manifest.json", help="Output manifest file name")
+    argument_parser.add_argument("-r", "--root", type=str, help="Signed folder, the files to verify are relative to it (default: the folder of the manifest)")
+    argument_parser.add_argument("-pub_k", "--public_key", type=str, help="Key file for verifying")
+    argument_parser.add_argument("-priv_k", "--private_key", type=str, help="Key file for signing")
+    argument_parser.add_argument("-w", "--workers", type=int, help="Number of hashing threads")
+    profiling.add_arguments(argument_parser)
+
+    args = argument_parser.parse_args()
+    profiling.start(args)
+
+    if bool(args.sign) == bool(args.verify):
+        error("You must provide one action: --sign FOLDER or --verify FILE [FILE ...]")
+
+    if args.sign:
+        if not os.path.isdir(args.sign):
+            error("The folder does not exist")
+        if not args.private_key or not os.path.exists(args.private_key):
+            error("You must provide an existing private key file with -priv_k")
+        try:
+            with profiling.phase("transform", hot=True):
+                manifest = sign_tree(args.sign, args.private_key, args.workers)
+        except ValueError as e:
+            error(str(e))
+        with profiling.phase("write output"), open(args.output, "w") as file:
+            json.dump(manifest, file, indent=1)
+        indicator(f"{len(manifest['files'])} files signed with one signature, manifest saved as {args.output}")
+        return
+
+    if not args.manifest or not os.path.exists(args.manifest):
+        error("You must provide an existing manifest with -m")
+    if not args.public_key or not os.path.exists(args.public_key):
+        error("You must provide an existing public key file with -pub_k")
+    with profiling.phase("load input"), open(args.manifest, "r") as file:
+        manifest = json.load(file)
+    if manifest.get("version") != MANIFEST_VERSION:
+        error("Unsupported manifest version")
+    with profiling.phase("load key"):
+        root_valid = verify_root(manifest, args.public_key)
+    if not root_valid:
+        error("The signature of the manifest root is invalid")
+
+    root_dir = args.root if args.root else os.path.dirname(os.path.abspath(args.manifest))
+    failed = 0
+    for path in args.verify:
+        if not os.path.exists(path):
+            print(Fore.RED + f"{path}: does not exist" + Style.RESET_ALL)
+            failed += 1
+            continue
+        name = os.path.relpath(path, root_dir).replace(os.sep, "/")
+        with profiling.phase("transform", hot=True):
+            valid = verify_file(manifest, name, path)
+        if valid:
+            indicator(f"{path}: valid")
+        else:
+            print(Fore.RED + f"{path}: invalid" + Style.RESET_ALL)
+            failed += 1
+    if failed:
+        error(f"{failed} of {len(args.verify)} files failed the verification") # exit status 1 for the scripts
+
+if __name__ == "__main__":
+    main()
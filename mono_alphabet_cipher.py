@@ -2,8 +2,8 @@
 # import
 import argparse
 import os
-import random
-import doctest
+from key_generator import alphabet_permutation
+import profiling
 
 # define
 alphabet = 'abcdefghijklmnopqrstuvwxyz'
@@ -47,9 +47,7 @@ def keyGenerator() -> str:
     Returns:
         str: a random key alphabet
     """
-    key = list(alphabet)
-    random.shuffle(key)
-    return ''.join(key)
+    return alphabet_permutation(alphabet) # Fisher-Yates shuffle from the OS CSPRNG
 
 def main():
     """command line interface for the mono-alphabet cipher
@@ -63,9 +61,11 @@ def main():
     argument_parser.add_argument("-d", action="store_true", help="Decode")
     argument_parser.add_argument( "--create-key", action="store_true", help="Create a random key alphabet and exit")
     argument_parser.add_argument("--print-only", action="store_true", help="Print the output only")
+    profiling.add_arguments(argument_parser)
 
     # Parse the arguments
     args = argument_parser.parse_args()
+    profiling.start(args)
 
     # Check the arguments
     if args.create_key:
@@ -100,18 +100,19 @@ def main():
         if not os.path.exists(args.i):
             print("The file does not exist")
             exit(1)
-        with open(args.i, "r", encoding='UTF-8') as file:
+        with profiling.phase("load input"), open(args.i, "r", encoding='UTF-8') as file:
             text = file.read()
     else:
         text = args.i
     
     
     # Process the text
-    if args.e:
-        output = encode(text, args.K)
-    
-    if args.d:
-        output = decode(text, args.K)
+    with profiling.phase("transform", hot=True):
+        if args.e:
+            output = encode(text, args.K)
+        
+        if args.d:
+            output = decode(text, args.K)
     
     
     # Print or save the output
@@ -119,9 +120,10 @@ def main():
         print("")
         print(output)
     else:
-        with open(args.o, "w") as file:
+        with profiling.phase("write output"), open(args.o, "w") as file:
             file.write(output)
 
 if __name__ == "__main__":
+    import doctest # only when run as a script, not when imported by pfs.py
     doctest.testmod()
     main()
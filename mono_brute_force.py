@@ -1,6 +1,6 @@
-import matplotlib.pyplot as plt
 import argparse
 import os
+import profiling
 
 alphabet = 'abcdefghijklmnopqrstuvwxyz'
 
@@ -21,6 +21,7 @@ def frequency_analysis(text:str) -> dict:
     return freq
 
 def addlabels(x,y,size=10):
+    import matplotlib.pyplot as plt # only imported when a graph is drawn
     for i in range(len(x)):
         plt.text(i, y[i]//2, y[i], ha = 'center', fontsize=size)
 
@@ -29,6 +30,7 @@ def plot_frequency(freq:dict):
     Args:
         freq (dict): frequency of each letter
     """
+    import matplotlib.pyplot as plt
     plt.bar(freq.keys(), freq.values())
     addlabels(list(freq.keys()), list(freq.values()), size=7)
     plt.show()
@@ -38,14 +40,16 @@ def find_e(text:str) -> dict:
     sorted_freq = sorted(freq.items(), key=lambda x: x[1], reverse=True)
     return sorted_freq[0][0]
 
-if __name__ == "__main__":
+def main():
     # Create the parser
     argument_parser = argparse.ArgumentParser(description="Caesar cipher")
     argument_parser.add_argument("-i", type=str, help="Text to cipher")
     argument_parser.add_argument("--graph", action="store_true", help="show the graph of the frequency of the letters")
+    profiling.add_arguments(argument_parser)
     
     # Parse the arguments
     args = argument_parser.parse_args()
+    profiling.start(args)
     
     # Check the arguments
     if not args.i:
@@ -58,16 +62,19 @@ if __name__ == "__main__":
         if not os.path.exists(args.i):
             print("The file does not exist")
             exit(1)
-        with open(args.i, "r", encoding='UTF-8') as file:
+        with profiling.phase("load input"), open(args.i, "r", encoding='UTF-8') as file:
             text = file.read()
     else:
         text = args.i
     # Frequency analysis
-    freq = frequency_analysis(text)
+    with profiling.phase("transform", hot=True):
+        freq = frequency_analysis(text)
+        e = find_e(text)
     
     
-    print(f"the most frequent letter is: {find_e(text)} with {freq[find_e(text)]} occurences")
+    print(f"the most frequent letter is: {e} with {freq[e]} occurences")
     if args.graph:
         plot_frequency(freq)
-    
-    
\ No newline at end of file
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 import argparse
 import os
+import profiling
 
 def bytes_xor(a:bytes, b:bytes) -> bytes: return bytes(x^y for x,y in zip(a,b))
 
@@ -16,9 +17,11 @@ def main():
     argument_parser.add_argument("-K", type=str, help="the keys alphabet")
     argument_parser.add_argument("-o", type=str, help="Output file name")
     argument_parser.add_argument("--print-only", action="store_true", help="Print the output only")
+    profiling.add_arguments(argument_parser)
     
     # Parse the arguments
     args = argument_parser.parse_args()
+    profiling.start(args)
     
     # Check the arguments
     if not args.i:
@@ -26,7 +29,7 @@ def main():
         exit(1)
     else:
         if os.path.exists(args.i):
-            with open(args.i, "rb") as file:
+            with profiling.phase("load input"), open(args.i, "rb") as file:
                 byte_input = file.read()
         else:
             print("file does not exist")
@@ -39,7 +42,7 @@ def main():
             file.write(args.K)
     else:
         if os.path.exists(args.K):
-            with open(args.K, "rb") as file:
+            with profiling.phase("load key"), open(args.K, "rb") as file:
                 args.K = file.read()
         else:
             print("key file does not exist")
@@ -50,13 +53,14 @@ def main():
         exit(1)
     
     # Process the text
-    output = one_time_pad_encrypt(byte_input, args.K)
+    with profiling.phase("transform", hot=True):
+        output = one_time_pad_encrypt(byte_input, args.K)
     
     # Print or save the output
     if args.print_only:
         print(output)
     else:
-        with open(args.o, "wb") as file:
+        with profiling.phase("write output"), open(args.o, "wb") as file:
             file.write(output)
 
 if __name__ == "__main__":
@@ -0,0 +1,335 @@
+from collections import OrderedDict
+from threading import Lock
+import functools
+import json
+import os
+
+"""
+Operations of the toolset as JSON-friendly functions
+
+Every operation takes keyword parameters that fit in JSON (texts, numbers,
+paths, bytes as hex strings) and returns a dict, so the daemon and the batch
+runner can run any of them from a request or a job line:
+
+    run("caesar.encode", {"text": "hello", "shift": 3}) => {"text": "khoor"}
+
+The state that is slow to build is kept warm for the life of the process:
+word dictionaries, imported RSA keys and expanded AES keys. The files are
+cached with their modification time, an edited file is loaded again.
+
+Each operation has a kind telling the daemon where to run it: "inline" (fast,
+in the event loop), "thread" (waits on I/O) or "process" (pure Python CPU work,
+on the process pool). Some operations only become "process" on large inputs.
+
+The tool modules are imported by the operations that use them, listing or
+running one operation doesn't import the whole toolset.
+"""
+
+HASH_TYPES = ("sha1", "sha256", "md5")
+LARGE_INPUT = 256 * 1024 # characters (or hex digits) above which a pure Python operation goes to the process pool
+
+OPERATIONS = {} # name => (function, kind), kind is a string or a function of the params
+
+def operation(name: str, kind="inline"):
+    """Register an operation, kind is "inline", "thread", "process" or a function of the params returning one"""
+    def register(function):
+        OPERATIONS[name] = (function, kind)
+        return function
+    return register
+
+def _large_text(params: dict) -> str:
+    """process for the large inputs of a pure Python operation, inline for the small ones"""
+    size = max((len(value) for value in params.values() if isinstance(value, str)), default=0)
+    return "process" if size > LARGE_INPUT else "inline"
+
+def kind(name: str, params: dict) -> str:
+    """Where the operation should run: inline, thread or process
+
+    >>> kind("caesar.encode", {"text": "hello", "shift": 3}), kind("hash.file", {"path": "f"})
+    ('inline', 'thread')
+    """
+    if name not in OPERATIONS:
+        raise ValueError(f"Unknown operation {name}")
+    operation_kind = OPERATIONS[name][1]
+    return operation_kind(params) if callable(operation_kind) else operation_kind
+
+def run(name: str, params: dict = None) -> dict:
+    """Run an operation with its parameters
+
+    Raises:
+        ValueError: if the operation is unknown or the parameters are invalid
+
+    >>> run("caesar.encode", {"text": "hello", "shift": 3})
+    {'text': 'khoor'}
+    >>> run("transposition.decode", run("transposition.encode", {"text": "hello im max", "columns": 3}) | {"columns": 3})
+    {'text': 'hello im max'}
+    """
+    if name not in OPERATIONS:
+        raise ValueError(f"Unknown operation {name}")
+    try:
+        return OPERATIONS[name][0](**(params or {}))
+    except TypeError as e: # missing or unexpected parameter
+        raise ValueError(f"Invalid parameters for {name}: {e}") from None
+
+def error_message(e: Exception) -> str:
+    """message of a failed operation, the ValueErrors are the ones meant for the user
+
+    >>> error_message(ValueError("Unknown operation x")), error_message(KeyError("k"))
+    ('Unknown operation x', "KeyError: 'k'")
+    """
+    return str(e) if isinstance(e, ValueError) else f"{type(e).__name__}: {e}"
+
+def _bytes(value: str, name: str) -> bytes:
+    try:
+        return bytes.fromhex(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be a hex string") from None
+
+def _file_version(path: str) -> tuple:
+    """cache key of a file: its real path and modification time (the file is reloaded when it changes)"""
+    path = os.path.realpath(path)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        raise ValueError(f"{path} does not exist") from None
+    return path, stat.st_mtime_ns, stat.st_size
+
+#### Warm state
+
+@functools.lru_cache(maxsize=8)
+def _dictionary(path: str, mtime_ns: int, size: int) -> frozenset:
+    with open(path, "r") as file:
+        return frozenset(json.load(file)) # only the words are looked up
+
+_loaded_dictionaries = set() # versions loaded by _dictionary, an eviction (more than 8 dictionaries) is not tracked
+
+def load_dictionary(path: str) -> frozenset:
+    """words of a JSON dictionary (list or dict of words), cached while the file doesn't change"""
+    version = _file_version(path)
+    words = _dictionary(*version)
+    _loaded_dictionaries.add(version)
+    return words
+
+def dictionary_loaded(path: str) -> bool:
+    """the dictionary is in the cache, load_dictionary returns at once"""
+    return _file_version(path) in _loaded_dictionaries
+
+@functools.lru_cache(maxsize=32)
+def _rsa_key(path: str, mtime_ns: int, size: int):
+    from Crypto.PublicKey import RSA
+    with open(path, "rb") as file:
+        return RSA.import_key(file.read())
+
+def load_rsa_key(path: str):
+    """imported RSA key (private or public) of a PEM file, cached while the file doesn't change"""
+    return _rsa_key(*_file_version(path))
+
+@functools.lru_cache(maxsize=8)
+def _pattern_index(path: str, mtime_ns: int, size: int):
+    import word_patterns
+    return word_patterns.PatternIndex(path)
+
+def load_pattern_index(path: str):
+    """memory mapped word-pattern index (word_patterns.py), cached while the file doesn't change"""
+    return _pattern_index(*_file_version(path))
+
+class CipherCache:
+    """LRU cache of expanded AES-ECB ciphers, the key schedule is computed once per key
+
+    ECB ciphers keep no state between two calls, one object serves every request of a key.
+    """
+    def __init__(self, maxsize: int = 256):
+        self.maxsize = maxsize
+        self._ciphers = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key: bytes):
+        with self._lock:
+            if key in self._ciphers:
+                self._ciphers.move_to_end(key)
+                return self._ciphers[key]
+        from Crypto.Cipher import AES
+        from Crypto.Util.Padding import pad
+        cipher = AES.new(pad(key, AES.block_size), AES.MODE_ECB) # the key is padded like aes128ecb
+        with self._lock:
+            self._ciphers[key] = cipher
+            while len(self._ciphers) > self.maxsize:
+                self._ciphers.popitem(last=False)
+        return cipher
+
+    def __len__(self) -> int:
+        return len(self._ciphers)
+
+AES_CIPHERS = CipherCache()
+
+def cache_info() -> dict:
+    """size of the warm caches of this process"""
+    return {"dictionaries": _dictionary.cache_info().currsize, "rsa_keys": _rsa_key.cache_info().currsize,
+            "pattern_indexes": _pattern_index.cache_info().currsize, "aes_ciphers": len(AES_CIPHERS)}
+
+def warm(dictionaries: list[str] = (), rsa_keys: list[str] = ()) -> None:
+    """Import the tool modules and load the given files in the caches (process pool initializer)"""
+    import caesar, mono_alphabet_cipher, poly_alphabet_cipher, transposition, caesar_bruteForcer
+    for path in dictionaries:
+        load_dictionary(path)
+    for path in rsa_keys:
+        load_rsa_key(path)
+
+#### Classical ciphers
+
+@operation("caesar.encode", kind=_large_text)
+def caesar_encode(text: str, shift: int) -> dict:
+    import caesar
+    return {"text": caesar.encode_caesar_cipher(text, shift)}
+
+@operation("caesar.decode", kind=_large_text)
+def caesar_decode(text: str, shift: int) -> dict:
+    import caesar
+    return {"text": caesar.decode_caesar_cipher(text, shift)}
+
+@operation("mono.encode", kind=_large_text)
+def mono_encode(text: str, key: str) -> dict:
+    import mono_alphabet_cipher
+    return {"text": mono_alphabet_cipher.encode(text, key)}
+
+@operation("mono.decode", kind=_large_text)
+def mono_decode(text: str, key: str) -> dict:
+    import mono_alphabet_cipher
+    return {"text": mono_alphabet_cipher.decode(text, key)}
+
+@operation("poly.encode", kind=_large_text)
+def poly_encode(text: str, keys: list[str]) -> dict:
+    import poly_alphabet_cipher
+    return {"text": poly_alphabet_cipher.encode(text, keys)}
+
+@operation("poly.decode", kind=_large_text)
+def poly_decode(text: str, keys: list[str]) -> dict:
+    import poly_alphabet_cipher
+    return {"text": poly_alphabet_cipher.decode(text, keys)}
+
+@operation("transposition.encode", kind=_large_text)
+def transposition_encode(text: str, columns: int) -> dict:
+    import transposition
+    return {"text": transposition.table_transpose(text, columns)}
+
+@operation("transposition.decode", kind=_large_text)
+def transposition_decode(text: str, columns: int) -> dict:
+    """the encoded table is read back with as many columns as the original table had rows"""
+    import transposition
+    rows = len(text) // columns if len(text) % columns == 0 else len(text) // columns + 1
+    return {"text": transposition.table_transpose(text, rows)}
+
+#### Modern primitives
+
+@operation("aes.encrypt")
+def aes_encrypt(data: str, key: str) -> dict:
+    """AES-ECB like aes128ecb, data and key in hex"""
+    from Crypto.Util.Padding import pad
+    cipher = AES_CIPHERS.get(_bytes(key, "key"))
+    return {"data": cipher.encrypt(pad(_bytes(data, "data"), 16)).hex()}
+
+@operation("aes.decrypt")
+def aes_decrypt(data: str, key: str) -> dict:
+    from Crypto.Util.Padding import unpad
+    cipher = AES_CIPHERS.get(_bytes(key, "key"))
+    return {"data": unpad(cipher.decrypt(_bytes(data, "data")), 16).hex()}
+
+@operation("otp.xor", kind=_large_text)
+def otp_xor(data: str, key: str) -> dict:
+    """one time pad, data and key in hex and of the same length"""
+    import one_time_padding
+    return {"data": one_time_padding.one_time_pad_encrypt(_bytes(data, "data"), _bytes(key, "key")).hex()}
+
+@operation("hash.file", kind="thread")
+def hash_file(path: str, hash_type: str = "sha256") -> dict:
+    import hash_file_verification
+    if hash_type not in HASH_TYPES:
+        raise ValueError("Invalid hash type, use sha1, sha256 or md5")
+    _file_version(path) # exists
+    return {"hash": hash_file_verification.hash_file(path, hash_type)}
+
+@operation("hash.data")
+def hash_data(data: str, hash_type: str = "sha256") -> dict:
+    import hash_file_verification
+    if hash_type not in HASH_TYPES:
+        raise ValueError("Invalid hash type, use sha1, sha256 or md5")
+    hasher = hash_file_verification.new_hasher(hash_type)
+    hasher.update(_bytes(data, "data"))
+    return {"hash": hasher.hexdigest()}
+
+def _digest(data: str, digest: str) -> bytes:
+    """SHA256 digest of the data, or the digest computed by the caller"""
+    from Crypto.Hash import SHA256
+    if digest is not None:
+        return _bytes(digest, "digest")
+    if data is None:
+        raise ValueError("data or digest is needed")
+    return SHA256.new(_bytes(data, "data")).digest()
+
+@operation("rsa.sign", kind="process")
+def rsa_sign(private_key: str, data: str = None, digest: str = None) -> dict:
+    """PKCS#1 v1.5 signature of the data (or of its SHA256 digest), the private key is a PEM file"""
+    from Crypto.Signature import pkcs1_15
+    from rsa_sign_and_verify import PrehashedSHA256
+    signer = pkcs1_15.new(load_rsa_key(private_key))
+    return {"signature": signer.sign(PrehashedSHA256(_digest(data, digest))).hex()}
+
+@operation("rsa.verify")
+def rsa_verify(public_key: str, signature: str, data: str = None, digest: str = None) -> dict:
+    from Crypto.Signature import pkcs1_15
+    from rsa_sign_and_verify import PrehashedSHA256
+    try:
+        pkcs1_15.new(load_rsa_key(public_key)).verify(PrehashedSHA256(_digest(data, digest)), _bytes(signature, "signature"))
+        return {"valid": True}
+    except (ValueError, TypeError):
+        return {"valid": False}
+
+#### Crackers
+
+@operation("classify", kind=_large_text)
+def classify(text: str) -> dict:
+    """likely cipher family of a ciphertext (cipher_classifier.py), the bulk triage classifies many texts at once"""
+    import cipher_classifier
+    return cipher_classifier.classify([text])[0]
+
+@operation("crack.caesar", kind="process")
+def crack_caesar(text: str, dictionary: str) -> dict:
+    """best shift of a caesar ciphertext, scored with the words of a JSON dictionary"""
+    import caesar_bruteForcer
+    shift, matching_words = caesar_bruteForcer._best_shift(text, load_dictionary(dictionary))
+    return {"shift": shift, "matching_words": matching_words,
+            "text": caesar_bruteForcer.decode_caesar_cipher(text, shift) if matching_words else None}
+
+@operation("crack.mono_frequency", kind=_large_text)
+def crack_mono_frequency(text: str) -> dict:
+    """letter frequencies of a mono-alphabet ciphertext, the most frequent letter likely stands for e"""
+    import mono_brute_force
+    frequencies = mono_brute_force.frequency_analysis(text)
+    return {"e": max(frequencies, key=frequencies.get), "frequencies": frequencies}
+
+@operation("crack.mono_words", kind="process")
+def crack_mono_words(text: str, index: str, max_nodes: int = 200000, budget: float = None) -> dict:
+    """key of a mono-alphabet ciphertext that kept its word boundaries, from a word-pattern index file,
+    the best one found within budget seconds if given"""
+    import word_patterns, anytime
+    cancelled = anytime.Deadline(budget).expired if budget is not None else None
+    return word_patterns.solve(text, load_pattern_index(index), max_nodes, cancelled=cancelled)
+
+@operation("crack.kasiski", kind=_large_text)
+def crack_kasiski(text: str, max_period: int = 20) -> dict:
+    """periods of a poly-alphabet ciphertext ranked by a Kasiski examination and the IoC (kasiski.py)"""
+    import kasiski
+    return {"periods": kasiski.rank_periods(text, max_period)}
+
+@operation("crack.anytime", kind="process")
+def crack_anytime(text: str, budget: float = 0.1, family: str = None, dictionary: str = None, index: str = None,
+                  max_period: int = 20) -> dict:
+    """best candidate of the cracker of the family (classified if None) within budget seconds (anytime.py)"""
+    import anytime
+    return anytime.crack(text, budget, family=family, dictionary=dictionary, index=index, max_period=max_period)
+
+@operation("crack.poly_subsets", kind=_large_text)
+def crack_poly_subsets(text: str, length: int = 10) -> dict:
+    """share of the most common letter in text[::i] for i < length, peaks at the multiples of the period"""
+    import poly_crack
+    return {"ratios": poly_crack.subsets(text, length)}
@@ -0,0 +1,84 @@
+import importlib
+import sys
+
+"""
+Single entry point of the toolset
+
+pfs.py only knows the names of the tools: the module of a subcommand is imported
+when that subcommand runs, and the plotting or GUI libraries only when a tool
+needs them. `python pfs.py caesar ...` imports nothing but caesar.py and its own
+dependencies, which matters when the tools run thousands of times from scripts.
+
+The arguments after the subcommand are the arguments of the tool, as if it was
+run directly (python pfs.py aes --help for the options of aes128ecb.py).
+
+Usage:
+
+python pfs.py --list
+python pfs.py caesar -i "hello" -K 3 -e --print-only
+python pfs.py aes -i file.bin -K key.key -e -o file.enc
+python pfs.py hash -f file.bin -t sha256 --profile
+"""
+
+# subcommand => (module, description), the modules are imported on demand
+COMMANDS = {
+    "caesar": ("caesar", "Caesar cipher"),
+    "caesar-crack": ("caesar_bruteForcer", "Caesar brute force with a dictionary"),
+    "transposition": ("transposition", "Transposition cipher"),
+    "mono": ("mono_alphabet_cipher", "Mono-alphabet substitution cipher"),
+    "mono-crack": ("mono_brute_force", "Letter frequency analysis of a mono-alphabet ciphertext"),
+    "mono-solve": ("word_patterns", "Word-pattern dictionary attack on mono-alphabet ciphertexts"),
+    "poly": ("poly_alphabet_cipher", "Poly-alphabet substitution cipher"),
+    "poly-crack": ("poly_crack", "Frequency analysis of the subsets of a poly-alphabet ciphertext"),
+    "classify": ("cipher_classifier", "Cipher-type classifier for bulk ciphertext triage"),
+    "crack": ("anytime", "Best candidate of the crackers within a time budget"),
+    "otp": ("one_time_padding", "One time pad"),
+    "aes": ("aes128ecb", "AES-128 ECB encryption of texts and files"),
+    "inplace": ("inplace_encryption", "In-place AES encryption of huge files"),
+    "archive": ("folder_archive", "Compress-then-encrypt folder archives"),
+    "hash": ("hash_file_verification", "File hashing, verification and dedupe"),
+    "sign": ("rsa_sign_and_verify", "RSA signatures"),
+    "manifest": ("merkle_manifest", "Merkle-root signature manifests"),
+    "kdf": ("key_derivation", "Password based key derivation calibration"),
+    "keygen": ("key_generator", "Bulk key generation"),
+    "keypool": ("rsa_key_pool", "Background RSA key-pair pool"),
+    "benchmark": ("benchmark", "Benchmark suite with regression baselines"),
+    "batch": ("batch_runner", "JSONL batch jobs over all the operations"),
+    "daemon": ("daemon", "Local daemon with warm caches"),
+    "client": ("daemon_client", "Send one request to the daemon"),
+    "gui": ("EncryptionApp", "Graphical interface (PyQt6)"),
+}
+
+def usage() -> str:
+    lines = ["usage: pfs.py <command> [arguments of the command]", "", "commands:"]
+    lines += [f"  {name:<15} {description}" for name, (_, description) in COMMANDS.items()]
+    return "\n".join(lines)
+
+def run(command: str, arguments: list[str]) -> None:
+    """Import the module of a command and run it with the arguments
+
+    The tools parse sys.argv, it is replaced by the arguments of the command.
+    A module without main() (the GUI) is run as a script.
+    """
+    module_name = COMMANDS[command][0]
+    sys.argv = [f"pfs.py {command}", *arguments]
+    module = importlib.import_module(module_name)
+    if hasattr(module, "main"):
+        module.main()
+    else:
+        import runpy
+        runpy.run_module(module_name, run_name="__main__")
+
+def main():
+    # no argparse here: the tools parse their own arguments, pfs.py only picks the tool
+    if len(sys.argv) < 2 or sys.argv[1] in ("-h", "--help", "--list"):
+        print(usage())
+        return
+    command = sys.argv[1]
+    if command not in COMMANDS:
+        print(f"Unknown command {command}\n\n{usage()}", file=sys.stderr)
+        sys.exit(2)
+    run(command, sys.argv[2:])
+
+if __name__ == "__main__":
+    main()
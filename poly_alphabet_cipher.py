@@ -2,7 +2,8 @@
 # import
 import argparse
 import os
-import random
+from key_generator import alphabet_permutation, alphabet_permutations
+import profiling
 # define
 """Poly-alphabet cipher
 This script is a simple implementation of the poly-alphabet cipher
@@ -69,9 +70,7 @@ def keyGenerator() -> str:
     Returns:
         str: a random key alphabet
     """
-    key = list(alphabet)
-    random.shuffle(key)
-    return ''.join(key)
+    return alphabet_permutation(alphabet) # Fisher-Yates shuffle from the OS CSPRNG
 
 def main():
     """command line interface for the mono-alphabet cipher
@@ -85,9 +84,11 @@ def main():
     argument_parser.add_argument("-d", action="store_true", help="Decode")
     argument_parser.add_argument( "--create-key", action="store_true", help="Create a random key alphabet and exit")
     argument_parser.add_argument("--print-only", action="store_true", help="Print the output only")
+    profiling.add_arguments(argument_parser)
 
     # Parse the arguments
     args = argument_parser.parse_args()
+    profiling.start(args)
 
     # Check the arguments
     if args.create_key:
@@ -103,9 +104,7 @@ def main():
         i = input("how meny keys do you want to generate ? : (type exit to exit) ")
         if i == "exit":
             exit(0)
-        keys = []
-        for _ in range(int(i)):
-            keys.append(keyGenerator())
+        keys = alphabet_permutations(int(i))
         args.K = keys
         print(f"Key alphabet: {keys}")
     else:
@@ -132,18 +131,19 @@ def main():
         if not os.path.exists(args.i):
             print("The file does not exist")
             exit(1)
-        with open(args.i, "r", encoding='UTF-8') as file:
+        with profiling.phase("load input"), open(args.i, "r", encoding='UTF-8') as file:
             text = file.read()
     else:
         text = args.i
     
 
     # Process the text
-    if args.e:
-        text = encode(text, args.K)
-    
-    if args.d:
-        text = decode(text, args.K)
+    with profiling.phase("transform", hot=True):
+        if args.e:
+            text = encode(text, args.K)
+        
+        if args.d:
+            text = decode(text, args.K)
     
     
     # Print or save the output
@@ -151,7 +151,7 @@ def main():
         print("")
         print(text)
     else:
-        with open(args.o, "w") as file:
+        with profiling.phase("write output"), open(args.o, "w") as file:
             file.write(text)
 
 
@@ -1,7 +1,6 @@
-import matplotlib.pyplot as plt
 import argparse
 import os
-from scipy.signal import savgol_filter
+import profiling
 
 alphabet = 'abcdefghijklmnopqrstuvwxyz'
 
@@ -36,26 +35,56 @@ def subsets(text, l=10,graph=False, verbose=False):
         histogram.append(find_most_common(sub_text)/len(sub_text))
         #if verbose:print(f"the most frequent letter is: {find_e(text)} with {freq[find_e(text)]} occurences in {text[i-1::i]}") 
     if graph:
+        import matplotlib.pyplot as plt # only imported when a graph is drawn
         plt.plot(values, histogram)
         plt.show()
+    return histogram
 
+def kasiski_periods(text, max_period=20, verbose=False):
+    """periods ranked by the repeated n-grams of the text (kasiski.py) and the index of coincidence"""
+    import kasiski # numpy, only imported with --kasiski
+    import numpy as np
+    if verbose:
+        # the longest repeats, without their suffixes (the same letter before every position)
+        found = [(repeat, positions) for repeat, positions in kasiski.repeats(text)
+                 if positions[0] == 0 or len({text[position - 1] for position in positions}) > 1
+                 or not text[positions[0] - 1].isalpha()]
+        for repeat, positions in sorted(found, key=lambda repeat: -len(repeat[0]))[:20]:
+            print(f"{repeat!r} at {positions.tolist()[:10]}, distances {np.diff(positions)[:10].tolist()}")
+    return kasiski.rank_periods(text, max_period)
 
-if __name__ == "__main__":
+def main():
     args_parse = argparse.ArgumentParser(description="Analyse the frequency of a subset of a text, and display the result on a graph")
     args_parse.add_argument('-i', '--input', type=str, help='file to analyse')
     args_parse.add_argument('-l', '--length', type=int, help='length of the subset')
     args_parse.add_argument('-v', '--verbose', action='store_true', help='verbose')
+    args_parse.add_argument('--kasiski', action='store_true', help='rank the periods with a Kasiski examination and the IoC')
+    args_parse.add_argument('--max-period', type=int, default=20, help='largest period ranked by --kasiski')
+    profiling.add_arguments(args_parse)
     args = args_parse.parse_args()
+    profiling.start(args)
     
     if not args.input:
         print("You must provide a file to analyse")
         os._exit(1)
     
-    if not args.length:
+    if not args.length and not args.kasiski:
         print("You must provide a length for the subset")
         os._exit(1)
     
-    with open(args.input, "r") as file:
+    with profiling.phase("load input"), open(args.input, "r") as file:
         text = file.read()
     
-    subsets(text, args.length, True, args.verbose)
\ No newline at end of file
+    if args.kasiski:
+        with profiling.phase("transform", hot=True):
+            ranking = kasiski_periods(text, args.max_period, args.verbose)
+        print("period  score  kasiski  ioc     distances")
+        for period in ranking[:5]:
+            ioc = f"{period['ioc']:.4f}" if period["ioc"] is not None else "-" # columns of less than two letters
+            print(f"{period['period']:>6}  {period['score']:.3f}  {period['kasiski']:>7.4f}  {ioc:<6}  {period['distances']}")
+    if args.length:
+        with profiling.phase("transform", hot=True):
+            subsets(text, args.length, True, args.verbose)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+import contextlib
+import threading
+import argparse
+import atexit
+import time
+import sys
+
+"""
+Per-phase instrumentation shared by the command line tools
+
+A tool names its phases (load input, load key, transform, write output...) with
+`with profiling.phase("transform", hot=True):`. When the tool runs with
+--profile, the wall time, CPU time and tracemalloc peak of each phase are
+printed on stderr at exit, as a table or as JSON lines. --cprofile FILE dumps a
+cProfile of the hot phases (pstats format, read it with python -m pstats FILE).
+
+Without the flags, phase() returns a shared empty context manager: the cost is
+one function call per phase, and tracemalloc, cProfile and json are not even
+imported. Only the phases of the main thread are recorded, the worker threads
+of a tool (hash dedupe...) are covered by the phase of the main thread that
+waits for them.
+
+tracemalloc slows down the code that allocates a lot of Python objects, the
+times of a --profile run are for comparing the phases, not absolute figures.
+
+Usage:
+
+python aes128ecb.py -i big.bin -K key.key -e -o big.enc --profile
+python caesar_bruteForcer.py -i input.txt -w words.json --print-only --profile json
+python hash_file_verification.py -f file.bin -t sha256 --cprofile hash.prof
+"""
+
+_NULL = contextlib.nullcontext() # reusable, returned by phase() when profiling is off
+
+class Profiler:
+    """Collects the wall time, CPU time and memory peak of named phases
+
+    Phases with the same name are added up (their peak is the max), phases can be nested.
+
+    >>> profiler = Profiler(memory=False)
+    >>> with profiler.phase("transform"):
+    ...     _ = sum(range(1000))
+    >>> with profiler.phase("transform"):
+    ...     pass
+    >>> [(p["phase"], p["calls"]) for p in profiler.results()]
+    [('transform', 2)]
+    """
+    def __init__(self, memory: bool = True, cprofile_path: str = None):
+        import tracemalloc, cProfile
+        self._tracemalloc = tracemalloc
+        self.memory = memory
+        self.cprofile_path = cprofile_path
+        self.cprofile = cProfile.Profile() if cprofile_path else None
+        self.phases = {} # name => [calls, wall, cpu, peak]
+        self._stack = [] # peak of the phases being run
+        self._hot = 0 # depth of the running hot phases
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def _update_peaks(self) -> None:
+        """the current peak belongs to all the running phases, before it is reset"""
+        _, peak = self._tracemalloc.get_traced_memory()
+        for frame in self._stack:
+            frame[1] = max(frame[1], peak - frame[0])
+
+    @contextlib.contextmanager
+    def phase(self, name: str, hot: bool = False):
+        frame = [0, 0] # memory at the start, peak above it
+        if self.memory:
+            self._update_peaks()
+            self._tracemalloc.reset_peak()
+            frame[0] = self._tracemalloc.get_traced_memory()[0]
+        self._stack.append(frame)
+        if hot and self.cprofile is not None:
+            if self._hot == 0:
+                self.cprofile.enable()
+            self._hot += 1
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+            if hot and self.cprofile is not None:
+                self._hot -= 1
+                if self._hot == 0:
+                    self.cprofile.disable()
+            if self.memory:
+                self._update_peaks()
+            self._stack.pop()
+            record = self.phases.setdefault(name, [0, 0.0, 0.0, 0])
+            record[0] += 1
+            record[1] += wall
+            record[2] += cpu
+            record[3] = max(record[3], frame[1])
+
+    def results(self) -> list[dict]:
+        """one dict per phase, in the order they first ran"""
+        return [{"phase": name, "calls": calls, "wall_s": round(wall, 6), "cpu_s": round(cpu, 6),
+                 "peak_bytes": peak if self.memory else None}
+                for name, (calls, wall, cpu, peak) in self.phases.items()]
+
+    def report(self, output_format: str = "table", file=None) -> None:
+        """print the phases (table, json lines or nothing if None) and dump the cProfile of the hot phases"""
+        import json
+        file = file or sys.stderr
+        if output_format == "json":
+            for result in self.results():
+                print(json.dumps(result), file=file)
+        elif output_format == "table" and self.phases:
+            print(f"{'phase':<24} {'calls':>5} {'wall (s)':>10} {'cpu (s)':>10} {'peak (MB)':>10}", file=file)
+            for result in self.results():
+                peak = f"{result['peak_bytes'] / 1024**2:10.2f}" if self.memory else f"{'n/a':>10}"
+                print(f"{result['phase']:<24} {result['calls']:>5} {result['wall_s']:10.4f} {result['cpu_s']:10.4f} {peak}", file=file)
+        if self.cprofile is not None:
+            self.cprofile.dump_stats(self.cprofile_path)
+            print(f"cProfile of the hot phases saved in {self.cprofile_path}", file=file)
+
+PROFILER = None # the Profiler of the running tool, None when profiling is off
+
+def phase(name: str, hot: bool = False):
+    """Context manager timing a phase of the running tool, an empty context when profiling is off
+
+    Args:
+        name (str): phase name, "load input", "load key", "load dictionary", "transform", "write output"...
+        hot (bool): the phase is covered by the --cprofile dump
+    """
+    if PROFILER is None or threading.current_thread() is not threading.main_thread():
+        return _NULL
+    return PROFILER.phase(name, hot)
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    """add the --profile and --cprofile options to a tool"""
+    group = parser.add_argument_group("profiling")
+    group.add_argument("--profile", nargs="?", const="table", choices=["table", "json"],
+                       help="Print the time and memory peak of each phase on stderr (table or json lines)")
+    group.add_argument("--cprofile", type=str, metavar="FILE", help="Dump a cProfile of the hot phases in FILE")
+
+def start(args: argparse.Namespace) -> Profiler:
+    """Enable the profiling if the options ask for it, the report is printed at exit
+
+    Returns:
+        Profiler: the profiler, None when profiling is off
+    """
+    global PROFILER
+    if not getattr(args, "profile", None) and not getattr(args, "cprofile", None):
+        return None
+    PROFILER = Profiler(memory=bool(args.profile), cprofile_path=args.cprofile)
+    atexit.register(PROFILER.report, args.profile)
+    return PROFILER
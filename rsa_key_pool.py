@@ -0,0 +1,296 @@
+from Crypto.PublicKey import RSA
+from colorama import Fore, Style
+from concurrent.futures import ProcessPoolExecutor
+from threading import Lock
+import argparse
+import json
+import os
+import time
+import uuid
+import profiling
+
+"""
+Background RSA key-pair pool
+
+RSA.generate(4096) takes seconds per key with a high variance. The pool generates
+key pairs in background worker processes, stores them encrypted (PKCS#8) in a
+folder and refills it up to a watermark, so a key is handed out instantly.
+
+Usage:
+
+python rsa_key_pool.py --pool keys/ --fill --watermark 200 -s 4096 -w 8
+python rsa_key_pool.py --pool keys/ --take -o tenant42
+python rsa_key_pool.py --pool keys/ --stats
+
+The passphrase of the pool is read from the PFS_POOL_PASSPHRASE environment variable
+or asked on the command line.
+"""
+
+PROTECTION = "PBKDF2WithHMAC-SHA256AndAES128-CBC"
+ITERATION_COUNT = 100000 # a take costs one key derivation, about 30 ms
+STATS_FILE = "stats.json"
+
+def error(message: str) -> None:
+    print(Fore.RED + Style.BRIGHT + message + Style.RESET_ALL)
+    os._exit(1)
+
+def indicator(message: str) -> None:
+    print(Fore.GREEN + message + Style.RESET_ALL)
+
+def _generate_encrypted_key(key_size: int, public_exponent: int, passphrase: str) -> tuple:
+    """Generate a key pair in a worker process
+
+    Returns:
+        tuple: (encrypted PKCS#8 PEM of the private key, generation time in seconds)
+    """
+    start = time.perf_counter()
+    key = RSA.generate(key_size, e=public_exponent)
+    duration = time.perf_counter() - start
+    pem = key.export_key(format="PEM", passphrase=passphrase, pkcs=8, protection=PROTECTION,
+                         prot_params={"iteration_count": ITERATION_COUNT})
+    return pem, duration
+
+class KeyPool:
+    """Pool of pre-generated RSA key pairs stored encrypted in a folder
+
+    Args:
+        directory (str): folder of the pool, created if needed
+        passphrase (str): passphrase protecting the stored private keys
+        key_size (int): size of the generated keys in bits
+        public_exponent (int): public exponent of the generated keys
+        watermark (int): number of keys the pool is refilled to
+        workers (int): number of generating processes, default is the number of CPUs
+    """
+    def __init__(self, directory: str, passphrase: str, key_size: int = 4096, public_exponent: int = 65537,
+                 watermark: int = 16, workers: int = None):
+        self.directory = directory
+        self.passphrase = passphrase
+        self.key_size = key_size
+        self.public_exponent = public_exponent
+        self.watermark = watermark
+        self.workers = workers
+
+        self._executor = None
+        self._pending = set()
+        self._lock = Lock()
+        self._generated = 0
+        self._generation_time = 0.0
+        self._taken = 0
+        self._misses = 0 # takes on an empty pool, the key was generated synchronously
+        self._failed = 0 # generations that raised, their key is missing from the pool
+        self._unreadable = 0 # keys that could not be imported (other passphrase, corrupt file), set aside
+        self._last_error = None
+        os.makedirs(directory, exist_ok=True)
+
+    def _suffix(self) -> str:
+        # keys of another size or exponent in the same folder are never handed out
+        return f".{self.key_size}-{self.public_exponent}.pem"
+
+    def _keys(self) -> list[str]:
+        return sorted(name for name in os.listdir(self.directory) if name.endswith(self._suffix()))
+
+    def depth(self) -> int:
+        """Number of keys ready in the pool"""
+        return len(self._keys())
+
+    def _store(self, future) -> None:
+        """Write a generated key to the pool, called by the executor when a generation is done
+
+        The future stays pending until the key is written, wait() returns once the keys are stored.
+        """
+        try:
+            if future.cancelled():
+                return
+            pem, duration = future.result()
+            name = uuid.uuid4().hex + self._suffix()
+            temporary = os.path.join(self.directory, name + ".tmp")
+            with open(temporary, "wb") as file:
+                file.write(pem)
+            os.replace(temporary, os.path.join(self.directory, name)) # a key is never seen half written
+            with self._lock:
+                self._generated += 1
+                self._generation_time += duration
+        except Exception as e: # generation or write failure, counted in stats()
+            with self._lock:
+                self._failed += 1
+                self._last_error = f"{type(e).__name__}: {e}"
+        finally:
+            with self._lock:
+                self._pending.discard(future)
+
+    def refill(self) -> int:
+        """Start the generation of the keys missing to reach the watermark, in the background
+
+        Returns:
+            int: number of generations started
+        """
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            missing = self.watermark - self.depth() - len(self._pending)
+            futures = [self._executor.submit(_generate_encrypted_key, self.key_size, self.public_exponent, self.passphrase)
+                       for _ in range(max(0, missing))]
+            self._pending.update(futures)
+        # outside the lock: the callback of a future already done runs here and takes the lock
+        for future in futures:
+            future.add_done_callback(self._store)
+        return max(0, missing)
+
+    def wait(self) -> None:
+        """Block until the running generations are stored"""
+        while True:
+            with self._lock:
+                pending = list(self._pending)
+            if not pending:
+                return
+            for future in pending:
+                future.exception() # wait without raising
+            time.sleep(0.01) # let the done callbacks store the keys
+
+    def take(self, refill: bool = True):
+        """Hand out a key pair and start refilling the pool
+
+        Keys are claimed with an atomic rename, several processes can share a pool.
+        A key that can't be imported (other passphrase, corrupt file) is renamed to
+        <name>.unreadable, out of the pool, and the next key is tried.
+        If the pool is empty the key is generated synchronously.
+
+        Args:
+            refill (bool): start the background refill after the take
+
+        Returns:
+            RSA key: the private key, its public key is key.publickey()
+        """
+        key = None
+        for name in self._keys():
+            path = os.path.join(self.directory, name)
+            claimed = path + f".{os.getpid()}.taken"
+            try:
+                os.rename(path, claimed)
+            except FileNotFoundError: # taken by someone else
+                continue
+            try:
+                with open(claimed, "rb") as file:
+                    key = RSA.import_key(file.read(), self.passphrase)
+            except (OSError, ValueError, IndexError, TypeError) as e:
+                os.replace(claimed, path + ".unreadable") # kept for inspection, never handed out
+                with self._lock:
+                    self._unreadable += 1
+                    self._last_error = f"{name}: {type(e).__name__}: {e}"
+                continue
+            os.remove(claimed)
+            break
+
+        with self._lock:
+            self._taken += 1
+            if key is None:
+                self._misses += 1
+        if key is None:
+            key = RSA.generate(self.key_size, e=self.public_exponent)
+        if refill:
+            self.refill()
+        return key
+
+    def stats(self) -> dict:
+        """Pool depth and generation statistics of this process"""
+        with self._lock:
+            return {
+                "depth": self.depth(),
+                "pending": len(self._pending),
+                "watermark": self.watermark,
+                "key_size": self.key_size,
+                "public_exponent": self.public_exponent,
+                "generated": self._generated,
+                "mean_generation_time": self._generation_time / self._generated if self._generated else None,
+                # keys per second of one worker, multiply by the number of workers for the pool rate
+                "generation_rate": self._generated / self._generation_time if self._generation_time else None,
+                "taken": self._taken,
+                "misses": self._misses,
+                "failed": self._failed,
+                "unreadable": self._unreadable,
+                "last_error": self._last_error,
+            }
+
+    def close(self, wait: bool = True) -> None:
+        """Stop the workers, running generations are stored if wait is True"""
+        if wait:
+            self.wait()
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=not wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def main():
+    import getpass
+
+    argument_parser = argparse.ArgumentParser(description="Background RSA key-pair pool")
+    argument_parser.add_argument("--pool", type=str, help="Folder of the pool")
+    argument_parser.add_argument("--fill", action="store_true", help="Fill the pool up to the watermark and exit")
+    argument_parser.add_argument("--take", action="store_true", help="Take a key pair from the pool")
+    argument_parser.add_argument("--stats", action="store_true", help="Print the pool statistics")
+    argument_parser.add_argument("-o", type=str, default="pool", help="Prefix of the exported key files (<prefix>_private_key.pem, <prefix>_public_key.pem)")
+    argument_parser.add_argument("-s", "--key-size", type=int, default=4096, help="Size of the keys in bits")
+    argument_parser.add_argument("-e", "--public-exponent", type=int, default=65537, help="Public exponent of the keys")
+    argument_parser.add_argument("--watermark", type=int, default=16, help="Number of keys the pool is refilled to")
+    argument_parser.add_argument("-w", "--workers", type=int, help="Number of generating processes")
+    profiling.add_arguments(argument_parser)
+
+    args = argument_parser.parse_args()
+    profiling.start(args)
+
+    if not args.pool:
+        error("You must provide the folder of the pool with --pool")
+    if not (args.fill or args.take or args.stats):
+        error("You must provide an action: --fill, --take or --stats")
+    passphrase = os.environ.get("PFS_POOL_PASSPHRASE") or getpass.getpass("Pool passphrase: ")
+
+    pool = KeyPool(args.pool, passphrase, args.key_size, args.public_exponent, args.watermark, args.workers)
+    stats_path = os.path.join(args.pool, STATS_FILE)
+
+    if args.fill:
+        start = time.perf_counter()
+        with profiling.phase("transform", hot=True):
+            started = pool.refill()
+            pool.wait()
+        elapsed = time.perf_counter() - start
+        stats = pool.stats()
+        indicator(f"{stats['generated']} keys generated in {elapsed:.1f}s ({stats['generated'] / elapsed if elapsed else 0:.2f} keys/s)")
+        if stats["failed"]:
+            print(Fore.RED + f"{stats['failed']} of {started} generations failed, last error: {stats['last_error']}" + Style.RESET_ALL)
+        with open(stats_path, "w") as file:
+            json.dump(stats, file, indent=1)
+
+    if args.take:
+        with profiling.phase("load key"):
+            key = pool.take(refill=False) # the process exits right away, --fill refills the pool
+        with profiling.phase("write output"), open(args.o + "_private_key.pem", "wb") as file:
+            file.write(key.export_key(format="PEM"))
+        with open(args.o + "_public_key.pem", "wb") as file:
+            file.write(key.publickey().export_key(format="PEM"))
+        indicator(f"Key pair saved as {args.o}_private_key.pem and {args.o}_public_key.pem")
+        if pool.stats()["unreadable"]:
+            print(Fore.RED + f"{pool.stats()['unreadable']} keys could not be imported and were set aside as .unreadable, "
+                  f"last error: {pool.stats()['last_error']}" + Style.RESET_ALL)
+        if pool.stats()["misses"]:
+            print("The pool was empty, the key was generated on the spot")
+
+    if args.stats:
+        stats = pool.stats()
+        if os.path.exists(stats_path): # generation statistics of the last --fill
+            with open(stats_path, "r") as file:
+                last_fill = json.load(file)
+            for name in ("generated", "mean_generation_time", "generation_rate"):
+                stats[name] = last_fill.get(name)
+        for name, value in stats.items():
+            print(f"{name}: {value}")
+
+    pool.close()
+
+if __name__ == "__main__":
+    main()
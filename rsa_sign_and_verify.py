@@ -1,8 +1,71 @@
 from Crypto.Hash import SHA256
 from Crypto.PublicKey import RSA
 from Crypto.Signature import pkcs1_15
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from collections import OrderedDict
+from threading import Thread, Lock
+from queue import Queue
 import argparse
+import sys
 import os
+import profiling
+import daemon_client
+
+CHUNK_SIZE = 1024 * 1024 # bytes read at once when hashing a file
+
+class PrehashedSHA256:
+    """SHA256 digest computed elsewhere, usable by pkcs1_15 in place of a SHA256 hash object"""
+    oid = SHA256.new().oid
+    digest_size = SHA256.digest_size
+
+    def __init__(self, digest: bytes):
+        if len(digest) != self.digest_size:
+            raise ValueError(f"A SHA256 digest is {self.digest_size} bytes long, got {len(digest)}")
+        self._digest = digest
+
+    def digest(self) -> bytes:
+        return self._digest
+
+    def hexdigest(self) -> str:
+        return self._digest.hex()
+
+def _read_chunks(file, queue: Queue, chunk_size: int) -> None:
+    """Read the file by chunks into the queue, None marks the end (or an exception is put)"""
+    try:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            queue.put(chunk)
+        queue.put(None)
+    except Exception as e:
+        queue.put(e)
+
+def hash_stream(source, chunk_size: int = CHUNK_SIZE):
+    """Hash a file with SHA256 in constant memory
+
+    A reader thread reads the next chunks while the current one is hashed,
+    at most 2 chunks are waiting in memory.
+
+    Args:
+        source (str | file object): path of the file or binary file object to hash
+        chunk_size (int): number of bytes read at once
+
+    Returns:
+        SHA256 hash object of the whole content
+    """
+    hasher = SHA256.new()
+    file = open(source, "rb") if isinstance(source, (str, bytes, os.PathLike)) else source
+    try:
+        queue = Queue(maxsize=2)
+        reader = Thread(target=_read_chunks, args=(file, queue, chunk_size), daemon=True)
+        reader.start()
+        while (chunk := queue.get()) is not None:
+            if isinstance(chunk, Exception):
+                raise chunk
+            hasher.update(chunk)
+        reader.join()
+    finally:
+        if file is not source:
+            file.close()
+    return hasher
 
 class Signer:
     def __init__(self, generate=False, key_size: int = 4096):
@@ -18,16 +81,18 @@ class Signer:
         self.hasher = SHA256.new()
         self.signer = pkcs1_15.new(self.private_key)
 
-    def generate_rsa_keypair(self,key_size: int = 4096) -> tuple:
+    def generate_rsa_keypair(self,key_size: int = 4096, public_exponent: int = 65537) -> tuple:
         """Generate an RSA key pair.
+        To get keys instantly, take them from a pre-generated rsa_key_pool.KeyPool.
 
         Args:
             key_size (int): Size of the RSA key in bits. Default is 4096.
+            public_exponent (int): Public exponent of the key. Default is 65537.
 
         Returns:
             tuple: A tuple containing the private and public keys.
         """
-        private_key = RSA.generate(key_size)
+        private_key = RSA.generate(key_size, e=public_exponent)
         public_key = private_key.publickey()
         return private_key, public_key
 
@@ -45,6 +110,29 @@ class Signer:
         self.reset()  # Reset the hasher and signer for future use
         return signature
 
+    def sign_digest(self, digest: bytes) -> bytes:
+        """Sign a SHA256 digest computed elsewhere using the private key.
+
+        Args:
+            digest (bytes): The 32 bytes SHA256 digest of the message.
+
+        Returns:
+            bytes: The signature, the same as sign_message on the original message.
+        """
+        return self.signer.sign(PrehashedSHA256(digest))
+
+    def sign_file(self, source, chunk_size: int = CHUNK_SIZE) -> bytes:
+        """Sign a file using the private key, the file is streamed and never fully in memory.
+
+        Args:
+            source (str | file object): Path or binary file object to sign.
+            chunk_size (int): Number of bytes read at once.
+
+        Returns:
+            bytes: The signature, the same as sign_message on the file content.
+        """
+        return self.signer.sign(hash_stream(source, chunk_size))
+
     def import_key(self, private_key_path:str=None, public_key_path:str=None) -> None:
         """Import RSA keys from files.
 
@@ -89,13 +177,195 @@ class Signer:
         Returns:
             bool: True if the signature is valid, False otherwise.
         """
-        self.hasher.update(message)
+        hasher = SHA256.new(message) # a fresh hasher, self.hasher would keep the previous messages
         try:
-            pkcs1_15.new(self.public_key).verify(self.hasher, signature)
+            pkcs1_15.new(self.public_key).verify(hasher, signature)
             return True
         except (ValueError, TypeError):
             return False
 
+    def verify_digest(self, digest: bytes, signature: bytes) -> bool:
+        """Verify the signature of a SHA256 digest computed elsewhere using the public key.
+
+        Args:
+            digest (bytes): The 32 bytes SHA256 digest of the original message.
+            signature (bytes): The signature to verify.
+
+        Returns:
+            bool: True if the signature is valid, False otherwise.
+        """
+        try:
+            pkcs1_15.new(self.public_key).verify(PrehashedSHA256(digest), signature)
+            return True
+        except (ValueError, TypeError):
+            return False
+
+    def verify_file(self, source, signature: bytes, chunk_size: int = CHUNK_SIZE) -> bool:
+        """Verify the signature of a file using the public key, the file is streamed and never fully in memory.
+
+        Args:
+            source (str | file object): Path or binary file object of the original message.
+            signature (bytes): The signature to verify.
+            chunk_size (int): Number of bytes read at once.
+
+        Returns:
+            bool: True if the signature is valid, False otherwise.
+        """
+        return self.verify_digest(hash_stream(source, chunk_size).digest(), signature)
+
+class PublicKeyCache:
+    """Thread-safe LRU cache of imported public keys, keyed by the fingerprint of their PEM"""
+    def __init__(self, maxsize: int = 128):
+        self.maxsize = maxsize
+        self._keys = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, pem: bytes):
+        """Return the imported key of the PEM, it is only parsed the first time"""
+        fingerprint = key_fingerprint(pem)
+        with self._lock:
+            if fingerprint in self._keys:
+                self._keys.move_to_end(fingerprint)
+                return self._keys[fingerprint]
+        key = RSA.import_key(pem) # parsed outside of the lock, two threads may parse the same key once
+        with self._lock:
+            self._keys[fingerprint] = key
+            self._keys.move_to_end(fingerprint)
+            while len(self._keys) > self.maxsize:
+                self._keys.popitem(last=False)
+        return key
+
+PUBLIC_KEYS = PublicKeyCache()
+
+def key_fingerprint(pem: bytes) -> str:
+    """SHA256 fingerprint of a PEM encoded key"""
+    return SHA256.new(pem).hexdigest()
+
+def load_public_key(public_key_path: str):
+    """Import a public key from a file, through the PUBLIC_KEYS cache"""
+    with open(public_key_path, "rb") as f:
+        return PUBLIC_KEYS.get(f.read())
+
+# the private key of a signing worker process, parsed once by _init_signing_worker
+_worker_signer = None
+
+def _init_signing_worker(private_key_pem: bytes, passphrase: str = None) -> None:
+    global _worker_signer
+    _worker_signer = pkcs1_15.new(RSA.import_key(private_key_pem, passphrase))
+
+def _sign_digest_in_worker(digest: bytes) -> bytes:
+    if digest is None: # the file could not be read
+        return None
+    return _worker_signer.sign(PrehashedSHA256(digest))
+
+def _digest_or_none(path: str) -> bytes:
+    """SHA256 digest of a file, None if it can't be read (removed, no permission...)"""
+    try:
+        return hash_stream(path).digest()
+    except OSError:
+        return None
+
+def batch_sign(paths: list[str], private_key_path: str, workers: int = None, passphrase: str = None) -> list[tuple]:
+    """Sign many files with one private key
+
+    The files are hashed on a thread pool and the RSA private-key operations are
+    spread over a process pool, each worker parses the private key once.
+
+    Args:
+        paths (list[str]): files to sign
+        private_key_path (str): path to the PEM private key
+        workers (int): number of signing processes, default is the number of CPUs
+        passphrase (str): passphrase of the private key if it is encrypted
+
+    Returns:
+        list[tuple]: (path, signature) in the order of paths, signature is None for a file that can't be read
+    """
+    with open(private_key_path, "rb") as f:
+        private_key_pem = f.read()
+    RSA.import_key(private_key_pem, passphrase) # fail early on a wrong key or passphrase
+
+    with ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) * 2)) as hashers:
+        digests = hashers.map(_digest_or_none, paths) # one unreadable file doesn't stop the batch
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_signing_worker,
+                                 initargs=(private_key_pem, passphrase)) as signers:
+            signatures = list(signers.map(_sign_digest_in_worker, digests, chunksize=16))
+    return list(zip(paths, signatures))
+
+def batch_verify(items: list[tuple], public_key_path: str, workers: int = None) -> list[tuple]:
+    """Verify many (path, signature) pairs with one public key
+
+    Verifying with the public exponent is cheap, so files are hashed and verified on a thread pool.
+
+    Args:
+        items (list[tuple]): (path, signature) pairs to verify
+        public_key_path (str): path to the PEM public key
+        workers (int): number of threads
+
+    Returns:
+        list[tuple]: (path, is_valid) in the order of items
+    """
+    verifier = pkcs1_15.new(load_public_key(public_key_path))
+
+    def verify(item):
+        path, signature = item
+        try:
+            verifier.verify(hash_stream(path), signature)
+            return path, True
+        except (ValueError, TypeError, OSError): # an unreadable file is not valid
+            return path, False
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(verify, items))
+
+def batch_main(args) -> None:
+    """--batch mode of the command line interface"""
+    from hash_file_verification import collect_files
+
+    if args.sign == args.verify:
+        print("You must specify either --sign or --verify.")
+        return
+    key_path = args.private_key if args.sign else args.public_key
+    if not key_path or not os.path.exists(key_path):
+        print("You must provide an existing private key file for signing or public key file for verification.")
+        return
+    for path in args.batch:
+        if not os.path.exists(path):
+            print(f"{path} does not exist.")
+            return
+
+    paths = [path for path in collect_files(args.batch) if not path.endswith(".sig")]
+    if args.sign:
+        failed = 0
+        for path, signature in batch_sign(paths, key_path, args.workers):
+            if signature is None:
+                failed += 1
+                print(f"{path}: could not be read")
+                continue
+            try:
+                with open(path + ".sig", "wb") as f:
+                    f.write(signature)
+            except OSError as e:
+                failed += 1
+                print(f"{path}: the signature could not be written ({e.strerror})")
+        print(f"{len(paths) - failed}/{len(paths)} files signed.")
+        if failed:
+            sys.exit(1)
+        return
+
+    items = []
+    for path in paths:
+        if not os.path.exists(path + ".sig"):
+            print(f"{path}: no signature")
+            continue
+        with open(path + ".sig", "rb") as f:
+            items.append((path, f.read()))
+    invalid = 0
+    for path, is_valid in batch_verify(items, key_path, args.workers):
+        if not is_valid:
+            invalid += 1
+            print(f"{path}: signature is invalid")
+    print(f"{len(items) - invalid}/{len(items)} signatures are valid.")
+
 def main():
     parser = argparse.ArgumentParser(description="RSA Sign and Verify")
     parser.add_argument("-g", "--generate",action="store_true" , help="Generate RSA key pair")
@@ -106,8 +376,13 @@ def main():
     parser.add_argument("-pub_k", "--public_key", type=str, help="Key file for verifying")
     parser.add_argument("-priv_k", "--private_key", type=str, help="Key file for signing")
     parser.add_argument("-o", "--output", type=str, help="Output file for the signature")
+    parser.add_argument("--digest", action="store_true", help="The input is a hex SHA256 digest computed elsewhere")
+    parser.add_argument("--batch", nargs="+", type=str, help="Files or folders to sign or verify, signatures are the <file>.sig files")
+    parser.add_argument("-w", "--workers", type=int, help="Number of workers used by the batch mode")
+    profiling.add_arguments(parser)
     
     args = parser.parse_args()
+    profiling.start(args)
     
     if args.generate:
         # Generate RSA key pair if requested
@@ -116,6 +391,11 @@ def main():
         print("RSA key pair generated and saved as 'private_key.pem' and 'public_key.pem'.")
         return
     
+    if args.batch:
+        with profiling.phase("transform", hot=True):
+            batch_main(args)
+        return
+
     # verify the arguments
     if not args.input:
         print("You must provide an input file to sign or verify.")
@@ -136,12 +416,21 @@ def main():
         print("The public key file does not exist.")
         return
     
-    # check if the input file exists
-    if not os.path.exists(args.input):
-        message = args.input.encode()
+    # check if the input file exists, files are streamed instead of being read in memory
+    if args.digest:
+        try:
+            digest = bytes.fromhex(args.input)
+        except ValueError:
+            print("The digest must be in hexadecimal.")
+            return
+        if len(digest) != SHA256.digest_size:
+            print("The digest must be a SHA256 digest (64 hex characters).")
+            return
+    elif not os.path.exists(args.input):
+        digest = SHA256.new(args.input.encode()).digest()
     else:
-        with open(args.input, "rb") as f:
-            message = f.read()
+        with profiling.phase("load input", hot=True): # the file is hashed while it is read
+            digest = hash_stream(args.input).digest()
     
     # import the signature
     if args.signature:
@@ -152,16 +441,25 @@ def main():
                 signature = f.read()
     
     
-    SIGNER = Signer()
-    SIGNER.import_key(private_key_path=args.private_key, public_key_path=args.public_key)
+    # a running daemon keeps the keys imported, else they are imported here
+    if args.sign:
+        result = daemon_client.try_call("rsa.sign", {"private_key": os.path.abspath(args.private_key), "digest": digest.hex()})
+    else:
+        result = daemon_client.try_call("rsa.verify", {"public_key": os.path.abspath(args.public_key), "digest": digest.hex(), "signature": signature.hex()})
+    if result is None:
+        SIGNER = Signer()
+        with profiling.phase("load key"):
+            SIGNER.import_key(private_key_path=args.private_key, public_key_path=args.public_key)
     if args.sign:
-        signature = SIGNER.sign_message(message)
+        with profiling.phase("transform", hot=True):
+            signature = bytes.fromhex(result["signature"]) if result else SIGNER.sign_digest(digest)
         if args.output:
-            with open(args.output, "wb") as f:
+            with profiling.phase("write output"), open(args.output, "wb") as f:
                 f.write(signature)
         print(f"Signature: {signature.hex()}")
     elif args.verify:
-        is_valid = SIGNER.verify(message, signature)
+        with profiling.phase("transform", hot=True):
+            is_valid = result["valid"] if result else SIGNER.verify_digest(digest, signature)
         if is_valid:
             print("Signature is valid.")
         else:
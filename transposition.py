@@ -2,9 +2,8 @@
 # imports
 import argparse
 import os
-import numpy as np
 from colorama import Fore, Style
-import doctest
+import profiling
 
 # define
 def table_transpose(text:str, n:int, verbose:bool=False) -> str:
@@ -27,12 +26,11 @@ def table_transpose(text:str, n:int, verbose:bool=False) -> str:
     """
     if len(text) % n != 0: # the text must be a multiple of n, if not we add spaces
         text += " " * (n - len(text) % n)
-    table = np.array([list(text[i:i+n]) for i in range(0, len(text), n)])
-    if verbose: print(table)
+    columns = [text[i::n] for i in range(n)] # the column i of the table is every n-th character from i
+    if verbose: print("\n".join(" ".join(text[i:i+n]) for i in range(0, len(text), n)))
     if verbose: print("transposed:")
-    if verbose: print(table.T)
-    table = ''.join(table.T.flatten())
-    return table
+    if verbose: print("\n".join(" ".join(column) for column in columns))
+    return ''.join(columns)
 
 def error(message: str) -> None:
     print(Fore.RED + Style.BRIGHT + message + Style.RESET_ALL)
@@ -50,9 +48,11 @@ def main():
     argument_parser.add_argument("-e", action="store_true", help="Encode")
     argument_parser.add_argument("-d", action="store_true", help="Decode")
     argument_parser.add_argument("-v", '--verbose', action="store_true", help="Verbose mode")
+    profiling.add_arguments(argument_parser)
 
     # Parse the arguments
     args = argument_parser.parse_args()
+    profiling.start(args)
 
     # Check the arguments
     if not args.i:
@@ -74,23 +74,25 @@ def main():
         indicator("file input detected...")
         if not os.path.exists(args.i):
             error("The file does not exist")
-        with open(args.i, "r") as file:
+        with profiling.phase("load input"), open(args.i, "r") as file:
             text = file.read()
     else:
         text = args.i
     
     """ --- --- --- --- --- Process the text  --- --- --- --- ---"""
     
-    output = table_transpose(text, args.K, args.verbose)
+    with profiling.phase("transform", hot=True):
+        output = table_transpose(text, args.K, args.verbose)
     
     # Print or save the output
     if args.print_only:
         print(f"'{output}'")
     else:
-        with open(args.o, "w") as file:
+        with profiling.phase("write output"), open(args.o, "w") as file:
             file.write(output)
             
 
 if __name__ == "__main__":
+    import doctest # only when run as a script, not when imported by pfs.py
     doctest.testmod()
     main()
\ No newline at end of file
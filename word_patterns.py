@@ -0,0 +1,449 @@
+from colorama import Fore, Style
+from collections import Counter, deque
+from checkpoint import Checkpoint, CHECKPOINT_INTERVAL
+from bisect import bisect_left
+import argparse
+import profiling
+import hashlib
+import struct
+import mmap
+import json
+import re
+import os
+
+"""
+Word-pattern dictionary attack on mono-alphabet ciphertexts
+
+A mono-alphabet cipher keeps the pattern of the letters of a word: "hello" and
+its ciphertext both have the pattern ABCCD. The pattern index maps each pattern
+of a dictionary to its words, the candidates of a cipher word are the words of
+its pattern. The solver picks a candidate for the cipher word with the fewest
+candidates, which fixes some letters of the key, and drops the candidates of
+the other words that contradict it (constraint propagation). A word without a
+consistent candidate is left unmatched (names, words missing from the
+dictionary). The search is a depth first branch and bound on the number of
+letters of the ciphertext covered by dictionary words, it solves the short
+messages that letter frequencies can't.
+
+The index is built once from a JSON dictionary (list of words, or dict of words
+like words_dictionary.json, the numbers of a dict of counts order the
+candidates) and mapped in memory: loading it costs an mmap, the lookups read
+the pages they need.
+
+Index file (little endian, uint32): header, pattern offsets (P + 1), first word
+of each pattern (P + 1), word offsets (W + 1), then the sorted patterns and the
+words grouped by pattern.
+
+A long search (large dictionary, --max-nodes in millions) can be checkpointed
+with --checkpoint: its position in the search tree and the best solution are
+saved every --checkpoint-interval seconds and on SIGTERM, the same command
+resumes it exactly where it stopped. The checkpoint of a search stopped at
+--max-nodes is kept, rerunning with a larger --max-nodes continues it.
+
+Usage:
+
+python word_patterns.py --build words_dictionary.json -o words.pat
+python word_patterns.py -i "ciphertext with its spaces" -x words.pat
+python word_patterns.py -i ciphertext.txt -x words.pat -o output.txt --max-nodes 1000000
+python word_patterns.py -i ciphertext.txt -x words.pat -o output.txt --max-nodes 50000000 --checkpoint search.ckpt
+"""
+
+alphabet = 'abcdefghijklmnopqrstuvwxyz'
+MAGIC = b"PFSWPAT1"
+HEADER = struct.Struct("<8sIIII") # magic, patterns, words, pattern bytes, word bytes
+MAX_NODES = 200000 # search nodes before the best solution found is returned
+
+def error(message: str) -> None:
+    print(Fore.RED + Style.BRIGHT + message + Style.RESET_ALL)
+    os._exit(1)
+
+def indicator(message: str) -> None:
+    print(Fore.GREEN + message + Style.RESET_ALL)
+
+def pattern(word: str) -> str:
+    """letter pattern of a word: each new letter gets the next capital
+
+    >>> pattern("hello"), pattern("attack"), pattern("xyz")
+    ('ABCCD', 'ABBACD', 'ABC')
+    """
+    letters = {}
+    return "".join(letters.setdefault(letter, chr(65 + len(letters))) for letter in word)
+
+#### Index
+
+def build_index(dictionary: dict, path: str) -> tuple:
+    """Write the pattern index of the words of a dictionary
+
+    Args:
+        dictionary (dict): word => count (or any value), the most frequent words are tried first
+        path (str): index file
+
+    Returns:
+        tuple: (patterns, words) written
+    """
+    import cipher_classifier
+    frequency = dict(zip(alphabet, cipher_classifier.ENGLISH.tolist()))
+    counts = {}
+    for word, count in dictionary.items():
+        word = word.lower()
+        if word.isascii() and word.isalpha():
+            count = count if isinstance(count, (int, float)) else 0
+            counts[word] = max(count, counts.get(word, count))
+
+    # without counts, the words made of frequent letters first
+    def order(word):
+        return (-counts[word], -sum(frequency[letter] for letter in word) / len(word), word)
+    groups = {}
+    for word in counts:
+        groups.setdefault(pattern(word), []).append(word)
+    patterns = sorted(groups)
+    pattern_offsets, first_words, word_offsets = [0], [0], [0]
+    pattern_blob, word_blob = bytearray(), bytearray()
+    for key in patterns:
+        pattern_blob += key.encode()
+        pattern_offsets.append(len(pattern_blob))
+        for word in sorted(groups[key], key=order):
+            word_blob += word.encode()
+            word_offsets.append(len(word_blob))
+        first_words.append(len(word_offsets) - 1)
+
+    temporary = path + ".tmp"
+    with open(temporary, "wb") as file:
+        file.write(HEADER.pack(MAGIC, len(patterns), len(counts), len(pattern_blob), len(word_blob)))
+        for table in (pattern_offsets, first_words, word_offsets):
+            file.write(struct.pack(f"<{len(table)}I", *table))
+        file.write(pattern_blob)
+        file.write(word_blob)
+    os.replace(temporary, path)
+    return len(patterns), len(counts)
+
+class PatternIndex:
+    """Pattern index mapped in memory
+
+    Raises:
+        ValueError: if the file is not a pattern index
+    """
+    def __init__(self, path: str):
+        with open(path, "rb") as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._map) < HEADER.size or self._map[:len(MAGIC)] != MAGIC:
+            self._map.close()
+            raise ValueError(f"{path} is not a pattern index, build it with --build")
+        _, self.patterns, self.words, pattern_bytes, word_bytes = HEADER.unpack_from(self._map)
+        view = memoryview(self._map)
+        offset = HEADER.size
+        tables = []
+        for size in (self.patterns + 1, self.patterns + 1, self.words + 1):
+            tables.append(view[offset:offset + 4 * size].cast("I")) # no copy, the pages are read on use
+            offset += 4 * size
+        self._pattern_offsets, self._first_words, self._word_offsets = tables
+        self._pattern_blob = view[offset:offset + pattern_bytes]
+        self._word_blob = view[offset + pattern_bytes:offset + pattern_bytes + word_bytes]
+        self._cache = {}
+
+    def _pattern(self, i: int) -> bytes:
+        return self._pattern_blob[self._pattern_offsets[i]:self._pattern_offsets[i + 1]].tobytes()
+
+    def candidates(self, key: str) -> tuple:
+        """words of a pattern, the most likely first"""
+        if key not in self._cache:
+            target = key.encode()
+            i = bisect_left(range(self.patterns), target, key=self._pattern)
+            words = ()
+            if i < self.patterns and self._pattern(i) == target:
+                offsets = self._word_offsets[self._first_words[i]:self._first_words[i + 1] + 1]
+                words = tuple(self._word_blob[start:end].tobytes().decode() for start, end in zip(offsets[:-1], offsets[1:]))
+            self._cache[key] = words
+        return self._cache[key]
+
+    def close(self) -> None:
+        self._cache.clear()
+        for view in (self._pattern_offsets, self._first_words, self._word_offsets, self._pattern_blob, self._word_blob):
+            view.release() # the map can't be closed while a view of it exists
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+#### Solver
+
+def _consistent(cipher: str, word: str, to_plain: dict, to_cipher: dict) -> bool:
+    """the word fits the letters of the key fixed so far"""
+    for c, p in zip(cipher, word):
+        bound = to_plain.get(c)
+        if bound is None:
+            if p in to_cipher:
+                return False
+        elif bound != p:
+            return False
+    return True
+
+class _Search:
+    """depth first branch and bound over the cipher words
+
+    The domain of a cipher word is the set of the indexes of its candidates that fit the key so far.
+    Fixing a letter intersects it with the candidates having that letter at its positions.
+
+    The search is deterministic: its position is the branch taken at each depth of the tree (the
+    index of the candidate, the number of candidates for the word left unmatched). A checkpoint keeps
+    that path with the best solution, the resumed search replays it and skips the branches before.
+    """
+    def __init__(self, candidates: dict, weights: dict, max_nodes: int, checkpoint=None, cancelled=None, on_improve=None):
+        self.candidates = candidates # cipher word => candidate words, the most likely first
+        self.weights = weights # cipher word => letters of the ciphertext it covers
+        self.max_nodes = max_nodes
+        self.checkpoint = checkpoint
+        self.cancelled = cancelled # returns True when the search must stop (deadline, user)
+        self.on_improve = on_improve # called with the key and the score of each better solution
+        self.nodes = 0
+        self.best_score = -1
+        self.best_key = {}
+        self.best_words = {}
+        self.stopped = False # stop requested (signal or cancelled), the checkpoint is saved
+        self._positions = {}
+        self._path = [] # branch taken at each depth above the current node
+        self._resume = deque() # branches of the interrupted search still to replay
+
+    def state(self) -> dict:
+        """position and best solution of the search, for a checkpoint"""
+        path = self._path + list(self._resume)
+        return {"path": path, "nodes": self.nodes - len(path) - 1, "best_score": self.best_score,
+                "best_key": self.best_key, "best_words": self.best_words}
+
+    def restore(self, state: dict) -> None:
+        """continue from the state of an interrupted search"""
+        self._resume = deque(state["path"])
+        self.nodes = state["nodes"] # the replayed nodes are counted again
+        self.best_score, self.best_key, self.best_words = state["best_score"], state["best_key"], state["best_words"]
+
+    def _having(self, cipher: str, position: int) -> dict:
+        """plain letter => indexes of the candidates of a cipher word with that letter at a position"""
+        if (cipher, position) not in self._positions:
+            having = {}
+            for i, word in enumerate(self.candidates[cipher]):
+                having.setdefault(word[position], set()).add(i)
+            self._positions[cipher, position] = having
+        return self._positions[cipher, position]
+
+    def run(self, domains: dict, to_plain: dict, to_cipher: dict, chosen: dict, score: int) -> None:
+        self.nodes += 1
+        if score > self.best_score:
+            self.best_score, self.best_key, self.best_words = score, dict(to_plain), dict(chosen)
+            if self.on_improve is not None:
+                self.on_improve(self.best_key, score)
+        if self.cancelled is not None and self.cancelled():
+            self.stopped = True
+        if self.checkpoint is not None and (self.checkpoint.due() or self.nodes >= self.max_nodes or self.stopped):
+            self.checkpoint.save(self.state()) # at max_nodes too: a larger --max-nodes continues from here
+            self.stopped = self.stopped or self.checkpoint.stop_requested
+        if self.stopped or self.nodes >= self.max_nodes:
+            return
+        start = self._resume.popleft() if self._resume else 0
+        if not domains or score + sum(self.weights[word] for word in domains) <= self.best_score:
+            # no word left, or even matching every word can't do better
+            self._resume.clear() # a resumed search can prune earlier with the best solution restored
+            return
+        # the most constrained word first, the longest on ties
+        cipher = min(domains, key=lambda word: (len(domains[word]), -len(word)))
+        rest = {word: domain for word, domain in domains.items() if word != cipher}
+        candidates = self.candidates[cipher]
+        branches = sorted(domains[cipher])
+        for branch in range(start, len(branches)):
+            word = candidates[branches[branch]]
+            # the domains only follow the cipher letters, a plain letter can be taken by another one
+            if not _consistent(cipher, word, to_plain, to_cipher):
+                continue
+            new = dict((c, p) for c, p in zip(cipher, word) if c not in to_plain)
+            for c, p in new.items():
+                to_plain[c], to_cipher[p] = p, c
+            # propagation: the candidates of the words sharing a new letter must have it at its positions
+            narrowed = {}
+            for other, domain in rest.items():
+                for position, letter in enumerate(other):
+                    if letter in new:
+                        # a table of a large dictionary takes ms to build
+                        if (other, position) not in self._positions and self.cancelled is not None and self.cancelled():
+                            self.stopped = True
+                            break
+                        domain = domain & self._having(other, position).get(new[letter], set())
+                        if not domain:
+                            break
+                if self.stopped:
+                    break
+                if domain:
+                    narrowed[other] = domain
+            if self.stopped:
+                if self.checkpoint is not None:
+                    self._path.append(branch) # resumes with this branch
+                    self.checkpoint.save(self.state())
+                    self._path.pop()
+                for c, p in new.items():
+                    del to_plain[c], to_cipher[p]
+                return
+            chosen[cipher] = word
+            self._path.append(branch)
+            self.run(narrowed, to_plain, to_cipher, chosen, score + self.weights[cipher])
+            self._path.pop()
+            del chosen[cipher]
+            for c, p in new.items():
+                del to_plain[c], to_cipher[p]
+            if self.stopped or self.nodes >= self.max_nodes:
+                return
+        self._path.append(len(branches))
+        self.run(rest, to_plain, to_cipher, chosen, score) # the word is not in the dictionary
+        self._path.pop()
+
+def decode(text: str, to_plain: dict, unknown: str = "_") -> str:
+    """decode with a partial key (cipher letter => plain letter), the letters not found are replaced by unknown"""
+    return "".join(to_plain.get(letter, unknown) if letter in alphabet else letter for letter in text.lower())
+
+def key_alphabet(to_plain: dict, unknown: str = "_") -> str:
+    """the partial key in the format of mono_alphabet_cipher.py (the cipher letter of a, b, c...)"""
+    to_cipher = {p: c for c, p in to_plain.items()}
+    return "".join(to_cipher.get(letter, unknown) for letter in alphabet)
+
+def search_identity(text: str, index: PatternIndex) -> dict:
+    """what a checkpoint of the search depends on: the ciphertext and the index (not max_nodes)"""
+    return {"search": "word_patterns", "text": hashlib.sha256(text.lower().encode()).hexdigest(),
+            "index": [index.patterns, index.words]}
+
+def solve(text: str, index: PatternIndex, max_nodes: int = MAX_NODES, checkpoint=None, cancelled=None, on_improve=None) -> dict:
+    """Break a mono-alphabet ciphertext that kept its word boundaries
+
+    Args:
+        checkpoint (checkpoint.Checkpoint): resume the search from it and save it periodically,
+            it is removed once the search is complete
+        cancelled (callable): returns True to stop the search, the best solution so far is returned
+        on_improve (callable): called with the key (mono_alphabet_cipher format) and the coverage of
+            each better solution, as soon as the search finds it
+
+    Returns:
+        dict: key (mono_alphabet_cipher format, _ for the letters not found), text, matched (cipher words
+        found in the dictionary), words, coverage (share of the letters covered), nodes, complete
+        (False if the search stopped at max_nodes, on a signal or cancelled) and stopped (signal or cancelled)
+
+    Raises:
+        ValueError: if the checkpoint belongs to another search
+
+    >>> import tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), "words.pat")
+    >>> words = "attack the hill at dawn and tall hall lit ten"
+    >>> build_index({word: 1 for word in words.split()}, path)
+    (5, 10)
+    >>> with PatternIndex(path) as index:
+    ...     solve("zggzxp gsv sroo zg wzdm", index)["text"]
+    'attack the hill at dawn'
+    """
+    occurrences = Counter(re.findall(f"[{alphabet}]+", text.lower()))
+    weights = {word: count * len(word) for word, count in occurrences.items()}
+    candidates = {word: index.candidates(pattern(word)) for word in weights}
+    domains = {word: set(range(len(words))) for word, words in candidates.items() if words}
+    total = sum(weights.values())
+    if on_improve is not None:
+        improved = on_improve
+        def on_improve(to_plain, score):
+            improved(key_alphabet(to_plain), round(score / total, 3) if total else 0.0)
+    search = _Search(candidates, weights, max_nodes, checkpoint, cancelled, on_improve)
+    if checkpoint is not None:
+        state = checkpoint.load()
+        if state is not None:
+            search.restore(state)
+    search.run(domains, {}, {}, {}, 0)
+    complete = not search.stopped and search.nodes < max_nodes
+    if checkpoint is not None and complete:
+        checkpoint.remove()
+    return {"key": key_alphabet(search.best_key), "text": decode(text, search.best_key),
+            "matched": sum(occurrences[word] for word in search.best_words), "words": sum(occurrences.values()),
+            "coverage": round(search.best_score / total, 3) if total else 0.0, "nodes": search.nodes,
+            "complete": complete, "stopped": search.stopped}
+
+def load_dictionary(path: str) -> dict:
+    """word => count of a JSON dictionary (a list of words counts 1 for each)"""
+    with open(path, "r") as file:
+        words = json.load(file)
+    return words if isinstance(words, dict) else {word: 1 for word in words}
+
+def main():
+    argument_parser = argparse.ArgumentParser(description="Word-pattern dictionary attack on mono-alphabet ciphertexts")
+    argument_parser.add_argument("-i", type=str, help="Ciphertext (or a .txt file)")
+    argument_parser.add_argument("-x", type=str, help="Pattern index built with --build")
+    argument_parser.add_argument("-o", type=str, help="Output file (the index with --build)")
+    argument_parser.add_argument("--build", type=str, metavar="DICTIONARY", help="Build the pattern index of a JSON dictionary")
+    argument_parser.add_argument("--max-nodes", type=int, default=MAX_NODES, help="Search nodes before the best solution is returned")
+    argument_parser.add_argument("--checkpoint", type=str, help="Save the search to this file and resume from it")
+    argument_parser.add_argument("--checkpoint-interval", type=float, default=CHECKPOINT_INTERVAL, help="Seconds between two checkpoints")
+    argument_parser.add_argument("--print-only", action="store_true", help="Print the output only")
+    profiling.add_arguments(argument_parser)
+
+    args = argument_parser.parse_args()
+    profiling.start(args)
+
+    if args.build:
+        if not os.path.exists(args.build):
+            error("The dictionary does not exist")
+        if not args.o:
+            error("You must provide the index file with the -o option")
+        with profiling.phase("load dictionary"):
+            dictionary = load_dictionary(args.build)
+        with profiling.phase("transform", hot=True):
+            patterns, words = build_index(dictionary, args.o)
+        indicator(f"{words} words in {patterns} patterns written to {args.o}")
+        return
+
+    if not args.i:
+        error("You must provide a ciphertext with the -i option")
+    if not args.x or not os.path.exists(args.x):
+        error("You must provide an existing pattern index with the -x option")
+    if not args.o and not args.print_only:
+        error("You must provide an output file name with the -o option")
+    if args.max_nodes < 1:
+        error("The number of nodes must be positive")
+    if args.checkpoint_interval <= 0:
+        error("The checkpoint interval must be positive")
+    if str(args.i).split(".")[-1] == "txt":
+        if not os.path.exists(args.i):
+            error("The file does not exist")
+        with profiling.phase("load input"), open(args.i, "r", encoding='UTF-8') as file:
+            text = file.read()
+    else:
+        text = args.i
+
+    try:
+        with profiling.phase("load dictionary"):
+            index = PatternIndex(args.x)
+    except ValueError as e:
+        error(str(e))
+    checkpoint = None
+    if args.checkpoint:
+        checkpoint = Checkpoint(args.checkpoint, args.checkpoint_interval, search_identity(text, index))
+        checkpoint.stop_on_signal()
+        if os.path.exists(args.checkpoint):
+            indicator(f"Resuming the search from {args.checkpoint}")
+    try:
+        with index, profiling.phase("transform", hot=True):
+            result = solve(text, index, args.max_nodes, checkpoint)
+    except ValueError as e:
+        error(str(e))
+
+    if result["stopped"]:
+        stopped = " (stopped, resume with the same command)"
+    elif not result["complete"]:
+        stopped = f" (stopped at --max-nodes{', a larger one resumes from the checkpoint' if checkpoint else ''})"
+    else:
+        stopped = ""
+    indicator(f"{result['matched']}/{result['words']} words found, {result['coverage']:.0%} of the letters, "
+              f"{result['nodes']} nodes{stopped}")
+    if checkpoint is not None and checkpoint.writes:
+        indicator(f"{checkpoint.writes} checkpoints written, {checkpoint.overhead():.2%} of the time")
+    print(f"key: {result['key']}")
+    if args.print_only:
+        print(result["text"])
+    else:
+        with profiling.phase("write output"), open(args.o, "w") as file:
+            file.write(result["text"])
+
+if __name__ == "__main__":
+    main()